@@ -0,0 +1,103 @@
+#!/usr/bin/python -uB
+
+"""
+	GL call dispatch benchmark.
+	Reports calls/second for a few per-frame GL calls through opengl.gl in
+	"checked" mode (PyOpenGL wrappers, error checking included) and in "fast"
+	mode (driver entry points through ctypes).
+	Draws are of 0 elements, so that the driver returns right away and what's
+	measured is the cost of getting there.
+
+	Needs a GL 4.5 context. Headless machines can use
+		SDL_VIDEODRIVER=offscreen PYOPENGL_PLATFORM=egl
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+import celeritas.uio as uio
+import celeritas.opengl as opengl
+from OpenGL.GL import *
+
+
+
+CALLS = 200000
+
+VERTEX_SHADER = """
+	#version 450 core
+	layout (location = 0) in vec2 position;
+	uniform vec4 rgba;
+	out vec4 color;
+	void main() {
+		gl_Position = vec4(position, 0.0, 1.0);
+		color = rgba;
+	}
+"""
+
+FRAGMENT_SHADER = """
+	#version 450 core
+	in vec4 color;
+	out vec4 frag_color;
+	void main() {
+		frag_color = color;
+	}
+"""
+
+
+
+def measure(call):
+	# timeit's loop keeps its own overhead out of the way
+	elapsed = min(timeit.repeat(call, number = CALLS, repeat = 3))
+	return (CALLS / elapsed)
+
+
+
+def main():
+	window = uio.AppWindow(w = 64, h = 64, visible = False, title = b"bench_gl_dispatch", swap_interval = uio.SWAP_INTERVAL_OFF)
+
+	program = opengl.build_program({GL_VERTEX_SHADER: VERTEX_SHADER, GL_FRAGMENT_SHADER: FRAGMENT_SHADER})
+	mesh = opengl.Mesh(
+		numpy.array([(-1.0, -1.0), (1.0, -1.0), (-1.0, 1.0)], dtype = numpy.float32),
+		numpy.array([0, 1, 2], dtype = numpy.uint32)
+	)
+	rgba_location = program.uniforms["rgba"].location
+	rgba = numpy.array([1.0, 0.5, 0.25, 1.0], dtype = numpy.float32)
+	rgba_pointer = opengl.buffer_pointer(rgba)
+
+	gl = opengl.gl
+	glUseProgram(program.gl_id)
+	glBindVertexArray(mesh.vertex_array)
+
+	calls = (
+		("glUseProgram", lambda: gl.glUseProgram(program.gl_id)),
+		("glBindVertexArray", lambda: gl.glBindVertexArray(mesh.vertex_array)),
+		("glUniform4f", lambda: gl.glUniform4f(rgba_location, 1.0, 0.5, 0.25, 1.0)),
+		("glProgramUniform4fv", lambda: gl.glProgramUniform4fv(program.gl_id, rgba_location, 1, rgba_pointer)),
+		("glDrawElements", lambda: gl.glDrawElements(GL_TRIANGLES, 0, GL_UNSIGNED_INT, None))
+	)
+
+	results = {}
+	for mode in (opengl.GL_DISPATCH_CHECKED, opengl.GL_DISPATCH_FAST):
+		gl.use(mode)
+		for (c_name, call) in calls:
+			results[(c_name, mode)] = measure(call)
+		glFinish()
+
+	print("%-22s %16s %16s %10s" % ("call", "checked calls/s", "fast calls/s", "speedup"))
+	for (c_name, call) in calls:
+		(checked, fast) = (results[(c_name, opengl.GL_DISPATCH_CHECKED)], results[(c_name, opengl.GL_DISPATCH_FAST)])
+		print("%-22s %16.0f %16.0f %9.1fx" % (c_name, checked, fast, (fast / checked)))
+
+	gl.use(opengl.GL_DISPATCH_CHECKED)
+	mesh.release()
+	program.delete()
+	window = None
+	return 0
+
+
+
+exit(main())
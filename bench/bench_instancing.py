@@ -0,0 +1,151 @@
+#!/usr/bin/python -uB
+
+"""
+	Instanced drawing benchmark.
+	Draws N colored quads per frame, as N glDrawElements() calls with the
+	per-quad values set as uniforms, and as one opengl.InstancedBatch draw.
+	Reports milliseconds per frame, glFinish() included, so that it counts
+	both the CPU time spent submitting and the GPU time.
+
+	Needs a GL 4.5 context. Headless machines can use
+		SDL_VIDEODRIVER=offscreen PYOPENGL_PLATFORM=egl
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+import celeritas.uio as uio
+import celeritas.opengl as opengl
+from OpenGL.GL import *
+
+
+
+INSTANCE_COUNTS = (1000, 10000, 100000)
+# the draw loop runs for at least this many quads per measurement...
+MIN_QUADS = 200000
+# ...and this many frames
+MIN_FRAMES = 3
+
+QUAD_VERTICES = numpy.array([
+	(-1.0, -1.0), (1.0, -1.0), (-1.0, 1.0), (1.0, 1.0)
+], dtype = numpy.float32)
+QUAD_INDICES = numpy.array([0, 1, 3, 3, 2, 0], dtype = numpy.uint32)
+
+QUAD_INSTANCE = numpy.dtype([
+	("offset", numpy.float32, (2, )),
+	("scale", numpy.float32),
+	("rgba", numpy.uint8, (4, ))
+])
+
+FRAGMENT_SHADER = """
+	#version 450 core
+	in vec4 quad_rgba;
+	out vec4 color;
+	void main() {
+		color = quad_rgba;
+	}
+"""
+
+UNIFORM_VERTEX_SHADER = """
+	#version 450 core
+	layout (location = 0) in vec2 position;
+	uniform vec2 offset;
+	uniform float scale;
+	uniform vec4 rgba;
+	out vec4 quad_rgba;
+	void main() {
+		gl_Position = vec4(offset + (position * scale), 0.0, 1.0);
+		quad_rgba = rgba;
+	}
+"""
+
+INSTANCED_VERTEX_SHADER = """
+	#version 450 core
+	layout (location = 0) in vec2 position;
+	layout (location = 1) in vec2 offset;
+	layout (location = 2) in float scale;
+	layout (location = 3) in vec4 rgba;
+	out vec4 quad_rgba;
+	void main() {
+		gl_Position = vec4(offset + (position * scale), 0.0, 1.0);
+		quad_rgba = rgba;
+	}
+"""
+
+
+
+def make_instances(count):
+	instances = numpy.zeros(count, dtype = QUAD_INSTANCE)
+	random = numpy.random.RandomState(count)
+	instances["offset"] = random.uniform(-1.0, 1.0, (count, 2))
+	instances["scale"] = 0.005
+	instances["rgba"] = random.randint(0, 256, (count, 4))
+	return instances
+
+
+def measure(draw_frame, quads):
+	frames = max(MIN_FRAMES, MIN_QUADS // quads)
+	draw_frame()
+	glFinish()
+	t_start = timeit.default_timer()
+	for f_n in range(frames):
+		glClear(GL_COLOR_BUFFER_BIT)
+		draw_frame()
+		glFinish()
+	return ((timeit.default_timer() - t_start) * 1000.0 / frames)
+
+
+
+def main():
+	window = uio.AppWindow(w = 512, h = 512, visible = False, title = b"bench_instancing", swap_interval = uio.SWAP_INTERVAL_OFF)
+
+	builder = opengl.ProgramBuilder()
+	builder.add({GL_VERTEX_SHADER: UNIFORM_VERTEX_SHADER, GL_FRAGMENT_SHADER: FRAGMENT_SHADER}, "uniforms")
+	builder.add({GL_VERTEX_SHADER: INSTANCED_VERTEX_SHADER, GL_FRAGMENT_SHADER: FRAGMENT_SHADER}, "instanced")
+	(program_uniforms, program_instanced) = builder.build()
+
+	batch = opengl.InstancedBatch(QUAD_VERTICES, QUAD_INDICES, QUAD_INSTANCE, normalized = ("rgba", ))
+
+	(offset_location, scale_location, rgba_location) = (
+		program_uniforms.uniforms[u_name].location for u_name in ("offset", "scale", "rgba")
+	)
+
+	print("%10s %16s %16s %10s" % ("instances", "draw loop ms", "instanced ms", "speedup"))
+	for count in INSTANCE_COUNTS:
+		instances = make_instances(count)
+		# what the loop would get from the scene: Python values, not arrays
+		quads = [
+			(float(i_o[0]), float(i_o[1]), float(i_s), tuple((float(c) / 255.0) for c in i_c))
+			for (i_o, i_s, i_c) in zip(instances["offset"], instances["scale"], instances["rgba"])
+		]
+
+		def draw_loop():
+			glUseProgram(program_uniforms.gl_id)
+			glBindVertexArray(batch.mesh.vertex_array)
+			for (x, y, scale, rgba) in quads:
+				glUniform2f(offset_location, x, y)
+				glUniform1f(scale_location, scale)
+				glUniform4f(rgba_location, *rgba)
+				glDrawElements(GL_TRIANGLES, batch.mesh.index_count, GL_UNSIGNED_INT, None)
+
+		def draw_instanced():
+			glUseProgram(program_instanced.gl_id)
+			batch.draw(instances)
+
+		loop_ms = measure(draw_loop, count)
+		instanced_ms = measure(draw_instanced, count)
+		print("%10d %16.2f %16.2f %9.1fx" % (count, loop_ms, instanced_ms, (loop_ms / instanced_ms)))
+
+	batch.release()
+	program_uniforms.delete()
+	program_instanced.delete()
+	window = None
+	return 0
+
+
+
+exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/python -uB
+
+"""
+	Texture loading benchmark.
+	Loads a set of generated BMP images as textures, once synchronously
+	(decode and upload on the main thread, one after the other) and once
+	through textures.TextureLoader, calling update() once per simulated frame.
+	Reports the total time and the longest the main thread was held up in one
+	go, which is what shows up as a hitch.
+
+	Needs a GL 4.5 context. Headless machines can use
+		SDL_VIDEODRIVER=offscreen PYOPENGL_PLATFORM=egl
+"""
+import os
+import sys
+import shutil
+import timeit
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+import sdl2
+
+import celeritas.uio as uio
+import celeritas.opengl as opengl
+import celeritas.textures as textures
+from OpenGL.GL import *
+
+
+
+IMAGE_COUNT = 64
+IMAGE_SIZE = 512
+UPLOAD_BUDGET = (4 << 20)
+
+
+
+def write_images(directory):
+	paths = []
+	random = numpy.random.RandomState(0)
+	for i_n in range(IMAGE_COUNT):
+		surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, IMAGE_SIZE, IMAGE_SIZE, 32, sdl2.SDL_PIXELFORMAT_RGBA32)
+		pixels = numpy.ctypeslib.as_array(
+			(sdl2.Uint8 * (surface.contents.pitch * IMAGE_SIZE)).from_address(surface.contents.pixels)
+		)
+		pixels[:] = random.randint(0, 256, pixels.size)
+		path = os.path.join(directory, "%03d.bmp" % i_n)
+		sdl2.SDL_SaveBMP(surface, path.encode())
+		sdl2.SDL_FreeSurface(surface)
+		paths.append(path)
+	return paths
+
+
+def load_sync(paths):
+	(worst, loaded) = (0.0, [])
+	for path in paths:
+		t_start = timeit.default_timer()
+		pixels = textures.decode_image(path)
+		texture = opengl.Texture(pixels.shape[1], pixels.shape[0], GL_RGBA8, levels = 0)
+		texture.upload(pixels)
+		texture.generate_mipmaps()
+		glFinish()
+		worst = max(worst, (timeit.default_timer() - t_start))
+		loaded.append(texture)
+	for texture in loaded:
+		texture.release()
+	return worst
+
+
+def load_async(paths):
+	loader = textures.TextureLoader(upload_budget = UPLOAD_BUDGET)
+	(worst, frames) = (0.0, 0)
+	t_start = timeit.default_timer()
+	handles = [loader.load(path) for path in paths]
+	worst = (timeit.default_timer() - t_start)
+	while (loader.pending):
+		t_frame = timeit.default_timer()
+		loader.update()
+		glFinish()
+		worst = max(worst, (timeit.default_timer() - t_frame))
+		frames += 1
+	failed = len([handle for handle in handles if handle.failed])
+	loader.release()
+	return (worst, frames, failed)
+
+
+
+def main():
+	window = uio.AppWindow(w = 64, h = 64, visible = False, title = b"bench_texture_loader", swap_interval = uio.SWAP_INTERVAL_OFF)
+	directory = tempfile.mkdtemp(prefix = "bench_texture_loader")
+	try:
+		paths = write_images(directory)
+
+		t_start = timeit.default_timer()
+		sync_worst = load_sync(paths)
+		sync_total = timeit.default_timer() - t_start
+
+		t_start = timeit.default_timer()
+		(async_worst, frames, failed) = load_async(paths)
+		async_total = timeit.default_timer() - t_start
+	finally:
+		shutil.rmtree(directory)
+
+	print("%d images of %dx%d, %d bytes uploaded per frame at most" % (IMAGE_COUNT, IMAGE_SIZE, IMAGE_SIZE, UPLOAD_BUDGET))
+	print("%-14s %12s %18s %10s" % ("", "total ms", "longest stall ms", "frames"))
+	print("%-14s %12.1f %18.2f %10d" % ("synchronous", (sync_total * 1000.0), (sync_worst * 1000.0), 1))
+	print("%-14s %12.1f %18.2f %10d" % ("TextureLoader", (async_total * 1000.0), (async_worst * 1000.0), frames))
+	if (failed):
+		print("%d images failed to load" % (failed))
+
+	window = None
+	return 0
+
+
+
+exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/python -uB
+
+"""
+	Event object footprint benchmark.
+	Reports bytes per event and construction time per event for:
+		- the former dict based MouseMotionEvent, built through a chain of
+		  keyword super().__init__() calls (reproduced below, as it no longer exists)
+		- the slotted class built with keyword arguments
+		- the slotted class built through uio.new_event(), as the decoder does
+		- uio.new_event() recycling instances from the free list
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import celeritas.uio as uio
+
+
+
+EVENT_COUNT = 100000
+
+
+
+class LegacyEvent(object):
+	def __init__(self, event_type, timestamp):
+		self.sdl_type = event_type;
+		self.ts = timestamp;
+
+class LegacyWindowScopeEvent(LegacyEvent):
+	def __init__(self, event_type, timestamp, window_id):
+		super(LegacyWindowScopeEvent, self).__init__(event_type = event_type, timestamp = timestamp)
+		self.winid = window_id
+
+class LegacyMouseInputEvent(LegacyWindowScopeEvent):
+	def __init__(self, event_type, timestamp, window_id, mouse_id, buttons_mask, x, y):
+		super(LegacyMouseInputEvent, self).__init__(event_type = event_type, timestamp = timestamp, window_id = window_id)
+		(self.md_id, self._buttons_mask, self.x_abs, self.y_abs) = (mouse_id, buttons_mask, x, y)
+
+class LegacyMouseMotionEvent(LegacyMouseInputEvent):
+	def __init__(self, event_type, timestamp, window_id, mouse_id, buttons_mask, x, y, xrel, yrel):
+		super(LegacyMouseMotionEvent, self).__init__(
+			event_type = event_type, timestamp = timestamp, window_id = window_id,
+			mouse_id = mouse_id, buttons_mask = buttons_mask, x = x, y = y
+		)
+		(self.x_rel, self.y_rel) = (xrel, yrel)
+
+
+
+def build_legacy(e_n):
+	return LegacyMouseMotionEvent(
+		event_type = 1024, timestamp = e_n, window_id = 1, mouse_id = 0,
+		buttons_mask = 0, x = e_n, y = e_n, xrel = 1, yrel = 1
+	)
+
+def build_slotted(e_n):
+	return uio.MouseMotionEvent(
+		event_type = 1024, timestamp = e_n, window_id = 1, mouse_id = 0,
+		buttons_mask = 0, x = e_n, y = e_n, xrel = 1, yrel = 1
+	)
+
+def build_new_event(e_n):
+	return uio.new_event(uio.MouseMotionEvent, 1024, e_n, 1, 0, 0, e_n, e_n, 1, 1)
+
+
+
+def measure(build, recycle = False):
+	"""
+		Return:
+			(bytes per live event, nanoseconds per construction)
+	"""
+	# memory is traced in a separate run, tracing skews timings badly.
+	# Besides the object itself this counts the list slot and the non cached integers
+	tracemalloc.start()
+	events = [build(e_n) for e_n in range(EVENT_COUNT)]
+	mem_current = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	if (recycle):
+		# the timed round is then served entirely out of the free list
+		uio.release_events(events)
+	events = None
+
+	t_start = timeit.default_timer()
+	events = [build(e_n) for e_n in range(EVENT_COUNT)]
+	elapsed = timeit.default_timer() - t_start
+
+	return (float(mem_current) / EVENT_COUNT, (elapsed * 1e9) / EVENT_COUNT)
+
+
+
+def main():
+	print("%-32s %12s %12s" % ("construction", "bytes/event", "ns/event"))
+	for (b_name, build, recycle) in (
+		("dict + keyword super() chain", build_legacy, False),
+		("slots, keyword arguments", build_slotted, False),
+		("slots, new_event()", build_new_event, False),
+		("slots, new_event() pooled", build_new_event, True)
+	):
+		uio.pool_events = recycle
+		uio.EVENT_POOL_SIZE = EVENT_COUNT
+		uio.event_pools.clear()
+		print("%-32s %12.1f %12.1f" % ((b_name,) + measure(build, recycle)))
+	return 0
+
+
+
+exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/python -uB
+
+"""
+	Event drain micro-benchmark.
+	Compares the SDL_PollEvent() one-at-a-time loop against the batched
+	SDL_PeepEvents() drain in uio.poll_events(), with eagerly decoded and
+	with lazy events, in events/second.
+
+	Runs headless: synthetic mouse motion is pushed with SDL_PushEvent()
+	under the SDL dummy video driver and routed to a queue registered for a
+	fake window id. Every queued event then has its coordinates read, so
+	decoding, queueing and consuming are all part of the measurement, and
+	lazy events are paid for when they are looked at, as they would be
+"""
+import os
+import sys
+import ctypes
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sdl2 import *
+
+import celeritas.uio as uio
+
+
+
+BENCH_WINID = 1
+# SDL's own queue tops out at 65535 events
+EVENTS_PER_ROUND = 32768
+ROUNDS = 10
+
+# event ring for the lazy drain, holding a whole round
+lazy_ring = uio.EventRing(EVENTS_PER_ROUND)
+
+
+
+def push_motion(count):
+	event = SDL_Event()
+	event.type = SDL_MOUSEMOTION
+	event.motion.windowID = BENCH_WINID
+	for e_n in range(count):
+		event.motion.x = e_n & 1023
+		event.motion.y = e_n >> 10
+		event.motion.xrel = 1
+		event.motion.yrel = 1
+		if (SDL_PushEvent(ctypes.byref(event)) != 1):
+			raise uio.SDLException("SDL_PushEvent failed: %s" % (SDL_GetError()))
+
+
+def drain_polled():
+	""" What poll_events() used to do: one SDL_PollEvent() round trip per event """
+	event = SDL_Event()
+	while (SDL_PollEvent(ctypes.byref(event))):
+		uio.route_sdl_event(event)
+
+
+def drain_peeped():
+	uio.poll_events()
+
+
+def drain_lazy():
+	"""
+		Batched drain with the queue taking EventView objects instead of decoded ones.
+		The ring is as large as a round, so that no view is overwritten before it's read
+	"""
+	(ring, uio.event_ring) = (uio.event_ring, lazy_ring)
+	uio.windows_events[BENCH_WINID].lazy = True
+	try:
+		uio.poll_events()
+	finally:
+		uio.windows_events[BENCH_WINID].lazy = False
+		uio.event_ring = ring
+
+
+def consume():
+	""" Reads what a mouse motion consumer would from every queued event """
+	x_sum = 0
+	for event in uio.windows_events[BENCH_WINID].pop():
+		x_sum += event.x_abs + event.y_abs + event.x_rel + event.y_rel
+	return x_sum
+
+
+def measure(drain):
+	elapsed = 0.0
+	for r_n in range(ROUNDS):
+		push_motion(EVENTS_PER_ROUND)
+		t_start = timeit.default_timer()
+		drain()
+		consume()
+		elapsed += timeit.default_timer() - t_start
+		uio.windows_events[BENCH_WINID].clear()
+	return (EVENTS_PER_ROUND * ROUNDS) / elapsed
+
+
+
+def main():
+	if (SDL_Init(SDL_INIT_VIDEO) != 0):
+		raise uio.SDLException("SDL Initialization failed: `%s`" % (SDL_GetError()))
+
+	uio.windows_events[BENCH_WINID] = uio.EventQueue(capacity = EVENTS_PER_ROUND)
+
+	# the drained queue is left empty between runs
+	SDL_FlushEvents(SDL_FIRSTEVENT, SDL_LASTEVENT)
+
+	print("%-28s %14s" % ("drain", "events/s"))
+	for (d_name, drain) in (
+		("SDL_PollEvent loop", drain_polled),
+		("SDL_PeepEvents x%d" % uio.EVENT_BATCH_SIZE, drain_peeped),
+		("SDL_PeepEvents x%d, lazy" % uio.EVENT_BATCH_SIZE, drain_lazy)
+	):
+		print("%-28s %14.0f" % (d_name, measure(drain)))
+
+	del(uio.windows_events[BENCH_WINID])
+	SDL_Quit()
+	return 0
+
+
+
+exit(main())
@@ -2,6 +2,7 @@
 
 
 
+import os
 import sys
 import logging
 import time
@@ -32,6 +33,9 @@ import celeritas.info
 from celeritas.config import guc
 
 import celeritas.uio as uio
+import celeritas.scheduler
+import celeritas.profiler as profiler
+import celeritas.opengl
 
 
 
@@ -39,6 +43,9 @@ import celeritas.uio as uio
 
 APP_TITLE = b"Celeritas 0.0.0"
 
+# GLSL sources of the demo
+SHADER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shaders")
+
 
 
 logger = logging.getLogger(__name__)
@@ -50,6 +57,11 @@ def main():
 
 	celeritas.config.load()
 
+	# handlers below do not hold on to events
+	uio.pool_events = True
+
+	profiler.enable(guc["system"]["profiling"])
+
 
 	main_window = uio.AppWindow(
 		w = guc["video"]["resolution_x"],
@@ -59,9 +71,14 @@ def main():
 			celeritas.info.APP_MAJOR,
 			celeritas.info.APP_MINOR,
 			celeritas.info.APP_REVISION
-		))
+		)),
+		# everything we care about goes through handlers
+		queue_events = False
 	)
 
+	# GPU timings are only worth their queries when someone is looking at them
+	gl_context = celeritas.opengl.Context(gpu_timing = guc["system"]["profiling"])
+
 	print("Vendor:          %s" % (glGetString(GL_VENDOR)))
 	print("Opengl version:  %s" % (glGetString(GL_VERSION)))
 	print("GLSL Version:    %s" % (glGetString(GL_SHADING_LANGUAGE_VERSION)))
@@ -72,7 +89,7 @@ def main():
 
 
 	print("Creating OpenGL viewport")
-	glViewport(0, 0, guc["video"]["resolution_x"], guc["video"]["resolution_y"])
+	gl_context.viewport(0, 0, guc["video"]["resolution_x"], guc["video"]["resolution_y"])
 
 	#glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 	#glEnable(GL_DEPTH_TEST)
@@ -80,217 +97,148 @@ def main():
 	#glEnable(GL_BLEND)
 
 
-	print("Creating vertex shader")
-	shader_v_main = glCreateShader(GL_VERTEX_SHADER)
-	print("Preparing vertex shader source")
-	glShaderSource(
-		shader_v_main,
-		"""
-			#version 450 core
-			layout (location = 0) in vec3 vertex_offset;
-
-			uniform vec2 crosshair_position;
-
-
-			void main() {
-				gl_Position = vec4(
-					crosshair_position.x + (vertex_offset.x * (1.0 - abs(crosshair_position.x))),
-					crosshair_position.y + (vertex_offset.y * (1.0 - abs(crosshair_position.y))),
-					vertex_offset.z,
-					1.0
-				);
-			}
-		"""
-	)
-	print("Compiling vertex shader")
-	glCompileShader(shader_v_main)
-	if (not glGetShaderiv(shader_v_main, GL_COMPILE_STATUS)):
-		print("Shader compilation failed. Error: `%s`" % glGetShaderInfoLog(shader_v_main))
-		return 5
-
-
-	print("Creating fragment shader")
-	shader_f_main = glCreateShader(GL_FRAGMENT_SHADER)
-	print("Preparing fragment shader source")
-	glShaderSource(
-		shader_f_main,
-		"""
-			#version 450 core
-
-			uniform vec4 obj_rgba;
-			uniform vec2 crosshair_position;
-
-			out vec4 color;
-
-			float distance;
-
-			void main()	{
-				distance = pow(pow(abs(crosshair_position.x), 2.0) + pow(abs(crosshair_position.y), 2.0), 0.5) / 1.414213562;
-				//distance = (abs.crosshair_position.x ** 2);
-				//color = obj_rgba;
-				color = vec4(1.0, 1.0, 1.0, 1.0);
-				color = vec4((1 - distance), distance, 0.0, obj_rgba.w);
-				//color = vec4((1 - abs(crosshair_position.x)), (1 - abs(crosshair_position.x)), abs(crosshair_position.x), 1.0);
-			}
-		"""
+	print("Building shader programs")
+	shader_manager = celeritas.opengl.ShaderManager(
+		cache = celeritas.opengl.ProgramCache(guc["system"]["config_dir"] + "/" + celeritas.opengl.PROGRAM_CACHE_DIR),
+		watch = guc["system"]["shader_reload"]
 	)
-	print("Compiling fragment shader")
-	glCompileShader(shader_f_main)
-	if (not glGetShaderiv(shader_f_main, GL_COMPILE_STATUS)):
-		print("Shader compilation failed. Error: `%s`" % glGetShaderInfoLog(shader_f_main))
+	try:
+		program_builder = shader_manager.load({
+			"main": (SHADER_DIR + "/main.vert", SHADER_DIR + "/main.frag")
+		})
+	except celeritas.opengl.ShaderException as e_shader:
+		print("Shader program build failed. Error: `%s`" % (e_shader))
 		return 5
-
-
-	print("Creating shader program")
-	shprog_main = glCreateProgram()
-	print("Attaching shaders to program")
-	glAttachShader(shprog_main, shader_v_main)
-	glAttachShader(shprog_main, shader_f_main)
-	print("Linking program")
-	glLinkProgram(shprog_main)
-	if (not glGetProgramiv(shprog_main, GL_LINK_STATUS)):
-		print("Program linking failed. Error: `%s`" % glGetProgramInfoLog(shprog_main))
+	print("Shader programs ready in %.2fms (main %s)" % (
+		(program_builder.wall_time * 1000.0),
+		("loaded from cache" if shader_manager["main"].from_cache else "compiled")
+	))
+
+	# uniform block shared by all programs, laid out like `frame_data` in the shaders
+	frame_data = celeritas.opengl.UniformBuffer([
+		("crosshair_position", numpy.float32, (2, )),
+		("time", numpy.float32)
+	], 0, name = "frame_data", context = gl_context)
+	try:
+		frame_data.attach(shader_manager["main"], "frame_data")
+	except celeritas.opengl.ShaderException as e_shader:
+		print("Uniform block mismatch. Error: `%s`" % (e_shader))
 		return 5
 
 
-	print("Deleting shader objects")
-	map(glDeleteShader, (shader_f_main, shader_v_main))
-
-	crosshair_uniform = glGetUniformLocation(shprog_main, "crosshair_position")
-	rgba_uniform = glGetUniformLocation(shprog_main, "obj_rgba")
+	# one vertex: position, as in `vertex_offset` of the vertex shader
+	vertex_dtype = numpy.dtype([("vertex_offset", numpy.float32, (3, ))])
 
+	vertices = numpy.array([
+		((-0.2, -0.2,  0.0), ),		# bottom left
+		(( 0.2, -0.2,  0.0), ),		# bottom right
+		((-0.2,  0.2,  0.0), ),		# top left
+		(( 0.2,  0.2,  0.0), ),		# top right
+	], dtype = vertex_dtype)
 
-	vertices = [
-		-0.2, -0.2,  0.0,		# bottom left
-		 0.2, -0.2,  0.0,		# bottom right
-		-0.2,  0.2,  0.0,		# top left
-		 0.2,  0.2,  0.0,		# top right
-	]
-	vertices_s = (GLfloat * len(vertices))(*vertices)
-
-	indices = [
+	indices = numpy.array([
 		0, 1, 3,
 		3, 2, 0
-	]
-	indices_s = (GLuint * len(indices))(*indices)
-
-
-	print("Generating Vertex Array Object")
-	vao_main = glGenVertexArrays(1)
-	print("Binding Vertex Array Object")
-	glBindVertexArray(vao_main)
-
-	print("Generating vertex buffer")
-	vbo_main = glGenBuffers(1)
-	print("Binding vertex buffer")
-	glBindBuffer(GL_ARRAY_BUFFER, vbo_main)
-	print("Storing data in the vertex buffer")
-	glBufferData(
-		GL_ARRAY_BUFFER,
-		ArrayDatatype.arrayByteCount(vertices_s),	# calculate size
-		vertices_s,   								# this is how the array of GLfloats is built: sort a dynamic type. Ask Mike
-		GL_STATIC_DRAW
-	)
+	], dtype = numpy.uint16)
 
 
-	print("Generating element buffer")
-	ebo_main = glGenBuffers(1)
-	print("Binding element buffer")
-	glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo_main)
-	print("Storing data in the element buffer")
-	glBufferData(
-		GL_ELEMENT_ARRAY_BUFFER,
-		ArrayDatatype.arrayByteCount(indices_s),	# calculate size
-		indices_s,   								# this is how the array of GLfloats is built: sort a dynamic type. Ask Mike
-		GL_STATIC_DRAW
-	)
+	print("Creating the crosshair mesh")
+	mesh_main = celeritas.opengl.Mesh(vertices, indices)
+
+	render_queue = celeritas.opengl.RenderQueue(gl_context)
+
 
 
-	print("Preparing vertex attribute definition for position")
-	glVertexAttribPointer(
-		0,								# location 0 is position according to the layout in our vertex shader
-		3,								# we supply 3 variables per vertex
-		GL_FLOAT,						# they're floats
-		False,							# not sure why the author specifies "false" here. The data in fact IS normalized
-		ctypes.sizeof(GLfloat) * 3,		# stride is same as length as the array has no gaps
-		None							# we start at the first byte. This is a null pointer
-	)
-	print("Activating vertex attribute definition for position")
-	glEnableVertexAttribArray(0)
 
+	w_x = ctypes.c_int(); w_y = ctypes.c_int()
+	#SDL_GetWindowSize(main_window.sdl_window, w_x, w_y); # move this to "on resize" events and the like
 
-	print("Unbinding Vertex Buffer Object")
-	glBindBuffer(GL_ARRAY_BUFFER, 0)
-	print("Unbinding Vertex Array Object")
-	glBindVertexArray(0)
+	# handlers can't rebind locals, so their state lives in here
+	loop_state = {
+		"rel_x": 0.0,
+		"rel_y": 0.0,
+		"closing": False
+	}
 
+	def on_window_close(event):
+		loop_state["closing"] = True
 
+	def on_mouse_motion(event):
+		loop_state["rel_x"] = (-0.5 + (float(event.x_abs) / float(guc["video"]["resolution_x"]))) * 2.0
+		loop_state["rel_y"] = (-0.5 + (float(event.y_abs) / float(guc["video"]["resolution_y"]))) * -2.0
 
+	main_window.add_event_handler(uio.WindowCloseEvent, on_window_close)
+	main_window.add_event_handler(uio.MouseMotionEvent, on_mouse_motion)
+	# we only ever look at the latest pointer position
+	uio.coalesce_mouse_motion = True
 
-	w_x = ctypes.c_int(); w_y = ctypes.c_int()
-	#SDL_GetWindowSize(main_window.sdl_window, w_x, w_y); # move this to "on resize" events and the like
-	rel_x = 0.0; rel_y = 0.0
+	scheduler = celeritas.scheduler.FrameScheduler(main_window)
 
 	while (uio.window_count > 0):
 
-		for event in main_window.pop_events():
-			#print(isinstance(event, uio.WindowCloseEvent))
-			if (isinstance(event, uio.WindowCloseEvent)):
-				main_window = None
-				break
-			#elif (event.type in (SDL_WINDOWEVENT_RESIZED, SDL_WINDOWEVENT_SIZE_CHANGED, SDL_WINDOWEVENT_MOVED)):
-				#print("Resized")
-				#SDL_GetWindowSize(main_window.sdl_window, w_x, w_y)
-			if (isinstance(event, uio.MouseMotionEvent)):
- 				rel_x = (-0.5 + (float(event.x_abs) / float(guc["video"]["resolution_x"]))) * 2.0
- 				rel_y = (-0.5 + (float(event.y_abs) / float(guc["video"]["resolution_y"]))) * -2.0
-# 				rel_y = (-0.5 + (float(m_y.value) / float(w_y.value))) * -2.0
-# 			elif (event.type in (SDL_KEYDOWN, SDL_KEYUP)):
-# 				key_event = uio.KeyInputEvent(
-# 					event_type = event.type,
-# 					timestamp = event.key.timestamp,
-# 					window_id = event.key.windowID,
-# 					key_code = event.key.keysym.sym,
-# 					unicode_cp = event.key.keysym.unicode,
-# 					scan_code = event.key.keysym.scancode,
-# 					modifiers = event.key.keysym.mod,
-# 					is_repeat = bool(event.key.repeat)
-# 				)
-# 			
+		# nothing is simulated yet, we only need the frame accounting
+		scheduler.begin_frame()
+
+		uio.poll_events()
+		if (loop_state["closing"]):
+			main_window = None
 
 		# did we delete the window
 		if (main_window is None):
 			break;
 
-		glClear(GL_COLOR_BUFFER_BIT)
-		glClearColor(0, 0.2, 0.2, 0)
-
-		#print("Activating program")
-		glUseProgram(shprog_main)
-		glUniform2f(crosshair_uniform, rel_x, rel_y)
+		# between frames is the only safe time to swap programs
+		for program_name in shader_manager.update():
+			try:
+				frame_data.attach(shader_manager[program_name], "frame_data")
+			except celeritas.opengl.ShaderException as e_shader:
+				logger.error("%s", e_shader)
 
-		glUniform4f(rgba_uniform, 0.0, 0.0, 0.0, 1.0)
+		with profiler.zone("draw"), gl_context.gpu_pass("draw"):
+			celeritas.opengl.gl.glClear(GL_COLOR_BUFFER_BIT)
+			gl_context.clear_color(0, 0.2, 0.2, 0)
 
+			program_main = shader_manager["main"]
+			# only changes are uploaded
+			program_main.uniforms.obj_rgba = (0.0, 0.0, 0.0, 1.0)
 
-		glBindVertexArray(vao_main)
+			frame_data["crosshair_position"] = (loop_state["rel_x"], loop_state["rel_y"])
+			# simulation time, in seconds
+			frame_data["time"] = scheduler.ticks * scheduler.tick_time
+			frame_data.upload()
 
-		#glDrawArrays(GL_TRIANGLES, 0, 3)
-		glDrawElements(GL_TRIANGLES, len(indices_s), GL_UNSIGNED_INT, None)
 
-		glUseProgram(0)
-		glBindVertexArray(0)
+			render_queue.submit_mesh(program_main, mesh_main)
+			render_queue.flush()
 
-		main_window.frame_swap()
 
-		time.sleep(0.001)
+		scheduler.end_frame()
+		gl_context.frame_end()
 
 
 	logger.info("The last window was closed. Shutting down")
 
-	glDeleteVertexArrays(1, [vao_main])
-	glDeleteBuffers(1, [vbo_main])
-
-
+	if (profiler.enabled):
+		logger.info("Frame times (ms): %s", profiler.stats())
+		logger.info("GPU draw times (ms): %s", gl_context.gpu_stats("draw"))
+		logger.info(
+			"GL state changes: %d issued, %d elided",
+			gl_context.total_calls_issued, gl_context.total_calls_elided
+		)
+		logger.info(
+			"Render queue: %d commands in %d batches, %d state changes",
+			render_queue.total_commands, render_queue.total_batches, render_queue.total_state_changes
+		)
+		profiler.dump_trace()
+
+	# GL objects go while the window, and so its context, is still alive:
+	# the scheduler holds the last reference to it
+	mesh_main.release(gl_context)
+	frame_data.release()
+	shader_manager.release()
+	gl_context.release()
+
+	scheduler = None
 	del(main_window);
 
 
@@ -9,7 +9,7 @@ import json
 import logging
 import logging.config
 
-import info
+import celeritas.info as info
 
 
 logger = logging.getLogger(__name__)
@@ -21,12 +21,19 @@ CONFIG_DIR_RELATIVE = "." + info.APP_NAME
 guc = {
 	"system": {
 		"config_dir": None,
-		"guc_file": "celeritas_guc.json"
+		"guc_file": "celeritas_guc.json",
+		"profiling": False,			# collect frame timings and dump a trace at shutdown
+		"shader_reload": True,		# rebuild shader programs when their files change
+		"loader_threads": 4			# threads decoding textures
 	},
 	"video": {
 		"full_screen": False,
 		"resolution_x": 640,
-		"resolution_y": 480
+		"resolution_y": 480,
+		"swap_interval": 1,			# 1: vsync, -1: adaptive vsync, 0: off
+		"frame_cap": 0,				# frames per second, 0 for no cap
+		"gl_dispatch": "checked",	# "fast" calls the per-frame GL functions without PyOpenGL's checks
+		"texture_upload_budget": 8388608	# bytes of texture data uploaded per frame at most
 	}
 }
 
@@ -83,7 +90,7 @@ def load():
 	config_file = guc["system"]["config_dir"] + "/" + guc["system"]["guc_file"]
 
 	try:
-		guc_fp = open(config_file, "r")
+		guc_fp = open(config_file, "r", encoding = "utf-8")
 	except IOError:
 		logger.info("Missing configuration file `%s`. Running off hard coded defaults", (config_file))
 		return False
@@ -91,7 +98,7 @@ def load():
 
 	file_guc = None
 	try:
-		file_guc = json.load(guc_fp, encoding = "UTF-8")
+		file_guc = json.load(guc_fp)
 	except:
 		logger.info("Unable to load JSON from file `%s`. Running off hard coded defaults", (config_file))
 
@@ -131,7 +138,7 @@ def save():
 
 	guc_fp = None
 	try:
-		guc_fp = open(config_file_tmp, "w")
+		guc_fp = open(config_file_tmp, "w", encoding = "utf-8")
 	except IOError:
 		logger.error("Unable to open temporary file `%s`. Configuration will not be saved", (config_file_tmp))
 		return False
@@ -139,7 +146,7 @@ def save():
 	if (guc_fp is not None):
 		saved_in_full = False
 		try:
-			json.dump(guc, guc_fp, encoding = "UTF-8", indent = 4, separators = None)
+			json.dump(guc, guc_fp, indent = 4, separators = None)
 			saved_in_full = True
 		except IOError:
 			logger.error("Cannot write to temporary file `%s`. Configuration will not be saved", (config_file_tmp))
@@ -5,7 +5,13 @@
 	without exposing the underlying API.
 	The most important thing we need the window to expose is the OpenGL context
 """
+import os
+import time
+import struct
+import ctypes
+import hashlib
 import logging
+import collections
 
 import OpenGL
 OpenGL.USE_ACCELERATE = True
@@ -20,17 +26,2624 @@ from OpenGL.GLU import *
 from OpenGL.GLUT import *
 from OpenGL.arrays import vbo
 import numpy
+from sdl2 import SDL_GL_GetProcAddress
 
 from OpenGL.GL import shaders
 
+# parallel compilation is an extension, and a recent one as far as PyOpenGL is concerned
+try:
+	from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR, GL_COMPLETION_STATUS_KHR
+except ImportError:
+	glMaxShaderCompilerThreadsKHR = None
+	GL_COMPLETION_STATUS_KHR = 0x91B1
+from OpenGL.raw.GL.VERSION.GL_2_0 import glGetProgramiv as raw_glGetProgramiv
+
+
+from celeritas.config import guc
+import celeritas.profiler as profiler
+import celeritas.watcher as watcher
 
 
 logger = logging.getLogger(__name__)
 
 
+# how many frames after submission GPU timings are read back. By then the GPU
+# is normally done with them, so reading never stalls the pipeline
+GPU_TIMER_LATENCY = 3
+
+# timestamp queries created up front. The pool grows if more are needed
+GPU_TIMER_POOL_SIZE = 64
+
+# where linked program binaries are kept, relative to the configuration directory
+PROGRAM_CACHE_DIR = "program_cache"
+
+# seconds slept between checks on programs the driver is building in parallel
+BUILD_POLL_INTERVAL = 0.001
+
+# regions of a StreamBuffer start at multiples of this many bytes, which
+# satisfies the offset alignment of any binding on any hardware we know of
+STREAM_REGION_ALIGNMENT = 256
+
+# a StreamBuffer waits on its fences in slices of this many nanoseconds
+STREAM_WAIT_SLICE = 1000000
+
+# GL dispatch modes, see Dispatch
+GL_DISPATCH_CHECKED = "checked"
+GL_DISPATCH_FAST = "fast"
+
+# (raw) GL types, for the signatures below
+_GLenum = _GLbitfield = _GLuint = ctypes.c_uint
+_GLint = _GLsizei = ctypes.c_int
+_GLfloat = ctypes.c_float
+_GLboolean = ctypes.c_ubyte
+_GLintptr = _GLsizeiptr = ctypes.c_ssize_t
+_GLpointer = ctypes.c_void_p
+
+# functions called every frame, that Dispatch can call without PyOpenGL in the way.
+# name -> argument types. None of them returns anything.
+# Pointers must be passed as ctypes.c_void_p or None (see buffer_pointer())
+HOT_FUNCTIONS = {
+	"glClear": (_GLbitfield, ),
+	"glClearColor": (_GLfloat, _GLfloat, _GLfloat, _GLfloat),
+	"glViewport": (_GLint, _GLint, _GLsizei, _GLsizei),
+	"glEnable": (_GLenum, ),
+	"glDisable": (_GLenum, ),
+	"glBlendFunc": (_GLenum, _GLenum),
+	"glDepthFunc": (_GLenum, ),
+	"glDepthMask": (_GLboolean, ),
+	"glCullFace": (_GLenum, ),
+	"glUseProgram": (_GLuint, ),
+	"glBindVertexArray": (_GLuint, ),
+	"glBindBuffer": (_GLenum, _GLuint),
+	"glBindBufferBase": (_GLenum, _GLuint, _GLuint),
+	"glBindBufferRange": (_GLenum, _GLuint, _GLuint, _GLintptr, _GLsizeiptr),
+	"glActiveTexture": (_GLenum, ),
+	"glBindTexture": (_GLenum, _GLuint),
+	"glBufferData": (_GLenum, _GLsizeiptr, _GLpointer, _GLenum),
+	"glBufferSubData": (_GLenum, _GLintptr, _GLsizeiptr, _GLpointer),
+	"glNamedBufferData": (_GLuint, _GLsizeiptr, _GLpointer, _GLenum),
+	"glNamedBufferSubData": (_GLuint, _GLintptr, _GLsizeiptr, _GLpointer),
+	"glDrawArrays": (_GLenum, _GLint, _GLsizei),
+	"glDrawElements": (_GLenum, _GLsizei, _GLenum, _GLpointer),
+	"glDrawElementsInstanced": (_GLenum, _GLsizei, _GLenum, _GLpointer, _GLsizei),
+	"glDrawElementsBaseVertex": (_GLenum, _GLsizei, _GLenum, _GLpointer, _GLint),
+	"glMultiDrawElementsIndirect": (_GLenum, _GLenum, _GLpointer, _GLsizei, _GLsizei),
+	"glUniform1f": (_GLint, _GLfloat),
+	"glUniform2f": (_GLint, _GLfloat, _GLfloat),
+	"glUniform3f": (_GLint, _GLfloat, _GLfloat, _GLfloat),
+	"glUniform4f": (_GLint, _GLfloat, _GLfloat, _GLfloat, _GLfloat),
+	"glUniform1i": (_GLint, _GLint),
+	"glProgramUniform1fv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform2fv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform3fv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform4fv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform1iv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform2iv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform3iv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform4iv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform1uiv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform2uiv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform3uiv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniform4uiv": (_GLuint, _GLint, _GLsizei, _GLpointer),
+	"glProgramUniformMatrix2fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix3fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix4fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix2x3fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix2x4fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix3x2fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix3x4fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix4x2fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer),
+	"glProgramUniformMatrix4x3fv": (_GLuint, _GLint, _GLsizei, _GLboolean, _GLpointer)
+}
+
+# GL entry points use the system calling convention, which is stdcall on Windows
+_GL_FUNCTYPE = (ctypes.WINFUNCTYPE if (os.name == "nt") else ctypes.CFUNCTYPE)
+
+# draw commands a RenderQueue starts with room for. It doubles when full
+RENDER_QUEUE_CAPACITY = 4096
+
+# uniform slot of commands that don't use one
+NO_UNIFORM_SLOT = 0xFFFF
+
+# primitive types whose draws of contiguous index ranges a RenderQueue can join.
+# Joining strips, loops or fans would connect the last vertex of one to the first of the next
+RENDER_MERGEABLE_MODES = numpy.array([GL_POINTS, GL_LINES, GL_TRIANGLES], dtype = numpy.uint32)
+
+# one RenderQueue command. key is the packed state: program, vertex array,
+# texture and uniform slot, 16 bits each, from the most significant
+RENDER_COMMAND = numpy.dtype([
+	("key", numpy.uint64),
+	("program", numpy.uint32),
+	("vertex_array", numpy.uint32),
+	("texture", numpy.uint32),
+	("uniform_slot", numpy.uint32),
+	("mode", numpy.uint32),
+	("index_type", numpy.uint32),			# 0 for non indexed draws
+	("first", numpy.uint32),				# first index (or vertex)
+	("count", numpy.uint32),
+	("base_vertex", numpy.int32)
+])
+
+# where each mesh of a MeshPool lives in the shared buffers
+MESH_POOL_RECORD = numpy.dtype([
+	("first_index", numpy.uint32),
+	("index_count", numpy.uint32),
+	("base_vertex", numpy.int32)
+])
+
+# what glMultiDrawElementsIndirect() reads, per draw
+DRAW_ELEMENTS_INDIRECT_COMMAND = numpy.dtype([
+	("count", numpy.uint32),
+	("instance_count", numpy.uint32),
+	("first_index", numpy.uint32),
+	("base_vertex", numpy.int32),
+	("base_instance", numpy.uint32)
+])
+
+# bytes per index, by index type
+INDEX_SIZES = {
+	GL_UNSIGNED_BYTE: 1,
+	GL_UNSIGNED_SHORT: 2,
+	GL_UNSIGNED_INT: 4
+}
+
+# human readable shader stage names, for messages
+SHADER_STAGE_NAMES = {
+	GL_VERTEX_SHADER: "vertex",
+	GL_TESS_CONTROL_SHADER: "tessellation control",
+	GL_TESS_EVALUATION_SHADER: "tessellation evaluation",
+	GL_GEOMETRY_SHADER: "geometry",
+	GL_FRAGMENT_SHADER: "fragment",
+	GL_COMPUTE_SHADER: "compute"
+}
+
+# shader file extensions, and the stage they imply
+SHADER_FILE_STAGES = {
+	".vert": GL_VERTEX_SHADER,
+	".tesc": GL_TESS_CONTROL_SHADER,
+	".tese": GL_TESS_EVALUATION_SHADER,
+	".geom": GL_GEOMETRY_SHADER,
+	".frag": GL_FRAGMENT_SHADER,
+	".comp": GL_COMPUTE_SHADER
+}
+
+
+
+
+class ShaderException(Exception): pass
+class FramebufferException(Exception): pass
+class BufferException(Exception): pass
+
+
+
+
+class Dispatch(object):
+	"""
+		The GL functions in HOT_FUNCTIONS, as attributes (gl.glDrawElements...).
+		In "checked" mode they are PyOpenGL's, with its argument conversion and
+		error checking after every call. In "fast" mode they are the driver's
+		entry points, from SDL_GL_GetProcAddress(), called through ctypes with
+		fixed signatures: no conversion and no checking, so mistakes show up
+		as garbage on screen or worse rather than as exceptions.
+		Code on the per frame path calls GL through the module's `gl` instance
+	"""
+	def __init__(self):
+		self.mode = None
+		# name -> ctypes function, resolved on the first switch to fast mode
+		self.raw_functions = None
+		self.use(GL_DISPATCH_CHECKED)
+
+
+	def resolve(self):
+		"""
+			Return:
+				{name: ctypes function} for the entry points the driver has
+		"""
+		raw_functions = {}
+		for (f_name, f_args) in HOT_FUNCTIONS.items():
+			address = SDL_GL_GetProcAddress(f_name.encode("ascii"))
+			if (not address):
+				logger.warning("The driver has no `%s`, it will go through PyOpenGL", f_name)
+				continue
+			raw_functions[f_name] = _GL_FUNCTYPE(None, *f_args)(address)
+		return raw_functions
+
+
+	def use(self, mode):
+		"""
+			Switches dispatch mode. Switching to "fast" needs a current context
+		"""
+		if (mode not in (GL_DISPATCH_CHECKED, GL_DISPATCH_FAST)):
+			raise ValueError("Unknown GL dispatch mode `%s`" % (mode))
+		if ((mode == GL_DISPATCH_FAST) and (self.raw_functions is None)):
+			self.raw_functions = self.resolve()
+		module_globals = globals()
+		for f_name in HOT_FUNCTIONS:
+			function = (self.raw_functions.get(f_name) if (mode == GL_DISPATCH_FAST) else None)
+			setattr(self, f_name, (function if (function is not None) else module_globals[f_name]))
+		self.mode = mode
+
+
+gl = Dispatch()
+
+
+
+# names of the extensions supported by the current context. Filled on first use
+_extensions = None
+
+def has_extension(name):
+	"""
+		Whether the current context supports extension `name` (e.g. "GL_KHR_parallel_shader_compile")
+	"""
+	global _extensions
+	if (_extensions is None):
+		_extensions = frozenset((
+			glGetStringi(GL_EXTENSIONS, e_n).decode("ascii") for e_n in range(glGetIntegerv(GL_NUM_EXTENSIONS))
+		))
+	return (name in _extensions)
+
+
+
+
+class GpuTimerPool(object):
+	"""
+		Asynchronous GPU timings for named passes, based on pairs of GL_TIMESTAMP
+		queries (unlike GL_TIME_ELAPSED, these can be nested).
+		Results are only looked at GPU_TIMER_LATENCY frames after submission and
+		only if GL_QUERY_RESULT_AVAILABLE says so; what is not ready yet is
+		simply tried again on the next frame.
+		Each pass gets a rolling per-frame series, see profiler.ZoneHistory
+	"""
+	def __init__(self,
+		latency = GPU_TIMER_LATENCY,
+		pool_size = GPU_TIMER_POOL_SIZE
+	):
+		"""
+			Arguments:
+				latency:		frames to wait before reading back a result
+				pool_size:		initial number of query objects
+		"""
+		self.latency = latency
+		self.free = [int(q_id) for q_id in glGenQueries(pool_size)]
+		self.allocated = pool_size
+
+		# (frame, pass name, start query, end query) in submission order
+		self.pending = collections.deque()
+		# pass name -> seconds, for the frame whose results are being collected
+		self.collected = {}
+
+		# pass name -> profiler.ZoneHistory of GPU seconds per frame
+		self.histories = {}
+
+		self.frame = 0
+		self._result = ctypes.c_uint64()
+
+
+	def _query(self):
+		if (not self.free):
+			# ran dry: results are taking longer than expected to come back
+			self.free.extend((int(q_id) for q_id in glGenQueries(GPU_TIMER_POOL_SIZE)))
+			self.allocated += GPU_TIMER_POOL_SIZE
+		return self.free.pop()
+
+
+	def begin(self, name):
+		"""
+			Marks the start of pass `name` in the command stream
+
+			Return:
+				a token to hand to end()
+		"""
+		q_start = self._query()
+		glQueryCounter(q_start, GL_TIMESTAMP)
+		return (name, q_start)
+
+
+	def end(self, token):
+		""" Marks the end of the pass started by begin() """
+		q_end = self._query()
+		glQueryCounter(q_end, GL_TIMESTAMP)
+		self.pending.append((self.frame, token[0], token[1], q_end))
+
+
+	def section(self, name):
+		""" Context manager wrapping begin()/end() """
+		return _GpuSection(self, name)
+
+
+	def frame_end(self):
+		"""
+			Closes the current frame and collects whatever results are due and available
+		"""
+		self.frame += 1
+
+		pending = self.pending
+		while (pending):
+			(p_frame, p_name, q_start, q_end) = pending[0]
+			if ((self.frame - p_frame) < self.latency):
+				break
+			if (not glGetQueryObjectuiv(q_end, GL_QUERY_RESULT_AVAILABLE)):
+				break
+
+			pending.popleft()
+			glGetQueryObjectui64v(q_end, GL_QUERY_RESULT, ctypes.byref(self._result))
+			t_end = self._result.value
+			glGetQueryObjectui64v(q_start, GL_QUERY_RESULT, ctypes.byref(self._result))
+			self.free.append(q_start)
+			self.free.append(q_end)
+
+			self.collected[p_name] = self.collected.get(p_name, 0.0) + ((t_end - self._result.value) / 1e9)
+
+			# the frame is complete once the next pending pass belongs to a later one
+			if ((not pending) or (pending[0][0] != p_frame)):
+				for (c_name, c_time) in self.collected.items():
+					c_history = self.histories.get(c_name)
+					if (c_history is None):
+						c_history = self.histories[c_name] = profiler.ZoneHistory()
+					c_history.push(c_time)
+				self.collected.clear()
+
+
+	def stats(self, name):
+		"""
+			Rolling GPU time statistics for a pass, see profiler.ZoneHistory.stats()
+		"""
+		p_history = self.histories.get(name)
+		return (p_history.stats() if (p_history is not None) else None)
+
+
+	def release(self):
+		""" Deletes all the query objects. The pool is unusable afterwards """
+		in_flight = [q_id for pending in self.pending for q_id in pending[2:]]
+		glDeleteQueries(len(self.free) + len(in_flight), self.free + in_flight)
+		self.free = []
+		self.pending.clear()
+
+
+
+class _GpuSection(object):
+	__slots__ = ("pool", "name", "token")
+
+	def __init__(self, pool, name):
+		(self.pool, self.name) = (pool, name)
+
+	def __enter__(self):
+		self.token = self.pool.begin(self.name)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.pool.end(self.token)
+		return False
+
+
 
 
 class Context(object):
-	""" An OpenGL Context. Very few applications need more than one """
-	def __init__():
-		pass
+	"""
+		An OpenGL Context. Very few applications need more than one.
+		Must be instantiated with the GL context of the window current
+
+		The context also tracks the GL state that is changed often (bindings,
+		capabilities, blending...) and drops the calls that wouldn't change
+		it, as every call through PyOpenGL is expensive. For that to work all
+		such changes must go through it; after changing state behind its back
+		call invalidate().
+		None in the tracked state means "unknown": the next call is always issued
+	"""
+	def __init__(self,
+		gpu_timing = True,
+		dispatch = None
+	):
+		"""
+			Arguments:
+				gpu_timing:		whether gpu_pass() actually times passes. Timestamp
+								queries are cheap but not free
+				dispatch:		GL_DISPATCH_* mode for `gl`. Defaults to guc["video"]["gl_dispatch"]
+		"""
+		gl.use(guc["video"]["gl_dispatch"] if (dispatch is None) else dispatch)
+		self.gpu_timers = (GpuTimerPool() if gpu_timing else None)
+
+		# state changing calls made and avoided during the frame in progress,
+		# during the last complete frame and overall
+		self.calls_issued = 0
+		self.calls_elided = 0
+		self.frame_calls_issued = 0
+		self.frame_calls_elided = 0
+		self.total_calls_issued = 0
+		self.total_calls_elided = 0
+
+		self.invalidate()
+
+
+	def invalidate(self):
+		"""
+			Forgets all the tracked state
+		"""
+		self.program = None
+		self.vertex_array = None
+		# target -> buffer. GL_ELEMENT_ARRAY_BUFFER belongs to the vertex array
+		self.buffers = {}
+		self.texture_unit = None
+		# (unit, target) -> texture
+		self.textures = {}
+		# capability (GL_BLEND...) -> bool
+		self.capabilities = {}
+		self.blend_funcs = None
+		self.depth_func_mode = None
+		self.depth_mask_flag = None
+		self.cull_face_mode = None
+		self.clear_rgba = None
+		self.viewport_rect = None
+
+
+	def use_program(self, program_id):
+		if (self.program == program_id):
+			self.calls_elided += 1
+			return
+		gl.glUseProgram(program_id)
+		self.program = program_id
+		self.calls_issued += 1
+
+
+	def bind_vertex_array(self, vertex_array_id):
+		if (self.vertex_array == vertex_array_id):
+			self.calls_elided += 1
+			return
+		gl.glBindVertexArray(vertex_array_id)
+		self.vertex_array = vertex_array_id
+		# the element buffer binding comes with the vertex array, and we don't know it
+		self.buffers.pop(GL_ELEMENT_ARRAY_BUFFER, None)
+		self.calls_issued += 1
+
+
+	def bind_buffer(self, target, buffer_id):
+		if (self.buffers.get(target) == buffer_id):
+			self.calls_elided += 1
+			return
+		gl.glBindBuffer(target, buffer_id)
+		self.buffers[target] = buffer_id
+		self.calls_issued += 1
+
+
+	def bind_buffer_base(self, target, index, buffer_id):
+		""" Indexed bindings aren't tracked, but they move the generic binding of `target` too """
+		gl.glBindBufferBase(target, index, buffer_id)
+		self.buffers[target] = buffer_id
+		self.calls_issued += 1
+
+
+	def bind_buffer_range(self, target, index, buffer_id, offset, size):
+		""" See bind_buffer_base() """
+		gl.glBindBufferRange(target, index, buffer_id, offset, size)
+		self.buffers[target] = buffer_id
+		self.calls_issued += 1
+
+
+	def forget_buffer(self, buffer_id):
+		"""
+			To be called when a buffer is deleted: GL hands the names of deleted
+			objects out again, and a bind of the new object must not be dropped
+		"""
+		for target in [target for (target, bound_id) in self.buffers.items() if (bound_id == buffer_id)]:
+			del self.buffers[target]
+
+
+	def forget_vertex_array(self, vertex_array_id):
+		""" See forget_buffer() """
+		if (self.vertex_array == vertex_array_id):
+			self.vertex_array = None
+			self.buffers.pop(GL_ELEMENT_ARRAY_BUFFER, None)
+
+
+	def forget_texture(self, texture_id):
+		""" See forget_buffer() """
+		for key in [key for (key, bound_id) in self.textures.items() if (bound_id == texture_id)]:
+			del self.textures[key]
+
+
+	def active_texture(self, unit):
+		"""
+			Arguments:
+				unit:		texture unit number, from 0 (not GL_TEXTURE0 + n)
+		"""
+		if (self.texture_unit == unit):
+			self.calls_elided += 1
+			return
+		gl.glActiveTexture(GL_TEXTURE0 + unit)
+		self.texture_unit = unit
+		self.calls_issued += 1
+
+
+	def bind_texture(self, target, texture_id, unit = None):
+		"""
+			Binds a texture to `unit`, or to the active unit if None
+		"""
+		if (unit is not None):
+			self.active_texture(unit)
+		elif (self.texture_unit is None):
+			# we cannot know which unit the binding would go to
+			self.textures.clear()
+		key = (self.texture_unit, target)
+		if ((self.texture_unit is not None) and (self.textures.get(key) == texture_id)):
+			self.calls_elided += 1
+			return
+		gl.glBindTexture(target, texture_id)
+		if (self.texture_unit is not None):
+			self.textures[key] = texture_id
+		self.calls_issued += 1
+
+
+	def set_capability(self, capability, flag):
+		"""
+			glEnable()/glDisable() of `capability` (GL_BLEND, GL_DEPTH_TEST, GL_CULL_FACE...)
+		"""
+		flag = bool(flag)
+		if (self.capabilities.get(capability) is flag):
+			self.calls_elided += 1
+			return
+		(gl.glEnable if flag else gl.glDisable)(capability)
+		self.capabilities[capability] = flag
+		self.calls_issued += 1
+
+
+	def enable(self, capability):
+		self.set_capability(capability, True)
+
+
+	def disable(self, capability):
+		self.set_capability(capability, False)
+
+
+	def blend_func(self, src_factor, dst_factor):
+		if (self.blend_funcs == (src_factor, dst_factor)):
+			self.calls_elided += 1
+			return
+		gl.glBlendFunc(src_factor, dst_factor)
+		self.blend_funcs = (src_factor, dst_factor)
+		self.calls_issued += 1
+
+
+	def depth_func(self, func):
+		if (self.depth_func_mode == func):
+			self.calls_elided += 1
+			return
+		gl.glDepthFunc(func)
+		self.depth_func_mode = func
+		self.calls_issued += 1
+
+
+	def depth_mask(self, flag):
+		flag = bool(flag)
+		if (self.depth_mask_flag is flag):
+			self.calls_elided += 1
+			return
+		gl.glDepthMask(flag)
+		self.depth_mask_flag = flag
+		self.calls_issued += 1
+
+
+	def cull_face(self, mode):
+		if (self.cull_face_mode == mode):
+			self.calls_elided += 1
+			return
+		gl.glCullFace(mode)
+		self.cull_face_mode = mode
+		self.calls_issued += 1
+
+
+	def clear_color(self, r, g, b, a):
+		if (self.clear_rgba == (r, g, b, a)):
+			self.calls_elided += 1
+			return
+		gl.glClearColor(r, g, b, a)
+		self.clear_rgba = (r, g, b, a)
+		self.calls_issued += 1
+
+
+	def viewport(self, x, y, w, h):
+		if (self.viewport_rect == (x, y, w, h)):
+			self.calls_elided += 1
+			return
+		gl.glViewport(x, y, w, h)
+		self.viewport_rect = (x, y, w, h)
+		self.calls_issued += 1
+
+
+	def gpu_pass(self, name):
+		"""
+			Context manager timing the GL commands submitted in its block as pass `name`.
+			Results show up in gpu_stats() a few frames later
+		"""
+		if (self.gpu_timers is None):
+			return profiler.NULL_ZONE
+		return self.gpu_timers.section(name)
+
+
+	def gpu_stats(self, name):
+		""" Rolling GPU time statistics for a pass, None if there are none """
+		return (self.gpu_timers.stats(name) if (self.gpu_timers is not None) else None)
+
+
+	def frame_end(self):
+		"""
+			To be called once per frame, after the last GL command of the frame
+		"""
+		if (self.gpu_timers is not None):
+			self.gpu_timers.frame_end()
+
+		(self.frame_calls_issued, self.frame_calls_elided) = (self.calls_issued, self.calls_elided)
+		self.total_calls_issued += self.calls_issued
+		self.total_calls_elided += self.calls_elided
+		(self.calls_issued, self.calls_elided) = (0, 0)
+
+
+	def release(self):
+		""" Frees the GL objects owned by the context tracker """
+		if (self.gpu_timers is not None):
+			self.gpu_timers.release()
+			self.gpu_timers = None
+
+
+
+
+# NumPy scalar type -> GL vertex attribute component type
+VERTEX_ATTRIBUTE_TYPES = {
+	numpy.dtype(numpy.float32): GL_FLOAT,
+	numpy.dtype(numpy.float16): GL_HALF_FLOAT,
+	numpy.dtype(numpy.float64): GL_DOUBLE,
+	numpy.dtype(numpy.int8): GL_BYTE,
+	numpy.dtype(numpy.uint8): GL_UNSIGNED_BYTE,
+	numpy.dtype(numpy.int16): GL_SHORT,
+	numpy.dtype(numpy.uint16): GL_UNSIGNED_SHORT,
+	numpy.dtype(numpy.int32): GL_INT,
+	numpy.dtype(numpy.uint32): GL_UNSIGNED_INT
+}
+
+# NumPy index type -> GL index type
+INDEX_TYPES = {
+	numpy.dtype(numpy.uint8): GL_UNSIGNED_BYTE,
+	numpy.dtype(numpy.uint16): GL_UNSIGNED_SHORT,
+	numpy.dtype(numpy.uint32): GL_UNSIGNED_INT
+}
+
+# NumPy dtype -> GL type of texture pixel data
+PIXEL_TYPES = {
+	numpy.dtype(numpy.uint8): GL_UNSIGNED_BYTE,
+	numpy.dtype(numpy.int8): GL_BYTE,
+	numpy.dtype(numpy.uint16): GL_UNSIGNED_SHORT,
+	numpy.dtype(numpy.int16): GL_SHORT,
+	numpy.dtype(numpy.uint32): GL_UNSIGNED_INT,
+	numpy.dtype(numpy.int32): GL_INT,
+	numpy.dtype(numpy.float16): GL_HALF_FLOAT,
+	numpy.dtype(numpy.float32): GL_FLOAT
+}
+
+# uniform type ->(NumPy dtype, components, glProgramUniform* function name, is a matrix).
+# Types not in here are samplers and images, which are set as ints
+UNIFORM_TYPES = {
+	GL_FLOAT: (numpy.float32, 1, "glProgramUniform1fv", False),
+	GL_FLOAT_VEC2: (numpy.float32, 2, "glProgramUniform2fv", False),
+	GL_FLOAT_VEC3: (numpy.float32, 3, "glProgramUniform3fv", False),
+	GL_FLOAT_VEC4: (numpy.float32, 4, "glProgramUniform4fv", False),
+	GL_INT: (numpy.int32, 1, "glProgramUniform1iv", False),
+	GL_INT_VEC2: (numpy.int32, 2, "glProgramUniform2iv", False),
+	GL_INT_VEC3: (numpy.int32, 3, "glProgramUniform3iv", False),
+	GL_INT_VEC4: (numpy.int32, 4, "glProgramUniform4iv", False),
+	GL_BOOL: (numpy.int32, 1, "glProgramUniform1iv", False),
+	GL_BOOL_VEC2: (numpy.int32, 2, "glProgramUniform2iv", False),
+	GL_BOOL_VEC3: (numpy.int32, 3, "glProgramUniform3iv", False),
+	GL_BOOL_VEC4: (numpy.int32, 4, "glProgramUniform4iv", False),
+	GL_UNSIGNED_INT: (numpy.uint32, 1, "glProgramUniform1uiv", False),
+	GL_UNSIGNED_INT_VEC2: (numpy.uint32, 2, "glProgramUniform2uiv", False),
+	GL_UNSIGNED_INT_VEC3: (numpy.uint32, 3, "glProgramUniform3uiv", False),
+	GL_UNSIGNED_INT_VEC4: (numpy.uint32, 4, "glProgramUniform4uiv", False),
+	GL_FLOAT_MAT2: (numpy.float32, 4, "glProgramUniformMatrix2fv", True),
+	GL_FLOAT_MAT3: (numpy.float32, 9, "glProgramUniformMatrix3fv", True),
+	GL_FLOAT_MAT4: (numpy.float32, 16, "glProgramUniformMatrix4fv", True),
+	GL_FLOAT_MAT2x3: (numpy.float32, 6, "glProgramUniformMatrix2x3fv", True),
+	GL_FLOAT_MAT2x4: (numpy.float32, 8, "glProgramUniformMatrix2x4fv", True),
+	GL_FLOAT_MAT3x2: (numpy.float32, 6, "glProgramUniformMatrix3x2fv", True),
+	GL_FLOAT_MAT3x4: (numpy.float32, 12, "glProgramUniformMatrix3x4fv", True),
+	GL_FLOAT_MAT4x2: (numpy.float32, 8, "glProgramUniformMatrix4x2fv", True),
+	GL_FLOAT_MAT4x3: (numpy.float32, 12, "glProgramUniformMatrix4x3fv", True)
+}
+SAMPLER_UNIFORM_TYPE = (numpy.int32, 1, "glProgramUniform1iv", False)
+
+
+
+
+class Uniform(object):
+	"""
+		One active uniform of a program, and the last value sent to it
+	"""
+	__slots__ = ("program_id", "name", "location", "gl_type", "size", "dtype", "components", "setter", "matrix", "value")
+
+	def __init__(self, program_id, name, location, gl_type, size):
+		"""
+			Arguments:
+				size:		number of elements for arrays, 1 otherwise
+		"""
+		(self.program_id, self.name, self.location, self.gl_type, self.size) = (program_id, name, location, gl_type, size)
+		(self.dtype, self.components, self.setter, self.matrix) = UNIFORM_TYPES.get(gl_type, SAMPLER_UNIFORM_TYPE)
+		self.value = None
+
+
+	def set(self, value):
+		"""
+			Uploads `value` (a scalar, a sequence or an array, flattened for arrays and
+			matrices, which are column major) unless it is what was uploaded last
+
+			Return:
+				whether a GL call was made
+		"""
+		if (isinstance(value, list)):
+			value = tuple(value)
+		last = self.value
+		if (last is not None):
+			if (isinstance(value, numpy.ndarray) or isinstance(last, numpy.ndarray)):
+				if (numpy.array_equal(value, last)):
+					return False
+			elif (value == last):
+				return False
+
+		data = numpy.asarray(value, dtype = self.dtype).ravel()
+		(count, leftover) = divmod(len(data), self.components)
+		if (leftover or (not count) or (count > self.size)):
+			raise ValueError("Uniform `%s` takes up to %d groups of %d values, got %d values" % (
+				self.name, self.size, self.components, len(data)
+			))
+
+		if (self.matrix):
+			getattr(gl, self.setter)(self.program_id, self.location, count, GL_FALSE, buffer_pointer(data))
+		else:
+			getattr(gl, self.setter)(self.program_id, self.location, count, buffer_pointer(data))
+
+		self.value = (value.copy() if isinstance(value, numpy.ndarray) else value)
+		return True
+
+
+
+
+class UniformSet(object):
+	"""
+		The active uniforms of a program, settable as attributes:
+
+			program.uniforms.obj_rgba = (0.0, 0.0, 0.0, 1.0)
+
+		Values go through glProgramUniform*(), so the program need not be in use.
+		Setting a uniform the program doesn't have (the compiler drops unused
+		ones, which is common while editing shaders) is logged once and ignored
+	"""
+	def __init__(self, program_id):
+		# object.__setattr__ as our own __setattr__ is for uniforms
+		object.__setattr__(self, "uniforms", {})
+		object.__setattr__(self, "missing", set())
+		object.__setattr__(self, "uploads", 0)
+		object.__setattr__(self, "elided", 0)
+
+		for u_n in range(glGetProgramiv(program_id, GL_ACTIVE_UNIFORMS)):
+			(u_name, u_size, u_type) = glGetActiveUniform(program_id, u_n)
+			u_name = u_name.decode("ascii") if isinstance(u_name, bytes) else u_name
+			location = glGetUniformLocation(program_id, u_name)
+			# members of uniform blocks have no location
+			if (location < 0):
+				continue
+			# arrays are reported as "name[0]"
+			if (u_name.endswith("[0]")):
+				u_name = u_name[:-3]
+			self.uniforms[u_name] = Uniform(program_id, u_name, location, int(u_type), int(u_size))
+
+
+	def __getitem__(self, name):
+		return self.uniforms[name]
+
+
+	def __contains__(self, name):
+		return (name in self.uniforms)
+
+
+	def __iter__(self):
+		return iter(self.uniforms)
+
+
+	def __getattr__(self, name):
+		""" The last value set. Only called for names that aren't regular attributes """
+		try:
+			return self.uniforms[name].value
+		except KeyError:
+			raise AttributeError("No active uniform named `%s`" % (name))
+
+
+	def __setattr__(self, name, value):
+		self.set(name, value)
+
+
+	def set(self, name, value):
+		uniform = self.uniforms.get(name)
+		if (uniform is None):
+			if (name not in self.missing):
+				self.missing.add(name)
+				logger.warning("Ignoring value for uniform `%s`, which is not active", name)
+			return
+		if (uniform.set(value)):
+			object.__setattr__(self, "uploads", self.uploads + 1)
+		else:
+			object.__setattr__(self, "elided", self.elided + 1)
+
+
+
+
+class Program(object):
+	"""
+		A linked shader program.
+		`sources` maps shader stages (GL_VERTEX_SHADER...) to GLSL source.
+		Its active uniforms are reflected on creation and set through .uniforms
+		(see UniformSet)
+	"""
+	def __init__(self, gl_id, sources, name = None, from_cache = False):
+		"""
+			Arguments:
+				gl_id:			the GL program object
+				sources:		{stage: GLSL source} the program was built from
+				name:			label for messages, defaults to the program id
+				from_cache:		whether it was loaded from a binary instead of compiled
+		"""
+		(self.gl_id, self.sources, self.from_cache) = (gl_id, sources, from_cache)
+		self.name = (name if (name is not None) else ("program #%d" % gl_id))
+		self.uniforms = UniformSet(gl_id)
+
+
+	def use(self, context = None):
+		"""
+			Makes this the current program, through `context` (a Context) if specified
+		"""
+		if (context is not None):
+			context.use_program(self.gl_id)
+		else:
+			glUseProgram(self.gl_id)
+
+
+	def delete(self):
+		if (self.gl_id):
+			glDeleteProgram(self.gl_id)
+			self.gl_id = 0
+
+
+
+
+def std140_dtype(dtype):
+	"""
+		Lays out a NumPy structured dtype the way std140 lays out the uniform
+		block with the same members, in the same order. Supported fields have a
+		4 bytes base type (float32, int32, uint32) and are:
+			- scalars: shape ()
+			- vectors: shape (n, ), n up to 4
+			- matrices and arrays: 2 or more dimensions. The last is the
+			  vector size, the others the columns/elements. std140 pads
+			  every column/element to 16 bytes, so the last dimension
+			  always grows to 4: a mat3 is (3, 4), a float[8] is (8, 4)
+				(declare it as (8, 1))
+
+		Return:
+			(padded dtype, {field: original last dimension} for the padded fields)
+	"""
+	dtype = numpy.dtype(dtype)
+	if (dtype.names is None):
+		raise ValueError("Uniform block layouts must be structured dtypes, got %s" % (dtype))
+
+	(names, formats, offsets, widths) = ([], [], [], {})
+	offset = 0
+	for f_name in dtype.names:
+		f_dtype = dtype.fields[f_name][0]
+		(base, shape) = (f_dtype.base, f_dtype.shape)
+		if ((base.itemsize != 4) or (base.kind not in "fiu")):
+			raise ValueError("Field `%s`: std140 blocks take 4 bytes scalars, got %s" % (f_name, base))
+
+		if (len(shape) == 0):
+			alignment = 4
+		elif (len(shape) == 1):
+			if (shape[0] > 4):
+				raise ValueError("Field `%s`: vectors have at most 4 components. Arrays of scalars are (n, 1)" % (f_name))
+			alignment = (4, 8, 16, 16)[shape[0] - 1]
+		else:
+			# arrays and matrices: every element/column is padded to a vec4
+			alignment = 16
+			if (shape[-1] > 4):
+				raise ValueError("Field `%s`: vectors have at most 4 components" % (f_name))
+			if (shape[-1] < 4):
+				widths[f_name] = shape[-1]
+				shape = shape[:-1] + (4, )
+
+		offset = ((offset + alignment - 1) // alignment) * alignment
+		names.append(f_name)
+		formats.append((base, shape))
+		offsets.append(offset)
+		offset += base.itemsize * int(numpy.prod(shape))
+
+	padded = numpy.dtype({
+		"names": names,
+		"formats": formats,
+		"offsets": offsets,
+		# a block is as big as a multiple of a vec4
+		"itemsize": ((offset + 15) // 16) * 16
+	})
+	return (padded, widths)
+
+
+
+
+class UniformBuffer(object):
+	"""
+		A uniform buffer object holding one std140 uniform block, laid out from a
+		NumPy structured dtype (see std140_dtype()). It lives at a binding point,
+		so any number of programs can share it (see attach()).
+
+		Fields are set by name, locally; upload() sends the whole block with a
+		single call, if anything changed:
+
+			frame_data = UniformBuffer([("crosshair_position", numpy.float32, (2, )), ("time", numpy.float32)], 0)
+			frame_data.attach(program, "frame_data")
+			...
+			frame_data["time"] = t
+			frame_data.upload()
+	"""
+	def __init__(self, dtype, binding, name = None, context = None):
+		"""
+			Arguments:
+				dtype:		structured dtype (or anything numpy.dtype() takes)
+							with the members of the block, in order
+				binding:	uniform buffer binding point
+				name:		label for messages
+				context:	Context to bind through, if any
+		"""
+		(self.dtype, self.widths) = std140_dtype(dtype)
+		self.binding = binding
+		self.name = (name if (name is not None) else ("uniform buffer @%d" % binding))
+		self.context = context
+		self.data = numpy.zeros(1, dtype = self.dtype)
+		self.dirty = True
+		self.uploads = 0
+
+		self.buffer = Buffer(size = self.dtype.itemsize)
+		self.gl_id = self.buffer.gl_id
+		bind_buffer_base(GL_UNIFORM_BUFFER, self.binding, self.gl_id, self.context)
+
+
+	def __getitem__(self, field):
+		"""
+			A view of the field, 0-d for scalars, so that it always writes through
+			(field[...] = value for those). Call touch() after writing into it
+		"""
+		return self.data[field][0, ...]
+
+
+	def __setitem__(self, field, value):
+		width = self.widths.get(field)
+		if (width is None):
+			self.data[0][field] = value
+		else:
+			# the padding stays zero
+			self.data[0][field][..., :width] = numpy.reshape(value, self.data[0][field].shape[:-1] + (width, ))
+		self.dirty = True
+
+
+	def touch(self):
+		""" Flags the block for upload after changes made through views """
+		self.dirty = True
+
+
+	def upload(self):
+		"""
+			Sends the block to the buffer if it changed since the last upload.
+			Meant to be called once per frame, before the draws
+
+			Return:
+				whether a GL call was made
+		"""
+		if (not self.dirty):
+			return False
+		self.buffer.update(self.data)
+		self.dirty = False
+		self.uploads += 1
+		return True
+
+
+	def attach(self, program, block_name):
+		"""
+			Points uniform block `block_name` of `program` at this buffer, after
+			checking that the layout the driver reports matches ours.
+			ShaderException is raised if it doesn't.
+
+			Return:
+				False if the program has no such active block, True otherwise
+		"""
+		block_index = glGetUniformBlockIndex(program.gl_id, block_name)
+		if (block_index == GL_INVALID_INDEX):
+			logger.warning("Program `%s` has no active uniform block `%s`", program.name, block_name)
+			return False
+
+		# PyOpenGL wants the output arrays for these
+		query = numpy.zeros(1, dtype = numpy.int32)
+		glGetActiveUniformBlockiv(program.gl_id, block_index, GL_UNIFORM_BLOCK_DATA_SIZE, query)
+		block_size = int(query[0])
+		if (block_size > self.dtype.itemsize):
+			raise ShaderException("Uniform block `%s` of program `%s` is %d bytes, %s only has %d" % (
+				block_name, program.name, block_size, self.name, self.dtype.itemsize
+			))
+
+		glGetActiveUniformBlockiv(program.gl_id, block_index, GL_UNIFORM_BLOCK_ACTIVE_UNIFORMS, query)
+		member_indices = numpy.zeros(int(query[0]), dtype = numpy.int32)
+		glGetActiveUniformBlockiv(program.gl_id, block_index, GL_UNIFORM_BLOCK_ACTIVE_UNIFORM_INDICES, member_indices)
+		for member_index in member_indices:
+			(m_name, m_size, m_type) = glGetActiveUniform(program.gl_id, int(member_index))
+			m_name = m_name.decode("ascii") if isinstance(m_name, bytes) else m_name
+			# "instance.member" if the block has an instance name, "member[0]" for arrays
+			field = m_name.rsplit(".", 1)[-1]
+			if (field.endswith("[0]")):
+				field = field[:-3]
+			glGetActiveUniformsiv(program.gl_id, 1, numpy.array([member_index], dtype = numpy.uint32), GL_UNIFORM_OFFSET, query)
+			m_offset = int(query[0])
+			if (field not in self.dtype.fields):
+				raise ShaderException("Uniform block `%s` of program `%s` has member `%s`, which %s lacks" % (
+					block_name, program.name, field, self.name
+				))
+			if (int(m_offset) != self.dtype.fields[field][1]):
+				raise ShaderException("Member `%s` of uniform block `%s` of program `%s` is at offset %d, %s has it at %d" % (
+					field, block_name, program.name, m_offset, self.name, self.dtype.fields[field][1]
+				))
+
+		glUniformBlockBinding(program.gl_id, block_index, self.binding)
+		return True
+
+
+	def release(self):
+		self.buffer.release(self.context)
+		self.gl_id = 0
+
+
+
+
+class ProgramCache(object):
+	"""
+		On-disk cache of linked program binaries (glGetProgramBinary()/glProgramBinary()).
+		Entries are keyed by a hash of the shader sources plus GL_VENDOR, GL_RENDERER
+		and GL_VERSION, so driver updates and GPU swaps just miss the cache.
+		Binaries the driver refuses are deleted and rebuilt from source
+	"""
+	def __init__(self, cache_dir = None):
+		"""
+			Arguments:
+				cache_dir:		defaults to PROGRAM_CACHE_DIR in the configuration directory,
+								which needs the configuration loaded
+		"""
+		if (cache_dir is None):
+			if (guc["system"]["config_dir"] is None):
+				raise ValueError("No program cache directory: pass one, or load the configuration first")
+			cache_dir = guc["system"]["config_dir"] + "/" + PROGRAM_CACHE_DIR
+		self.cache_dir = cache_dir
+		self.driver_id = b"\0".join((glGetString(g_string) or b"") for g_string in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+
+		(self.hits, self.misses, self.rejects) = (0, 0, 0)
+
+		format_count = int(glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS))
+		self.formats = (frozenset((int(b_format) for b_format in numpy.ravel(glGetIntegerv(GL_PROGRAM_BINARY_FORMATS)))) if format_count else frozenset())
+		self.enabled = bool(self.formats)
+		if (not self.enabled):
+			logger.info("The driver supports no program binary formats. Program cache disabled")
+			return
+
+		if (not os.path.isdir(self.cache_dir)):
+			try:
+				os.makedirs(self.cache_dir)
+			except OSError:
+				logger.error("Unable to create program cache directory `%s`. Program cache disabled", (self.cache_dir))
+				self.enabled = False
+
+
+	def key(self, sources):
+		""" The cache key of a set of sources, as a hex string """
+		key_hash = hashlib.sha1(self.driver_id)
+		for stage in sorted(sources):
+			key_hash.update(struct.pack("<I", stage))
+			key_hash.update(sources[stage].encode("utf-8"))
+		return key_hash.hexdigest()
+
+
+	def _file(self, sources):
+		return self.cache_dir + "/" + self.key(sources) + ".bin"
+
+
+	def load(self, sources):
+		"""
+			Return:
+				a linked GL program object for `sources`, or None on a miss
+		"""
+		if (not self.enabled):
+			return None
+
+		cache_file = self._file(sources)
+		try:
+			with open(cache_file, "rb") as cache_fp:
+				cached = cache_fp.read()
+		except IOError:
+			self.misses += 1
+			return None
+
+		# file layout: binary format (uint32, little endian) followed by the binary itself
+		program_id = glCreateProgram()
+		if ((len(cached) > 4) and (struct.unpack("<I", cached[:4])[0] in self.formats)):
+			try:
+				glProgramBinary(program_id, struct.unpack("<I", cached[:4])[0], cached[4:], len(cached) - 4)
+				if (glGetProgramiv(program_id, GL_LINK_STATUS)):
+					self.hits += 1
+					return program_id
+			except OpenGL.error.GLError:
+				pass
+
+		# stale or corrupt. It'll be replaced once rebuilt
+		logger.info("Discarding program binary `%s` rejected by the driver", (cache_file))
+		glDeleteProgram(program_id)
+		self.rejects += 1
+		try:
+			os.unlink(cache_file)
+		except OSError:
+			pass
+		return None
+
+
+	def store(self, program_id, sources):
+		"""
+			Saves the binary of a linked program. The program should have been linked
+			with GL_PROGRAM_BINARY_RETRIEVABLE_HINT set
+
+			Return:
+				True if the binary was written
+		"""
+		if (not self.enabled):
+			return False
+
+		binary_size = glGetProgramiv(program_id, GL_PROGRAM_BINARY_LENGTH)
+		if (binary_size <= 0):
+			return False
+
+		binary = ctypes.create_string_buffer(int(binary_size))
+		(binary_len, binary_format) = (GLsizei(), GLenum())
+		glGetProgramBinary(program_id, binary_size, ctypes.byref(binary_len), ctypes.byref(binary_format), binary)
+
+		# same atomic replacement as the configuration file
+		cache_file = self._file(sources)
+		cache_file_tmp = cache_file + ".tmp"
+		try:
+			with open(cache_file_tmp, "wb") as cache_fp:
+				cache_fp.write(struct.pack("<I", binary_format.value))
+				cache_fp.write(binary.raw[:binary_len.value])
+			os.rename(cache_file_tmp, cache_file)
+		except (IOError, OSError):
+			logger.error("Unable to write program binary `%s`", (cache_file))
+			return False
+
+		return True
+
+
+
+
+class ProgramBuilder(object):
+	"""
+		Builds a set of programs while letting the driver overlap the work.
+		Every cache load, compile and link is submitted before any status is
+		queried, as asking for GL_COMPILE_STATUS right after glCompileShader()
+		forces the driver to finish that shader before it sees the next one.
+		With GL_KHR_parallel_shader_compile the driver is also allowed to use
+		its own threads, and completion is polled with GL_COMPLETION_STATUS_KHR.
+
+		Usage:
+			builder = ProgramBuilder(cache)
+			builder.add(sources_a, "a")
+			builder.add(sources_b, "b")
+			(program_a, program_b) = builder.build()
+	"""
+	def __init__(self, cache = None):
+		"""
+			Arguments:
+				cache:		optional ProgramCache to load from and store into
+		"""
+		self.cache = cache
+		# (sources, name) in submission order
+		self.requests = []
+		# request index -> error message, for the last build()
+		self.errors = {}
+		# wall time of the last build(), in seconds
+		self.wall_time = 0.0
+
+		self.parallel = (bool(glMaxShaderCompilerThreadsKHR) and has_extension("GL_KHR_parallel_shader_compile"))
+		if (self.parallel):
+			# let the driver pick the number of threads
+			glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+
+
+	def add(self, sources, name = None):
+		"""
+			Queues a program for the next build()
+
+			Return:
+				the position of the program in the list build() returns
+		"""
+		self.requests.append((sources, name))
+		return (len(self.requests) - 1)
+
+
+	def build(self, raise_errors = True):
+		"""
+			Builds every queued program and empties the queue
+
+			Arguments:
+				raise_errors:	raise ShaderException if any program fails, after all of
+								them have been processed. Otherwise failed programs are
+								None in the result and their logs are in .errors
+
+			Return:
+				list of Program objects, in add() order
+		"""
+		t_start = profiler.clock()
+		(requests, self.requests) = (self.requests, [])
+		self.errors = {}
+		retrievable = ((self.cache is not None) and self.cache.enabled)
+
+		programs = [None] * len(requests)
+		# request index -> (program id, [shader ids]) for what has to go through the compiler
+		building = {}
+
+		# submission: cached binaries, then every compile, then every link
+		for (r_n, (sources, name)) in enumerate(requests):
+			program_id = (self.cache.load(sources) if (self.cache is not None) else None)
+			if (program_id is not None):
+				programs[r_n] = Program(program_id, sources, name = name, from_cache = True)
+				continue
+			shader_ids = []
+			for (stage, source) in sources.items():
+				shader_id = glCreateShader(stage)
+				glShaderSource(shader_id, source)
+				glCompileShader(shader_id)
+				shader_ids.append(shader_id)
+			building[r_n] = (None, shader_ids)
+
+		for (r_n, (program_id, shader_ids)) in building.items():
+			program_id = glCreateProgram()
+			if (retrievable):
+				glProgramParameteri(program_id, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+			for shader_id in shader_ids:
+				glAttachShader(program_id, shader_id)
+			glLinkProgram(program_id)
+			building[r_n] = (program_id, shader_ids)
+
+		if (self.parallel):
+			# nothing to do in the meantime here, but at least we don't block on any single program
+			# (the PyOpenGL wrapper of glGetProgramiv() doesn't know the size of this query).
+			# The driver threads get the core between checks
+			status = ctypes.c_int(0)
+			incomplete = [program_id for (program_id, shader_ids) in building.values()]
+			while (incomplete):
+				still_incomplete = []
+				for program_id in incomplete:
+					raw_glGetProgramiv(program_id, GL_COMPLETION_STATUS_KHR, ctypes.byref(status))
+					if (not status.value):
+						still_incomplete.append(program_id)
+				incomplete = still_incomplete
+				if (incomplete):
+					time.sleep(BUILD_POLL_INTERVAL)
+
+		# collection
+		for (r_n, (program_id, shader_ids)) in building.items():
+			(sources, name) = requests[r_n]
+			if (glGetProgramiv(program_id, GL_LINK_STATUS)):
+				if (self.cache is not None):
+					self.cache.store(program_id, sources)
+				programs[r_n] = Program(program_id, sources, name = name)
+			else:
+				# a failed compile shows up as a failed link. The shader logs are more useful
+				failures = [
+					"%s shader: %s" % (SHADER_STAGE_NAMES.get(glGetShaderiv(shader_id, GL_SHADER_TYPE), "?"), glGetShaderInfoLog(shader_id))
+					for shader_id in shader_ids if (not glGetShaderiv(shader_id, GL_COMPILE_STATUS))
+				] or ["link: %s" % (glGetProgramInfoLog(program_id))]
+				self.errors[r_n] = "Build of program `%s` failed. %s" % ((name if (name is not None) else r_n), "; ".join(failures))
+			for shader_id in shader_ids:
+				glDetachShader(program_id, shader_id)
+				glDeleteShader(shader_id)
+			if (r_n in self.errors):
+				glDeleteProgram(program_id)
+
+		self.wall_time = profiler.clock() - t_start
+		logger.info(
+			"Built %d programs (%d from cache, %d failed) in %.2fms",
+			len(requests), (len(requests) - len(building)), len(self.errors), (self.wall_time * 1000.0)
+		)
+
+		if (self.errors and raise_errors):
+			for program in programs:
+				if (program is not None):
+					program.delete()
+			raise ShaderException("\n".join((self.errors[r_n] for r_n in sorted(self.errors))))
+
+		return programs
+
+
+
+def build_program(sources, cache = None, name = None):
+	"""
+		Returns a Program for `sources`, loaded from `cache` (a ProgramCache) when possible,
+		compiled (and then cached) otherwise. See ProgramBuilder for building several at once
+	"""
+	builder = ProgramBuilder(cache)
+	builder.add(sources, name)
+	return builder.build()[0]
+
+
+
+
+class ShaderManager(object):
+	"""
+		Programs built from shader files, rebuilt when the files change.
+
+		The files are watched on a background thread (see watcher.FileWatcher),
+		but all the GL work happens in update(), which is meant to be called by
+		the main loop between frames. Changed programs are rebuilt together and
+		swapped in one by one only if they build; when they don't the error is
+		logged and the last good program stays in use.
+		Programs must be looked up (manager[name]) every frame, or at least after
+		update() reports them, as the Program object changes with every reload
+	"""
+	def __init__(self, cache = None, watch = True):
+		"""
+			Arguments:
+				cache:		optional ProgramCache
+				watch:		False disables reloading altogether
+		"""
+		self.cache = cache
+		self.watcher = (watcher.FileWatcher() if watch else None)
+		# name -> Program
+		self.programs = {}
+		# name -> {stage: file name}
+		self.files = {}
+		# file name -> set of program names using it
+		self.file_programs = collections.defaultdict(set)
+		self.reloads = 0
+		self.reload_failures = 0
+
+
+	def __getitem__(self, name):
+		return self.programs[name]
+
+
+	def __contains__(self, name):
+		return (name in self.programs)
+
+
+	@staticmethod
+	def read_sources(files):
+		"""
+			Return:
+				{stage: GLSL source} from {stage: file name}
+		"""
+		sources = {}
+		for (stage, file_name) in files.items():
+			with open(file_name, "r") as shader_fp:
+				sources[stage] = shader_fp.read()
+		return sources
+
+
+	def load(self, programs):
+		"""
+			Builds (together) and starts watching programs. ShaderException is raised,
+			and nothing is loaded, if any of them fails.
+
+			Arguments:
+				programs:	{name: files}. files is either {stage: file name} or a
+							list of file names, the stages then follow the
+							extensions (see SHADER_FILE_STAGES)
+
+			Return:
+				the ProgramBuilder used, for its wall_time
+		"""
+		builder = ProgramBuilder(self.cache)
+		all_files = {}
+		for (name, files) in programs.items():
+			if (not isinstance(files, dict)):
+				try:
+					files = dict(((SHADER_FILE_STAGES[os.path.splitext(f_name)[1]], f_name) for f_name in files))
+				except KeyError as e_ext:
+					raise ShaderException("Program `%s`: unknown shader file extension %s" % (name, e_ext))
+			files = dict(((stage, os.path.abspath(f_name)) for (stage, f_name) in files.items()))
+			try:
+				builder.add(self.read_sources(files), name)
+			except (IOError, OSError) as e_read:
+				raise ShaderException("Program `%s`: %s" % (name, e_read))
+			all_files[name] = files
+
+		for (name, program) in zip(programs, builder.build()):
+			if (name in self.programs):
+				self.programs[name].delete()
+			self.programs[name] = program
+			self.files[name] = all_files[name]
+			for file_name in all_files[name].values():
+				self.file_programs[file_name].add(name)
+				if (self.watcher is not None):
+					self.watcher.watch(file_name)
+
+		return builder
+
+
+	def update(self):
+		"""
+			Rebuilds the programs whose files changed since the last call.
+			Must be called with the context current, outside of any draw
+
+			Return:
+				the names of the programs that were replaced
+		"""
+		if (self.watcher is None):
+			return []
+		changed = self.watcher.changed()
+		if (not changed):
+			return []
+
+		names = set()
+		for file_name in changed:
+			names.update(self.file_programs.get(file_name, ()))
+
+		builder = ProgramBuilder(self.cache)
+		pending = []
+		for name in sorted(names):
+			try:
+				builder.add(self.read_sources(self.files[name]), name)
+			except (IOError, OSError) as e_read:
+				# editors briefly leave the file missing. It'll show up as changed again
+				logger.warning("Unable to reload program `%s`: %s", name, e_read)
+				continue
+			pending.append(name)
+
+		replaced = []
+		for (r_n, program) in enumerate(builder.build(raise_errors = False)):
+			name = pending[r_n]
+			if (program is None):
+				self.reload_failures += 1
+				logger.error("%s. Keeping the previous version", builder.errors[r_n])
+				continue
+			self.programs[name].delete()
+			self.programs[name] = program
+			self.reloads += 1
+			replaced.append(name)
+			logger.info("Reloaded program `%s`", name)
+
+		return replaced
+
+
+	def release(self):
+		"""
+			Stops watching and deletes every program
+		"""
+		if (self.watcher is not None):
+			self.watcher.stop()
+			self.watcher = None
+		for program in self.programs.values():
+			program.delete()
+		self.programs.clear()
+
+
+
+
+def bind_vertex_array(vertex_array_id, context = None):
+	""" Binds through `context` when there is one, so that it stays up to date """
+	if (context is not None):
+		context.bind_vertex_array(vertex_array_id)
+	else:
+		gl.glBindVertexArray(vertex_array_id)
+
+
+def bind_buffer(target, buffer_id, context = None):
+	""" Binds through `context` when there is one, so that it stays up to date """
+	if (context is not None):
+		context.bind_buffer(target, buffer_id)
+	else:
+		gl.glBindBuffer(target, buffer_id)
+
+
+def bind_buffer_base(target, index, buffer_id, context = None):
+	""" Binds through `context` when there is one, so that it stays up to date """
+	if (context is not None):
+		context.bind_buffer_base(target, index, buffer_id)
+	else:
+		gl.glBindBufferBase(target, index, buffer_id)
+
+
+def bind_buffer_range(target, index, buffer_id, offset, size, context = None):
+	""" Binds through `context` when there is one, so that it stays up to date """
+	if (context is not None):
+		context.bind_buffer_range(target, index, buffer_id, offset, size)
+	else:
+		gl.glBindBufferRange(target, index, buffer_id, offset, size)
+
+
+
+
+def vertex_attribute_layout(dtype, normalized = ()):
+	"""
+		How the fields of a structured dtype map to vertex attributes.
+		Fields take consecutive locations in order; a field with 2 dimensions
+		(a matrix) takes one location per row. Integer fields reach the shader
+		as integers unless they're listed in `normalized`, in which case they
+		are normalized to floats (e.g. RGBA as 4 uint8)
+
+		Return:
+			a generator of (components, GL type, byte offset, kind, normalize), one per
+			location. kind is "f" for float attributes, "i" for integer and "d" for double ones
+	"""
+	dtype = numpy.dtype(dtype)
+	if (dtype.names is None):
+		raise ValueError("Vertex layouts must be structured dtypes, got %s" % (dtype))
+
+	for f_name in dtype.names:
+		(f_dtype, f_offset) = dtype.fields[f_name][:2]
+		gl_type = VERTEX_ATTRIBUTE_TYPES.get(f_dtype.base)
+		if (gl_type is None):
+			raise ValueError("Field `%s`: no vertex attribute type for %s" % (f_name, f_dtype.base))
+		shape = (f_dtype.shape or (1, ))
+		if ((len(shape) > 2) or (shape[-1] > 4)):
+			raise ValueError("Field `%s`: attributes are up to 4 components, up to 4 of them for matrices. Got %s" % (f_name, shape))
+
+		if (gl_type == GL_DOUBLE):
+			kind = "d"
+		elif ((f_dtype.base.kind in "iu") and (f_name not in normalized)):
+			kind = "i"
+		else:
+			kind = "f"
+		(rows, components) = ((shape[0], shape[1]) if (len(shape) == 2) else (1, shape[0]))
+		for row in range(rows):
+			yield (components, gl_type, (f_offset + (row * components * f_dtype.base.itemsize)), kind, (f_name in normalized))
+
+
+def set_vertex_attributes(dtype, first_location = 0, divisor = 0, normalized = ()):
+	"""
+		Points vertex attributes at the fields of a structured dtype, for the
+		vertex array and GL_ARRAY_BUFFER currently bound, following
+		vertex_attribute_layout(). VertexArray.attach() does the same without binding
+
+		Arguments:
+			dtype:				structured dtype of one vertex (or instance)
+			first_location:		location of the first field
+			divisor:			0 for per-vertex attributes, n to advance once every n instances
+
+		Return:
+			the first location after the ones used
+	"""
+	dtype = numpy.dtype(dtype)
+	location = first_location
+	for (components, gl_type, f_offset, kind, normalize) in vertex_attribute_layout(dtype, normalized):
+		pointer = ctypes.c_void_p(f_offset)
+		if (kind == "d"):
+			glVertexAttribLPointer(location, components, gl_type, dtype.itemsize, pointer)
+		elif (kind == "i"):
+			glVertexAttribIPointer(location, components, gl_type, dtype.itemsize, pointer)
+		else:
+			glVertexAttribPointer(location, components, gl_type, normalize, dtype.itemsize, pointer)
+		glEnableVertexAttribArray(location)
+		if (divisor):
+			glVertexAttribDivisor(location, divisor)
+		location += 1
+
+	return location
+
+
+
+
+def as_buffer(data, dtype = None):
+	"""
+		A NumPy array over the memory of `data`, without copying it.
+		`data` is a NumPy array or any object exporting the buffer protocol
+		(bytes, bytearray, array.array, memoryview, mmap...), and must be
+		contiguous: making it so is a copy, which is for the caller to decide.
+
+		Arguments:
+			dtype:		what the memory holds. Raw buffers are read as this (as
+						bytes by default); NumPy arrays must already be of it,
+						reinterpreting them would only turn their values into garbage
+	"""
+	if (isinstance(data, numpy.ndarray)):
+		if (not data.flags.c_contiguous):
+			raise ValueError("Buffer data must be contiguous. Use numpy.ascontiguousarray()")
+		if ((dtype is not None) and (data.dtype != numpy.dtype(dtype))):
+			raise ValueError("Buffer data is %s, %s expected" % (data.dtype, numpy.dtype(dtype)))
+		return data
+
+	try:
+		array = numpy.frombuffer(data, dtype = numpy.uint8)
+	except (TypeError, ValueError) as e_buffer:
+		raise ValueError("Buffer data must be a contiguous buffer: %s" % (e_buffer))
+	if (dtype is not None):
+		array = array.view(dtype)
+	return array
+
+
+
+def buffer_pointer(array):
+	""" The address of a NumPy array's memory, for GL calls taking data, so that PyOpenGL doesn't convert it """
+	return ctypes.c_void_p(array.ctypes.data)
+
+
+
+
+def _create_name(create, *args):
+	""" One object name from a glCreate*() function, which PyOpenGL wants an output array for """
+	names = numpy.zeros(1, dtype = numpy.uint32)
+	create(*(args + (1, names)))
+	return int(names[0])
+
+
+
+
+class Buffer(object):
+	"""
+		A buffer object, created and updated through direct state access:
+		nothing gets bound to do so. By default the store is immutable in size
+		(glNamedBufferStorage()) but its contents can be updated; with a
+		`usage` hint it is a classic store instead, which respecify() can
+		reallocate.
+
+		Like the other GL object wrappers it is freed by release() (or leaving
+		a `with` block), never by the garbage collector, which may run when
+		no context is current
+	"""
+	def __init__(self, data = None, size = None, flags = GL_DYNAMIC_STORAGE_BIT, usage = None):
+		"""
+			Arguments:
+				data:		initial contents, see as_buffer(). Sets the size
+				size:		size in bytes, when there is no data
+				flags:		glNamedBufferStorage() flags
+				usage:		usage hint (GL_STREAM_DRAW...) for a mutable store. flags is ignored
+		"""
+		if (data is not None):
+			data = as_buffer(data)
+			size = data.nbytes
+		elif (size is None):
+			raise ValueError("Buffers need either data or a size")
+		(self.size, self.flags, self.usage) = (size, flags, usage)
+
+		self.gl_id = _create_name(glCreateBuffers)
+		pointer = (buffer_pointer(data) if (data is not None) else None)
+		if (usage is None):
+			glNamedBufferStorage(self.gl_id, size, pointer, flags)
+		else:
+			gl.glNamedBufferData(self.gl_id, size, pointer, usage)
+
+
+	def update(self, data, offset = 0):
+		"""
+			Overwrites part of the contents, from `offset` bytes on
+		"""
+		data = as_buffer(data)
+		if ((offset + data.nbytes) > self.size):
+			raise ValueError("%d bytes at offset %d overflow the %d of the buffer" % (data.nbytes, offset, self.size))
+		gl.glNamedBufferSubData(self.gl_id, offset, data.nbytes, buffer_pointer(data))
+
+
+	def respecify(self, data):
+		"""
+			Replaces the store with a new one holding `data`. Mutable stores only.
+			The driver hands over fresh memory rather than waiting for the GPU
+			to be done with the old one
+		"""
+		if (self.usage is None):
+			raise ValueError("Only buffers created with a usage hint can be respecified")
+		data = as_buffer(data)
+		gl.glNamedBufferData(self.gl_id, data.nbytes, buffer_pointer(data), self.usage)
+		self.size = data.nbytes
+
+
+	def release(self, context = None):
+		"""
+			Arguments:
+				context:	Context the buffer was bound through, if any, so it forgets the name
+		"""
+		if (self.gl_id):
+			glDeleteBuffers(1, [self.gl_id])
+			if (context is not None):
+				context.forget_buffer(self.gl_id)
+			self.gl_id = 0
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+		return False
+
+
+
+
+class VertexArray(object):
+	"""
+		A vertex array object set up through direct state access. Buffers are
+		attached to binding points with the layout of a structured dtype (see
+		set_vertex_attributes() for the rules)
+	"""
+	def __init__(self):
+		self.gl_id = _create_name(glCreateVertexArrays)
+		# binding point -> attached buffer, and the index buffer, to keep them referenced
+		self.buffers = {}
+		self.index_buffer = None
+
+
+	def attach(self, buffer, dtype, binding = 0, first_location = 0, divisor = 0, normalized = (), offset = 0):
+		"""
+			Sources the attributes described by `dtype` from `buffer`
+
+			Arguments:
+				buffer:				a Buffer, or a buffer name
+				dtype:				structured dtype of one element
+				binding:			vertex buffer binding point
+				first_location:		location of the first field
+				divisor:			0 for per-vertex attributes, n to advance once every n instances
+				normalized:			integer fields to normalize to floats
+				offset:				where the first element starts in the buffer
+
+			Return:
+				the first location after the ones used
+		"""
+		dtype = numpy.dtype(dtype)
+		glVertexArrayVertexBuffer(self.gl_id, binding, getattr(buffer, "gl_id", buffer), offset, dtype.itemsize)
+		location = first_location
+		for (components, gl_type, f_offset, kind, normalize) in vertex_attribute_layout(dtype, normalized):
+			glEnableVertexArrayAttrib(self.gl_id, location)
+			if (kind == "d"):
+				glVertexArrayAttribLFormat(self.gl_id, location, components, gl_type, f_offset)
+			elif (kind == "i"):
+				glVertexArrayAttribIFormat(self.gl_id, location, components, gl_type, f_offset)
+			else:
+				glVertexArrayAttribFormat(self.gl_id, location, components, gl_type, normalize, f_offset)
+			glVertexArrayAttribBinding(self.gl_id, location, binding)
+			location += 1
+		glVertexArrayBindingDivisor(self.gl_id, binding, divisor)
+		self.buffers[binding] = buffer
+		return location
+
+
+	def set_index_buffer(self, buffer):
+		glVertexArrayElementBuffer(self.gl_id, getattr(buffer, "gl_id", buffer))
+		self.index_buffer = buffer
+
+
+	def bind(self, context = None):
+		bind_vertex_array(self.gl_id, context)
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		if (self.gl_id):
+			glDeleteVertexArrays(1, [self.gl_id])
+			if (context is not None):
+				context.forget_vertex_array(self.gl_id)
+			self.gl_id = 0
+		self.buffers.clear()
+		self.index_buffer = None
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+		return False
+
+
+
+
+class Texture(object):
+	"""
+		A 2D texture with immutable storage, set up and filled through direct
+		state access
+	"""
+	def __init__(self, width, height, internal_format = GL_RGBA8, levels = 1, target = GL_TEXTURE_2D):
+		"""
+			Arguments:
+				internal_format:	sized format (GL_RGBA8, GL_DEPTH_COMPONENT24...)
+				levels:				mipmap levels, 0 for the full chain
+				target:				GL_TEXTURE_2D or GL_TEXTURE_RECTANGLE
+		"""
+		(self.width, self.height, self.internal_format, self.target) = (width, height, internal_format, target)
+		self.levels = (levels or self.mip_levels(width, height))
+		self.gl_id = _create_name(glCreateTextures, target)
+		glTextureStorage2D(self.gl_id, self.levels, internal_format, width, height)
+		self.set_filter((GL_LINEAR_MIPMAP_LINEAR if (self.levels > 1) else GL_LINEAR), GL_LINEAR)
+
+
+	@staticmethod
+	def mip_levels(width, height):
+		""" Number of levels of a full mipmap chain """
+		return max(int(width), int(height), 1).bit_length()
+
+
+	def upload(self, pixels, level = 0, x = 0, y = 0, width = None, height = None, pixel_format = GL_RGBA, pixel_type = None):
+		"""
+			Writes pixels into a level, the whole of it by default
+
+			Arguments:
+				pixels:			a NumPy array (or see as_buffer()) of rows from the
+								bottom, or a byte offset in the GL_PIXEL_UNPACK_BUFFER
+								currently bound
+				pixel_format:	GL_RGBA, GL_RGB, GL_RED...
+				pixel_type:		defaults to the one of the array's dtype, GL_UNSIGNED_BYTE for offsets
+		"""
+		width = (width if (width is not None) else max(1, (self.width >> level)))
+		height = (height if (height is not None) else max(1, (self.height >> level)))
+		if (isinstance(pixels, int)):
+			pointer = ctypes.c_void_p(pixels)
+			pixel_type = (pixel_type or GL_UNSIGNED_BYTE)
+			row_bytes = None
+		else:
+			pixels = as_buffer(pixels)
+			pixel_type = (pixel_type or PIXEL_TYPES.get(pixels.dtype.base))
+			if (pixel_type is None):
+				raise ValueError("No pixel type for %s" % (pixels.dtype))
+			pointer = buffer_pointer(pixels)
+			row_bytes = (pixels.nbytes // height)
+
+		# rows are 4 bytes aligned unless told otherwise
+		packed = ((row_bytes is not None) and (row_bytes % 4))
+		if (packed):
+			glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+		glTextureSubImage2D(self.gl_id, level, x, y, width, height, pixel_format, pixel_type, pointer)
+		if (packed):
+			glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+
+	def generate_mipmaps(self):
+		glGenerateTextureMipmap(self.gl_id)
+
+
+	def set_filter(self, min_filter, mag_filter):
+		glTextureParameteri(self.gl_id, GL_TEXTURE_MIN_FILTER, min_filter)
+		glTextureParameteri(self.gl_id, GL_TEXTURE_MAG_FILTER, mag_filter)
+
+
+	def set_wrap(self, wrap_s, wrap_t):
+		glTextureParameteri(self.gl_id, GL_TEXTURE_WRAP_S, wrap_s)
+		glTextureParameteri(self.gl_id, GL_TEXTURE_WRAP_T, wrap_t)
+
+
+	def bind(self, unit, context = None):
+		""" Binds to texture unit `unit` (a number), through `context` if specified """
+		if (context is not None):
+			context.bind_texture(self.target, self.gl_id, unit = unit)
+		else:
+			glBindTextureUnit(unit, self.gl_id)
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		if (self.gl_id):
+			glDeleteTextures(1, [self.gl_id])
+			if (context is not None):
+				context.forget_texture(self.gl_id)
+			self.gl_id = 0
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+		return False
+
+
+
+
+class Framebuffer(object):
+	"""
+		A framebuffer object with textures attached, set up and cleared through
+		direct state access. Only drawing into it needs it bound
+	"""
+	def __init__(self):
+		self.gl_id = _create_name(glCreateFramebuffers)
+		# attachment point (GL_COLOR_ATTACHMENT0...) -> Texture
+		self.attachments = {}
+
+
+	def attach(self, attachment, texture, level = 0):
+		glNamedFramebufferTexture(self.gl_id, attachment, getattr(texture, "gl_id", texture), level)
+		self.attachments[attachment] = texture
+
+
+	def draw_buffers(self, attachments):
+		""" Which color attachments fragment outputs 0, 1... go to """
+		glNamedFramebufferDrawBuffers(self.gl_id, len(attachments), numpy.array(attachments, dtype = numpy.uint32))
+
+
+	def check(self):
+		""" Raises FramebufferException if the framebuffer can't be drawn into """
+		status = glCheckNamedFramebufferStatus(self.gl_id, GL_FRAMEBUFFER)
+		if (status != GL_FRAMEBUFFER_COMPLETE):
+			raise FramebufferException("Framebuffer %d is incomplete, status 0x%04x" % (self.gl_id, status))
+
+
+	def clear_color(self, rgba, draw_buffer = 0):
+		glClearNamedFramebufferfv(self.gl_id, GL_COLOR, draw_buffer, numpy.array(rgba, dtype = numpy.float32))
+
+
+	def clear_depth(self, depth = 1.0):
+		glClearNamedFramebufferfv(self.gl_id, GL_DEPTH, 0, numpy.array([depth], dtype = numpy.float32))
+
+
+	def bind(self, target = GL_FRAMEBUFFER):
+		glBindFramebuffer(target, self.gl_id)
+
+
+	def release(self):
+		if (self.gl_id):
+			glDeleteFramebuffers(1, [self.gl_id])
+			self.gl_id = 0
+		self.attachments.clear()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+		return False
+
+
+
+
+class Mesh(object):
+	"""
+		Vertex (and optionally index) data in GPU buffers, with the vertex
+		array that describes it. Vertex attributes follow the dtype of the
+		vertices (see set_vertex_attributes()), starting at location 0.
+		Data goes to GL straight from the memory it lives in
+	"""
+	def __init__(self,
+		vertices,
+		indices = None,
+		vertex_dtype = None,
+		index_dtype = None,
+		normalized = (),
+		mode = GL_TRIANGLES
+	):
+		"""
+			Arguments:
+				vertices:		see as_buffer(). A structured array describes the attributes
+								itself; plain arrays of shape (vertex count, components)
+								become a single attribute
+				indices:		see as_buffer(). uint8, uint16 or uint32. None draws the
+								vertices in order
+				vertex_dtype:	structured dtype of one vertex. Raw buffers are read as
+								this, NumPy arrays must already be of it
+				index_dtype:	type of the indices. Raw buffers are read as this, NumPy
+								arrays must already be of it
+				normalized:		vertex fields to normalize, see set_vertex_attributes()
+				mode:			primitive type
+		"""
+		vertices = self._as_vertices(as_buffer(vertices, vertex_dtype))
+		indices = (as_buffer(indices, index_dtype) if (indices is not None) else None)
+		if ((indices is not None) and (indices.dtype not in INDEX_TYPES)):
+			raise ValueError("Indices must be uint8, uint16 or uint32, got %s" % (indices.dtype))
+
+		self.vertex_dtype = vertices.dtype
+		self.vertex_count = vertices.size
+		self.mode = mode
+
+		self.vertex_buffer = Buffer(vertices)
+		self.layout = VertexArray()
+		# where whoever extends the vertex array (e.g. with instance data) can start
+		self.next_location = self.layout.attach(self.vertex_buffer, self.vertex_dtype, normalized = normalized)
+
+		(self.index_buffer, self.index_count, self.index_type) = (None, 0, None)
+		if (indices is not None):
+			(self.index_count, self.index_type) = (indices.size, INDEX_TYPES[indices.dtype])
+			self.index_buffer = Buffer(indices)
+			self.layout.set_index_buffer(self.index_buffer)
+
+
+	@property
+	def vertex_array(self):
+		""" Name of the vertex array object """
+		return self.layout.gl_id
+
+
+	@staticmethod
+	def _as_vertices(vertices):
+		""" Plain (vertex count, components) arrays as a single `position` attribute """
+		if (vertices.dtype.names is not None):
+			return vertices
+		if (vertices.ndim != 2):
+			raise ValueError("Plain vertex arrays must be (vertex count, components), got shape %s" % (vertices.shape, ))
+		return vertices.view(numpy.dtype([("position", vertices.dtype, (vertices.shape[-1], ))])).reshape(-1)
+
+
+	def update_vertices(self, vertices, first = 0):
+		"""
+			Overwrites vertices from `first` on, in place. The buffer doesn't grow.
+			NumPy arrays must be of the mesh's vertex dtype (or plain ones of its
+			single attribute), other buffers are read as it
+		"""
+		if (isinstance(vertices, numpy.ndarray)):
+			vertices = self._as_vertices(as_buffer(vertices))
+			if (vertices.dtype != self.vertex_dtype):
+				raise ValueError("Vertices are %s, the mesh takes %s" % (vertices.dtype, self.vertex_dtype))
+		else:
+			vertices = as_buffer(vertices, self.vertex_dtype)
+		if ((first + vertices.size) > self.vertex_count):
+			raise ValueError("%d vertices from %d overflow the %d of the mesh" % (vertices.size, first, self.vertex_count))
+		self.vertex_buffer.update(vertices, (first * self.vertex_dtype.itemsize))
+
+
+	def draw(self, context = None):
+		"""
+			Draws the whole mesh. The program must be in use already
+		"""
+		bind_vertex_array(self.layout.gl_id, context)
+		if (self.index_type is not None):
+			gl.glDrawElements(self.mode, self.index_count, self.index_type, None)
+		else:
+			gl.glDrawArrays(self.mode, 0, self.vertex_count)
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		self.layout.release(context)
+		self.vertex_buffer.release(context)
+		if (self.index_buffer is not None):
+			self.index_buffer.release(context)
+
+
+
+
+class InstancedBatch(object):
+	"""
+		Draws many copies of one indexed mesh with a single call.
+		Per-instance attributes come from a NumPy array with a structured dtype,
+		uploaded whole before every draw and stepped once per instance
+		(glVertexAttribDivisor()). e.g. for sprites:
+
+			QUAD_INSTANCE = numpy.dtype([("offset", numpy.float32, (2, )), ("scale", numpy.float32), ("rgba", numpy.uint8, (4, ))])
+			batch = InstancedBatch(quad_vertices, quad_indices, QUAD_INSTANCE, normalized = ("rgba", ))
+			...
+			batch.draw(sprites)
+
+		The mesh attributes start at location 0, the instance ones follow
+	"""
+	def __init__(self, vertices, indices, instance_dtype, normalized = (), mode = GL_TRIANGLES):
+		"""
+			Arguments:
+				vertices:		mesh vertices, see Mesh
+				indices:		mesh indices, see Mesh
+				instance_dtype:	structured dtype of one instance
+				normalized:		instance fields to normalize, see set_vertex_attributes()
+				mode:			primitive type
+		"""
+		if (indices is None):
+			raise ValueError("Instanced batches need an indexed mesh")
+		self.mesh = Mesh(vertices, indices, mode = mode)
+		self.instance_dtype = numpy.dtype(instance_dtype)
+		self.draws = 0
+
+		self.instance_buffer = Buffer(size = 0, usage = GL_STREAM_DRAW)
+		self.mesh.layout.attach(
+			self.instance_buffer, self.instance_dtype,
+			binding = 1, first_location = self.mesh.next_location, divisor = 1, normalized = normalized
+		)
+
+
+	def draw(self, instances, context = None):
+		"""
+			Uploads `instances` (array of instance_dtype) and draws them all.
+			The program must be in use already
+
+			Arguments:
+				context:		Context to bind the vertex array through, if any
+		"""
+		instances = as_buffer(instances)
+		if (instances.dtype != self.instance_dtype):
+			raise ValueError("Instances are %s, the batch takes %s" % (instances.dtype, self.instance_dtype))
+		if (not instances.size):
+			return
+
+		self.instance_buffer.respecify(instances)
+		bind_vertex_array(self.mesh.vertex_array, context)
+		gl.glDrawElementsInstanced(self.mesh.mode, self.mesh.index_count, self.mesh.index_type, None, instances.size)
+		self.draws += 1
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		self.instance_buffer.release(context)
+		self.mesh.release(context)
+
+
+
+
+class StreamBuffer(object):
+	"""
+		A buffer for data rewritten every frame, split into `regions` regions
+		used in rotation. The whole store is mapped once, persistently and
+		coherently, and every region is a NumPy view straight on it: what's
+		written into the view is what the GPU reads, with no upload call.
+
+		A fence is placed after the commands using a region; the region is
+		written again only after the fence has signaled, which with 3 regions
+		is normally long done. Per frame:
+
+			vertices = stream.begin()		# waits if the GPU is still reading this region
+			vertices[:count] = ...
+			(draw, sourcing from stream.gl_id at stream.offset)
+			stream.end()					# fences the region
+	"""
+	def __init__(self, region_size, regions = 3, dtype = None, target = GL_ARRAY_BUFFER):
+		"""
+			Arguments:
+				region_size:	bytes per region. Rounded up to STREAM_REGION_ALIGNMENT
+				regions:		number of regions. 3 lets the CPU write one while the
+								GPU may still be reading the other two
+				dtype:			what the region views hold. Bytes by default
+				target:			target bind_range() binds the buffer to
+		"""
+		if (regions < 1):
+			raise ValueError("A stream buffer needs at least 1 region, got %s" % (regions))
+		self.dtype = numpy.dtype(numpy.uint8 if (dtype is None) else dtype)
+		self.region_size = ((region_size + STREAM_REGION_ALIGNMENT - 1) // STREAM_REGION_ALIGNMENT) * STREAM_REGION_ALIGNMENT
+		self.regions = regions
+		self.size = self.region_size * regions
+		self.target = target
+
+		flags = (GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT)
+		self.buffer = Buffer(size = self.size, flags = flags)
+		self.gl_id = self.buffer.gl_id
+		address = glMapNamedBufferRange(self.gl_id, 0, self.size, flags)
+		if (not address):
+			self.buffer.release()
+			raise BufferException("Unable to map %d bytes of stream buffer" % (self.size))
+
+		self.mapping = numpy.ctypeslib.as_array((ctypes.c_ubyte * self.size).from_address(address))
+		# whole elements only
+		region_items = self.region_size // self.dtype.itemsize
+		self.views = [
+			self.mapping[(r_n * self.region_size):((r_n * self.region_size) + (region_items * self.dtype.itemsize))].view(self.dtype)
+			for r_n in range(regions)
+		]
+		self.fences = [None] * regions
+
+		# region being written, -1 before the first begin()
+		self.region = -1
+		# fence waits: regions reused, how many of them had to wait and for how long
+		self.reuses = 0
+		self.waits = 0
+		self.wait_time = 0.0
+		self.max_wait = 0.0
+
+
+	@property
+	def offset(self):
+		""" Byte offset of the current region in the buffer """
+		return (self.region * self.region_size)
+
+
+	def begin(self):
+		"""
+			Moves to the next region, waiting for the GPU to be done with it if needed
+
+			Return:
+				the NumPy view of the region
+		"""
+		self.region = (self.region + 1) % self.regions
+		fence = self.fences[self.region]
+		if (fence is not None):
+			self.reuses += 1
+			status = glClientWaitSync(fence, 0, 0)
+			if (status not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED)):
+				t_start = profiler.clock()
+				while (status == GL_TIMEOUT_EXPIRED):
+					status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, STREAM_WAIT_SLICE)
+				waited = profiler.clock() - t_start
+				self.waits += 1
+				self.wait_time += waited
+				self.max_wait = max(self.max_wait, waited)
+				if (status == GL_WAIT_FAILED):
+					logger.error("Waiting on the fence of stream buffer region %d failed", self.region)
+			glDeleteSync(fence)
+			self.fences[self.region] = None
+		return self.views[self.region]
+
+
+	def end(self):
+		"""
+			Fences the current region. To be called after the last command reading it
+		"""
+		self.fences[self.region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+
+	def bind_range(self, index, target = None, context = None):
+		"""
+			Binds the current region to an indexed binding point (uniform or
+			shader storage buffers), through `target` or the creation one.
+			Through `context` too, if there is one
+		"""
+		bind_buffer_range((self.target if (target is None) else target), index, self.gl_id, self.offset, self.region_size, context)
+
+
+	def wait_stats(self):
+		"""
+			Return:
+				dictionary of reuses, waits, wait_ratio, total_ms and max_ms
+		"""
+		return {
+			"reuses": self.reuses,
+			"waits": self.waits,
+			"wait_ratio": ((float(self.waits) / self.reuses) if self.reuses else 0.0),
+			"total_ms": (self.wait_time * 1000.0),
+			"max_ms": (self.max_wait * 1000.0)
+		}
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		if (not self.gl_id):
+			return
+		for fence in self.fences:
+			if (fence is not None):
+				glDeleteSync(fence)
+		self.fences = [None] * self.regions
+		(self.views, self.mapping) = ([], None)
+		glUnmapNamedBuffer(self.gl_id)
+		self.buffer.release(context)
+		self.gl_id = 0
+
+
+
+
+def render_key(program, vertex_array, texture = 0, uniform_slot = NO_UNIFORM_SLOT):
+	"""
+		Packs the state of a draw in a 64 bits sort key. Works on scalars and
+		NumPy arrays alike. GL object names must fit in 16 bits
+	"""
+	return (
+		(numpy.uint64(program) << numpy.uint64(48)) |
+		(numpy.uint64(vertex_array) << numpy.uint64(32)) |
+		(numpy.uint64(texture) << numpy.uint64(16)) |
+		numpy.uint64(uniform_slot)
+	)
+
+
+
+class RenderQueue(object):
+	"""
+		Collects draw commands during the frame and submits them in one go, in
+		the order that needs the fewest state changes. Commands are sorted by
+		their state key (see render_key()) and then by where their indices
+		start. Neighbours with the same state whose index ranges are contiguous
+		become a single draw, for list primitives (see RENDER_MERGEABLE_MODES).
+
+		Textures are bound to unit 0 as GL_TEXTURE_2D. A uniform slot is a
+		range of the slot buffer (uniform_slots) bound to its binding point,
+		typically one set of per-object values in a larger uniform buffer.
+
+			queue = RenderQueue(context)
+			...
+			queue.submit_mesh(program, mesh, texture = tex)
+			...
+			queue.flush()
+	"""
+	def __init__(self, context, capacity = RENDER_QUEUE_CAPACITY, uniform_slots = None):
+		"""
+			Arguments:
+				context:		the Context state changes go through
+				capacity:		commands to preallocate room for
+				uniform_slots:	(buffer, binding point, slot size in bytes) for the
+								uniform slots of commands. The slot size must be a
+								multiple of GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT
+		"""
+		self.context = context
+		self.commands = numpy.zeros(capacity, dtype = RENDER_COMMAND)
+		self.count = 0
+		self.uniform_slots = uniform_slots
+		# slot bound to the binding point, as far as we know
+		self.bound_slot = None
+
+		# last flush, and overall
+		self.frame_commands = 0
+		self.frame_batches = 0
+		self.frame_state_changes = 0
+		self.total_commands = 0
+		self.total_batches = 0
+		self.total_state_changes = 0
+
+
+	def _reserve(self, count):
+		""" Room for `count` more commands """
+		if ((self.count + count) > len(self.commands)):
+			capacity = len(self.commands)
+			while (capacity < (self.count + count)):
+				capacity *= 2
+			logger.info("Growing the render queue to %d commands", capacity)
+			commands = numpy.zeros(capacity, dtype = RENDER_COMMAND)
+			commands[:self.count] = self.commands[:self.count]
+			self.commands = commands
+
+
+	def submit(self,
+		program,
+		vertex_array,
+		first,
+		count,
+		texture = 0,
+		uniform_slot = NO_UNIFORM_SLOT,
+		mode = GL_TRIANGLES,
+		index_type = GL_UNSIGNED_INT,
+		base_vertex = 0
+	):
+		"""
+			Queues a draw of `count` indices (vertices if index_type is 0) from `first`.
+			program, vertex_array and texture are GL object names
+		"""
+		if ((program | vertex_array | texture) > 0xFFFF):
+			raise ValueError("GL object names in render commands must fit in 16 bits")
+		if ((uniform_slot < 0) or (uniform_slot > NO_UNIFORM_SLOT)):
+			raise ValueError("Uniform slots must fit in 16 bits, got %d" % (uniform_slot))
+		self._reserve(1)
+		command = self.commands[self.count]
+		command["key"] = render_key(program, vertex_array, texture, uniform_slot)
+		(command["program"], command["vertex_array"], command["texture"], command["uniform_slot"]) = (program, vertex_array, texture, uniform_slot)
+		(command["mode"], command["index_type"], command["first"], command["count"], command["base_vertex"]) = (mode, index_type, first, count, base_vertex)
+		self.count += 1
+
+
+	def submit_mesh(self, program, mesh, texture = 0, uniform_slot = NO_UNIFORM_SLOT):
+		""" Queues a draw of a whole Mesh with a Program """
+		self.submit(
+			program.gl_id, mesh.vertex_array,
+			0, (mesh.index_count if (mesh.index_type is not None) else mesh.vertex_count),
+			texture = texture, uniform_slot = uniform_slot,
+			mode = mesh.mode, index_type = (mesh.index_type or 0)
+		)
+
+
+	def submit_many(self, commands):
+		"""
+			Queues an array of RENDER_COMMAND at once. Their keys are computed here
+		"""
+		commands = numpy.asarray(commands, dtype = RENDER_COMMAND)
+		if (len(commands) and ((commands["program"] | commands["vertex_array"] | commands["texture"]).max() > 0xFFFF)):
+			raise ValueError("GL object names in render commands must fit in 16 bits")
+		if (len(commands) and (commands["uniform_slot"].max() > NO_UNIFORM_SLOT)):
+			raise ValueError("Uniform slots must fit in 16 bits, got %d" % (commands["uniform_slot"].max()))
+		self._reserve(len(commands))
+		added = self.commands[self.count:(self.count + len(commands))]
+		added[:] = commands
+		added["key"] = render_key(added["program"], added["vertex_array"], added["texture"], added["uniform_slot"])
+		self.count += len(commands)
+
+
+	def clear(self):
+		""" Drops the queued commands """
+		self.count = 0
+
+
+	@profiler.profiled("RenderQueue.flush")
+	def flush(self):
+		"""
+			Sorts, merges and draws the queued commands, and empties the queue
+		"""
+		context = self.context
+		issued_before = context.calls_issued
+		commands = self.commands[:self.count]
+
+		# by state, then by first index so that contiguous ranges end up next to each other
+		commands = commands[numpy.lexsort((commands["first"], commands["key"]))]
+
+		# a batch starts wherever a command can't extend the previous one
+		starts = numpy.ones(len(commands), dtype = bool)
+		if (len(commands) > 1):
+			(previous, current) = (commands[:-1], commands[1:])
+			starts[1:] = (
+				(current["key"] != previous["key"]) |
+				(current["mode"] != previous["mode"]) |
+				(~numpy.isin(current["mode"], RENDER_MERGEABLE_MODES)) |
+				(current["index_type"] != previous["index_type"]) |
+				(current["base_vertex"] != previous["base_vertex"]) |
+				(current["first"] != (previous["first"] + previous["count"]))
+			)
+		batch_starts = numpy.flatnonzero(starts)
+		batch_counts = (numpy.add.reduceat(commands["count"], batch_starts) if len(batch_starts) else [])
+
+		for (batch_start, batch_count) in zip(batch_starts.tolist(), numpy.asarray(batch_counts).tolist()):
+			(program, vertex_array, texture, uniform_slot, mode, index_type, first, count, base_vertex) = commands[batch_start].tolist()[1:]
+			context.use_program(program)
+			context.bind_vertex_array(vertex_array)
+			context.bind_texture(GL_TEXTURE_2D, texture, unit = 0)
+			if ((uniform_slot != NO_UNIFORM_SLOT) and (uniform_slot != self.bound_slot) and (self.uniform_slots is not None)):
+				(slot_buffer, slot_binding, slot_size) = self.uniform_slots
+				context.bind_buffer_range(GL_UNIFORM_BUFFER, slot_binding, slot_buffer, (uniform_slot * slot_size), slot_size)
+				self.bound_slot = uniform_slot
+
+			if (not index_type):
+				gl.glDrawArrays(mode, first, batch_count)
+			elif (base_vertex):
+				gl.glDrawElementsBaseVertex(mode, batch_count, index_type, ctypes.c_void_p(first * INDEX_SIZES[index_type]), base_vertex)
+			else:
+				gl.glDrawElements(mode, batch_count, index_type, ctypes.c_void_p(first * INDEX_SIZES[index_type]))
+
+		self.frame_commands = self.count
+		self.frame_batches = len(batch_starts)
+		self.frame_state_changes = (context.calls_issued - issued_before)
+		self.total_commands += self.frame_commands
+		self.total_batches += self.frame_batches
+		self.total_state_changes += self.frame_state_changes
+		self.count = 0
+
+
+	def stats(self):
+		"""
+			Return:
+				dictionary of commands, batches and state changes of the last flush
+		"""
+		return {
+			"commands": self.frame_commands,
+			"batches": self.frame_batches,
+			"state_changes": self.frame_state_changes
+		}
+
+
+
+
+class MeshPool(object):
+	"""
+		Many meshes with the same vertex format in one vertex buffer and one
+		index buffer, drawn with a single glMultiDrawElementsIndirect().
+		The draw commands are built from a NumPy array of mesh ids without
+		looping in Python, so the cost of a draw doesn't depend on how many
+		meshes it covers.
+
+		Space is handed out in order and only given back all at once (clear()):
+		the pool is meant for level geometry and the like, loaded together.
+		The instances of each draw follow those of the draw before it: base
+		instances are the running total of the instance counts, so instanced
+		attributes (or gl_BaseInstance + gl_InstanceID) can read per-instance
+		data laid out draw after draw
+
+			pool = MeshPool(VERTEX, 1 << 20, 1 << 22)
+			rock = pool.add(rock_vertices, rock_indices)
+			tree = pool.add(tree_vertices, tree_indices)
+			...
+			pool.draw(numpy.array([rock, tree, tree]))
+	"""
+	def __init__(self,
+		vertex_dtype,
+		vertex_capacity,
+		index_capacity,
+		index_dtype = numpy.uint32,
+		normalized = (),
+		mode = GL_TRIANGLES
+	):
+		"""
+			Arguments:
+				vertex_dtype:		structured dtype of one vertex, see set_vertex_attributes()
+				vertex_capacity:	vertices the pool can hold
+				index_capacity:		indices the pool can hold
+				index_dtype:		uint8, uint16 or uint32
+				normalized:			vertex fields to normalize
+				mode:				primitive type
+		"""
+		self.vertex_dtype = numpy.dtype(vertex_dtype)
+		self.index_dtype = numpy.dtype(index_dtype)
+		self.index_type = INDEX_TYPES.get(self.index_dtype)
+		if (self.index_type is None):
+			raise ValueError("Indices must be uint8, uint16 or uint32, got %s" % (self.index_dtype))
+		(self.vertex_capacity, self.index_capacity) = (vertex_capacity, index_capacity)
+		self.mode = mode
+
+		# space used so far
+		(self.vertex_count, self.index_count) = (0, 0)
+		# mesh id -> MESH_POOL_RECORD
+		self.meshes = numpy.zeros(64, dtype = MESH_POOL_RECORD)
+		self.mesh_count = 0
+		self.draws = 0
+
+		self.vertex_buffer = Buffer(size = (vertex_capacity * self.vertex_dtype.itemsize))
+		self.index_buffer = Buffer(size = (index_capacity * self.index_dtype.itemsize))
+		self.command_buffer = Buffer(size = 0, usage = GL_STREAM_DRAW)
+		self.layout = VertexArray()
+		self.layout.attach(self.vertex_buffer, self.vertex_dtype, normalized = normalized)
+		self.layout.set_index_buffer(self.index_buffer)
+
+
+	def add(self, vertices, indices):
+		"""
+			Copies a mesh into the pool. Its indices count from its own first vertex
+
+			Arguments:
+				vertices:		see as_buffer(). NumPy arrays must be of the pool's vertex
+								dtype, other buffers are read as that
+				indices:		see as_buffer(). NumPy arrays must be of the pool's index
+								type, other buffers are read as that
+
+			Return:
+				the mesh id, for draw()
+		"""
+		vertices = as_buffer(vertices, self.vertex_dtype)
+		indices = as_buffer(indices, self.index_dtype)
+		if (((self.vertex_count + vertices.size) > self.vertex_capacity) or ((self.index_count + indices.size) > self.index_capacity)):
+			raise ValueError("Mesh pool full: %d/%d vertices and %d/%d indices used, %d and %d more requested" % (
+				self.vertex_count, self.vertex_capacity, self.index_count, self.index_capacity, vertices.size, indices.size
+			))
+
+		self.vertex_buffer.update(vertices, (self.vertex_count * self.vertex_dtype.itemsize))
+		self.index_buffer.update(indices, (self.index_count * self.index_dtype.itemsize))
+
+		if (self.mesh_count == len(self.meshes)):
+			self.meshes = numpy.concatenate((self.meshes, numpy.zeros(len(self.meshes), dtype = MESH_POOL_RECORD)))
+		self.meshes[self.mesh_count] = (self.index_count, indices.size, self.vertex_count)
+		self.vertex_count += vertices.size
+		self.index_count += indices.size
+		self.mesh_count += 1
+		return (self.mesh_count - 1)
+
+
+	def commands(self, mesh_ids, instance_counts = 1):
+		"""
+			Return:
+				the DRAW_ELEMENTS_INDIRECT_COMMAND array drawing `mesh_ids` (array of ids)
+		"""
+		records = self.meshes[:self.mesh_count][mesh_ids]
+		commands = numpy.empty(len(records), dtype = DRAW_ELEMENTS_INDIRECT_COMMAND)
+		commands["count"] = records["index_count"]
+		commands["instance_count"] = instance_counts
+		commands["first_index"] = records["first_index"]
+		commands["base_vertex"] = records["base_vertex"]
+		# exclusive running total, so that no two draws share instance data
+		commands["base_instance"] = numpy.cumsum(commands["instance_count"]) - commands["instance_count"]
+		return commands
+
+
+	def draw(self, mesh_ids = None, instance_counts = 1, context = None):
+		"""
+			Draws meshes (all of them if None, once each) with one call.
+			The program must be in use already
+
+			Arguments:
+				mesh_ids:			array of mesh ids, repeats allowed
+				instance_counts:	instances of every mesh, or array of them
+				context:			Context to bind through, if any
+		"""
+		if (mesh_ids is None):
+			mesh_ids = numpy.arange(self.mesh_count)
+		commands = self.commands(mesh_ids, instance_counts)
+		if (not len(commands)):
+			return
+
+		# respecified each time, so we don't wait for the previous draw to be done with it
+		self.command_buffer.respecify(commands)
+		bind_buffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer.gl_id, context)
+		bind_vertex_array(self.layout.gl_id, context)
+		gl.glMultiDrawElementsIndirect(self.mode, self.index_type, None, len(commands), 0)
+		self.draws += 1
+
+
+	def clear(self):
+		""" Forgets every mesh. Their space is reused by the next ones """
+		(self.vertex_count, self.index_count, self.mesh_count) = (0, 0, 0)
+
+
+	@property
+	def vertex_array(self):
+		""" Name of the vertex array object """
+		return self.layout.gl_id
+
+
+	def release(self, context = None):
+		""" See Buffer.release() """
+		self.layout.release(context)
+		for buffer in (self.vertex_buffer, self.index_buffer, self.command_buffer):
+			buffer.release(context)
@@ -0,0 +1,265 @@
+#!/usr/bin/python -uB
+
+"""
+	Frame time profiler for Celeritas.
+
+	Code is instrumented with named zones, either as context managers:
+
+		with profiler.zone("draw"):
+			...
+
+	or as decorators (@profiler.profiled()). The end of every frame is marked
+	with frame_mark(). While enabled, every zone is recorded for the trace
+	export and its time is accumulated per frame into a fixed size history,
+	over which rolling percentiles are computed.
+
+	The instrumentation stays in place in production: when disabled a zone
+	costs a global lookup and returns a shared no-op object
+"""
+import os
+import json
+import time
+import timeit
+import logging
+import threading
+import functools
+import collections
+
+import numpy
+
+
+from celeritas.config import guc
+
+
+logger = logging.getLogger(__name__)
+
+
+# frames worth of per-frame timings kept for the statistics
+FRAME_HISTORY = 1024
+
+# completed zones kept for the trace export. The oldest are discarded first
+TRACE_CAPACITY = 262144
+
+# name under which whole frames are accounted
+FRAME_ZONE = "frame"
+
+
+
+clock = timeit.default_timer
+
+enabled = False
+
+# (name, start, end, thread id) of completed zones, clock() units
+trace_events = collections.deque(maxlen = TRACE_CAPACITY)
+
+# zone name -> seconds spent in it during the frame in progress
+frame_totals = {}
+
+# zone name -> ZoneHistory
+histories = {}
+
+# clock() at the previous frame mark
+frame_start = None
+
+# clock() when profiling was enabled, the origin of trace timestamps
+trace_origin = clock()
+
+
+
+
+class ZoneHistory(object):
+	"""
+		Ring buffer of per-frame times for one zone
+	"""
+	def __init__(self, size = FRAME_HISTORY):
+		self.times = numpy.zeros(size, dtype = numpy.float64)
+		self.size = size
+		# total number of frames ever stored. The next one goes to (count % size)
+		self.count = 0
+
+	def push(self, seconds):
+		self.times[self.count % self.size] = seconds
+		self.count += 1
+
+	def stats(self):
+		"""
+			Return:
+				dictionary of count, mean, max, p50, p95 and p99 over the
+				retained frames, in milliseconds. None if there are none yet
+		"""
+		if (self.count == 0):
+			return None
+		window = self.times[:min(self.count, self.size)] * 1000.0
+		(p50, p95, p99) = numpy.percentile(window, (50, 95, 99))
+		return {
+			"count": len(window),
+			"mean": float(window.mean()),
+			"max": float(window.max()),
+			"p50": float(p50),
+			"p95": float(p95),
+			"p99": float(p99)
+		}
+
+
+
+class _NullZone(object):
+	""" What zone() hands out while disabled """
+	__slots__ = ()
+	def __enter__(self): return self
+	def __exit__(self, exc_type, exc_value, traceback): return False
+
+NULL_ZONE = _NullZone()
+
+
+
+class _Zone(object):
+	__slots__ = ("name", "start")
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = clock()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		record(self.name, self.start, clock())
+		return False
+
+
+
+
+def enable(flag = True):
+	"""
+		Turns profiling on or off. Timings collected so far are kept
+	"""
+	global enabled, frame_start, trace_origin
+	if (flag and (not enabled)):
+		if (not trace_events):
+			trace_origin = clock()
+		# the frame in progress started before we were watching
+		frame_start = None
+		frame_totals.clear()
+	enabled = bool(flag)
+
+
+
+def zone(name):
+	"""
+		Context manager timing the enclosed block as zone `name`
+	"""
+	if (not enabled):
+		return NULL_ZONE
+	return _Zone(name)
+
+
+
+def profiled(name = None):
+	"""
+		Decorator timing every call of the function as zone `name`
+		(module.function if not specified)
+	"""
+	def decorate(func):
+		z_name = name or ("%s.%s" % (func.__module__, func.__name__))
+
+		@functools.wraps(func)
+		def profiled_call(*args, **kwargs):
+			if (not enabled):
+				return func(*args, **kwargs)
+			start = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				record(z_name, start, clock())
+
+		return profiled_call
+
+	return decorate
+
+
+
+def record(name, start, end):
+	"""
+		Stores a completed zone. start and end are clock() values
+	"""
+	trace_events.append((name, start, end, threading.current_thread().ident))
+	frame_totals[name] = frame_totals.get(name, 0.0) + (end - start)
+
+
+
+def frame_mark():
+	"""
+		Closes the frame in progress: its duration and the time of every zone
+		go into the histories. To be called once per frame, at the same point
+	"""
+	global frame_start
+
+	if (not enabled):
+		return
+
+	now = clock()
+	if (frame_start is not None):
+		record(FRAME_ZONE, frame_start, now)
+		for (z_name, z_time) in frame_totals.items():
+			z_history = histories.get(z_name)
+			if (z_history is None):
+				z_history = histories[z_name] = ZoneHistory()
+			z_history.push(z_time)
+		# zones that did not run this frame still took 0 in it
+		for (z_name, z_history) in histories.items():
+			if (z_name not in frame_totals):
+				z_history.push(0.0)
+
+	frame_totals.clear()
+	frame_start = now
+
+
+
+def stats(name = FRAME_ZONE):
+	"""
+		Rolling statistics for a zone (whole frames by default). See ZoneHistory.stats()
+	"""
+	z_history = histories.get(name)
+	return (z_history.stats() if (z_history is not None) else None)
+
+
+
+def dump_trace(file_name = None):
+	"""
+		Writes the recorded zones as a Chrome trace (chrome://tracing, Perfetto)
+		JSON file in the configuration directory
+
+		Arguments:
+			file_name:		defaults to a timestamped name
+
+		Return:
+			the full path of the file, None if it could not be written
+	"""
+	if (file_name is None):
+		file_name = "trace_%s.json" % (time.strftime("%Y%m%d_%H%M%S"))
+	trace_file = guc["system"]["config_dir"] + "/" + file_name
+
+	pid = os.getpid()
+	trace = {
+		"displayTimeUnit": "ms",
+		"traceEvents": [
+			{
+				"name": z_name,
+				"ph": "X",
+				"ts": (z_start - trace_origin) * 1e6,
+				"dur": (z_end - z_start) * 1e6,
+				"pid": pid,
+				"tid": z_thread
+			} for (z_name, z_start, z_end, z_thread) in list(trace_events)
+		]
+	}
+
+	try:
+		with open(trace_file, "w") as trace_fp:
+			json.dump(trace, trace_fp)
+	except IOError:
+		logger.error("Unable to write trace file `%s`", (trace_file))
+		return None
+
+	logger.info("Wrote %d trace events to `%s`", len(trace["traceEvents"]), trace_file)
+	return trace_file
@@ -0,0 +1,180 @@
+#!/usr/bin/python -uB
+
+"""
+	Frame scheduler for Celeritas.
+	The simulation advances in fixed ticks while rendering happens at whatever
+	rate the display/frame cap allows; the renderer gets an interpolation factor
+	between the last two simulation states.
+
+	All timing is done on SDL's high resolution performance counter. Waiting for
+	the next frame is a coarse time.sleep() followed by a short spin, as sleeps
+	alone overshoot by too much to hold a frame rate
+"""
+import time
+import logging
+from sdl2 import *
+
+
+from celeritas.config import guc
+import celeritas.profiler as profiler
+
+
+logger = logging.getLogger(__name__)
+
+
+# simulation ticks per second
+TICK_RATE = 60
+
+# upper bound to the ticks run in a single frame. When the simulation cannot
+# keep up the backlog is dropped rather than making every following frame slower
+MAX_TICKS_PER_FRAME = 8
+
+# how early we wake up from sleeping to spin until the deadline, in seconds.
+# Must cover the scheduler latency of the OS
+SPIN_MARGIN = 0.002
+
+
+
+def counter():
+	""" Current value of the performance counter. See counter_frequency() """
+	return SDL_GetPerformanceCounter()
+
+
+def counter_frequency():
+	""" Performance counter ticks per second """
+	return SDL_GetPerformanceFrequency()
+
+
+
+def wait_until(deadline, frequency = None):
+	"""
+		Blocks until the performance counter reaches `deadline`.
+		Sleeps for the bulk of the wait and spins for the last SPIN_MARGIN seconds
+	"""
+	if (frequency is None):
+		frequency = SDL_GetPerformanceFrequency()
+
+	remaining = float(deadline - SDL_GetPerformanceCounter()) / frequency
+	if (remaining > SPIN_MARGIN):
+		time.sleep(remaining - SPIN_MARGIN)
+
+	while (SDL_GetPerformanceCounter() < deadline):
+		pass
+
+
+
+class FrameScheduler(object):
+	"""
+		Paces the main loop of a window. Typical use:
+
+			scheduler = FrameScheduler(window)
+			while (running):
+				for tick in range(scheduler.begin_frame()):
+					simulate(scheduler.tick_time)
+				render(scheduler.alpha)
+				scheduler.end_frame()
+
+		end_frame() swaps the window buffers and, if there is a frame cap, waits
+		for the next frame slot. With vsync and no cap the swap alone paces the loop
+	"""
+	def __init__(self,
+		window,
+		tick_rate = TICK_RATE,
+		frame_cap = None,
+		swap_interval = None,
+		max_ticks_per_frame = MAX_TICKS_PER_FRAME
+	):
+		"""
+			Arguments:
+				window:					the uio.AppWindow being paced
+				tick_rate:				simulation ticks per second
+				frame_cap:				maximum frames per second, 0 for none. Defaults to guc["video"]["frame_cap"]
+				swap_interval:			uio.SWAP_INTERVAL_* mode. Defaults to guc["video"]["swap_interval"]
+				max_ticks_per_frame:	see MAX_TICKS_PER_FRAME
+		"""
+		if (tick_rate <= 0):
+			raise ValueError("The tick rate must be positive, got %s" % (tick_rate))
+
+		self.window = window
+		self.frequency = SDL_GetPerformanceFrequency()
+
+		# simulation tick, both in seconds (for the simulation) and counter units (for us)
+		self.tick_time = 1.0 / tick_rate
+		self.tick_counts = float(self.frequency) / tick_rate
+		self.max_ticks_per_frame = max_ticks_per_frame
+
+		self.frame_cap = 0
+		self.frame_counts = 0
+		self.set_frame_cap(guc["video"]["frame_cap"] if (frame_cap is None) else frame_cap)
+		self.swap_interval = window.set_swap_interval(guc["video"]["swap_interval"] if (swap_interval is None) else swap_interval)
+
+		# counter units of simulation time not yet consumed by ticks
+		self.accumulator = 0.0
+		# interpolation factor between the previous and the current simulation state
+		self.alpha = 0.0
+
+		# frame bookkeeping, in counter units. frame_start is None until the first frame
+		self.frame_start = None
+		self.frame_deadline = None
+		self.frames = 0
+		self.ticks = 0
+		self.ticks_dropped = 0
+		# duration of the last complete frame, in seconds
+		self.frame_time = 0.0
+
+
+	def set_frame_cap(self, frame_cap):
+		"""
+			Changes the frame cap (frames per second, 0 disables it)
+		"""
+		if (frame_cap < 0):
+			raise ValueError("The frame cap cannot be negative, got %s" % (frame_cap))
+		self.frame_cap = frame_cap
+		self.frame_counts = ((float(self.frequency) / frame_cap) if frame_cap else 0)
+
+
+	def begin_frame(self):
+		"""
+			Accounts for the time elapsed since the previous frame.
+
+			Return:
+				the number of simulation ticks to run this frame
+		"""
+		now = SDL_GetPerformanceCounter()
+		if (self.frame_start is not None):
+			elapsed = now - self.frame_start
+			self.frame_time = float(elapsed) / self.frequency
+			self.accumulator += elapsed
+		self.frame_start = now
+
+		ticks = int(self.accumulator / self.tick_counts)
+		if (ticks > self.max_ticks_per_frame):
+			self.ticks_dropped += ticks - self.max_ticks_per_frame
+			self.accumulator -= (ticks - self.max_ticks_per_frame) * self.tick_counts
+			ticks = self.max_ticks_per_frame
+
+		self.accumulator -= ticks * self.tick_counts
+		self.alpha = self.accumulator / self.tick_counts
+		self.ticks += ticks
+
+		return ticks
+
+
+	def end_frame(self):
+		"""
+			Presents the frame and waits for the next slot, if capped
+		"""
+		self.window.frame_swap()
+		self.frames += 1
+
+		if (self.frame_counts and (self.frame_start is not None)):
+			# deadlines advance by whole periods, so rounding doesn't accumulate drift.
+			# If we are more than a frame late we resynchronize instead of racing to catch up
+			now = SDL_GetPerformanceCounter()
+			if ((self.frame_deadline is None) or ((now - self.frame_deadline) > self.frame_counts)):
+				self.frame_deadline = self.frame_start + self.frame_counts
+			else:
+				self.frame_deadline += self.frame_counts
+			wait_until(int(self.frame_deadline), self.frequency)
+
+		profiler.frame_mark()
@@ -0,0 +1,331 @@
+#!/usr/bin/python -uB
+
+"""
+	Texture loading for Celeritas.
+	Images are decoded into NumPy arrays on a thread pool, so that the main
+	loop never waits on files or decoders. Once a frame the main loop calls
+	TextureLoader.update(), which copies decoded rows into a persistently
+	mapped pixel unpack buffer (see opengl.StreamBuffer) and has GL source
+	the texture from there, at most a budget of bytes per frame; large
+	images are spread over several frames. Mipmaps are generated once the
+	last row is in.
+
+	load() hands back a TextureHandle straight away; its texture can be used
+	once it's ready:
+
+		loader = TextureLoader(context)
+		grass = loader.load("textures/grass.png")
+		...
+		loader.update()
+		if (grass.ready):
+			grass.texture.bind(0, context)
+
+	Decoding goes through SDL_image when it's there, and is limited to BMP
+	files otherwise
+"""
+import os
+import ctypes
+import logging
+import collections
+import concurrent.futures
+
+import numpy
+import sdl2
+try:
+	import sdl2.sdlimage as sdlimage
+except (ImportError, RuntimeError):
+	# PySDL2 raises RuntimeError when the SDL_image library is missing
+	sdlimage = None
+
+from OpenGL.GL import *
+
+from celeritas.config import guc
+import celeritas.opengl as opengl
+
+
+logger = logging.getLogger(__name__)
+
+
+TEXTURE_PENDING = "pending"
+TEXTURE_READY = "ready"
+TEXTURE_FAILED = "failed"
+
+# channels -> (pixel format, internal format for 8 bit channels)
+CHANNEL_FORMATS = {
+	1: (GL_RED, GL_R8),
+	2: (GL_RG, GL_RG8),
+	3: (GL_RGB, GL_RGB8),
+	4: (GL_RGBA, GL_RGBA8)
+}
+
+
+
+def decode_image(path):
+	"""
+		Decodes an image file into RGBA
+
+		Return:
+			a (height, width, 4) uint8 array, rows from the bottom as GL wants them
+	"""
+	if (sdlimage is not None):
+		surface = sdlimage.IMG_Load(path.encode())
+		get_error = sdlimage.IMG_GetError
+	else:
+		surface = sdl2.SDL_LoadBMP(path.encode())
+		get_error = sdl2.SDL_GetError
+	if (not surface):
+		raise IOError("Unable to load `%s`: %s" % (path, get_error().decode(errors = "replace")))
+
+	try:
+		rgba = sdl2.SDL_ConvertSurfaceFormat(surface, sdl2.SDL_PIXELFORMAT_RGBA32, 0)
+	finally:
+		sdl2.SDL_FreeSurface(surface)
+	if (not rgba):
+		raise IOError("Unable to convert `%s` to RGBA: %s" % (path, sdl2.SDL_GetError().decode(errors = "replace")))
+
+	try:
+		(width, height, pitch) = (rgba.contents.w, rgba.contents.h, rgba.contents.pitch)
+		rows = numpy.ctypeslib.as_array((ctypes.c_ubyte * (pitch * height)).from_address(rgba.contents.pixels)).reshape(height, pitch)
+		# SDL rows go top to bottom and may be padded
+		return numpy.ascontiguousarray(rows[::-1, :(width * 4)]).reshape(height, width, 4)
+	finally:
+		sdl2.SDL_FreeSurface(rgba)
+
+
+
+class TextureHandle(object):
+	"""
+		A texture being loaded. `texture` is an opengl.Texture once ready,
+		`error` says what went wrong if it failed
+	"""
+	def __init__(self, path, internal_format = None, mipmaps = True):
+		self.path = path
+		self.internal_format = internal_format
+		self.mipmaps = mipmaps
+		self.state = TEXTURE_PENDING
+		self.texture = None
+		self.error = None
+		# decoded pixels waiting to be uploaded, and how many rows of them are
+		self.pixels = None
+		self.rows_uploaded = 0
+		self.future = None
+
+
+	@property
+	def ready(self):
+		return (self.state == TEXTURE_READY)
+
+
+	@property
+	def failed(self):
+		return (self.state == TEXTURE_FAILED)
+
+
+	@property
+	def done(self):
+		""" Whether loading is over, for better or worse """
+		return (self.state != TEXTURE_PENDING)
+
+
+
+class TextureLoader(object):
+	"""
+		Loads textures without stalling the main loop. update() must be
+		called once per frame, from the thread owning the GL context; the
+		rest of the work happens on the thread pool
+	"""
+	def __init__(self, context = None, threads = None, upload_budget = None, decoder = decode_image):
+		"""
+			Arguments:
+				context:		opengl.Context to bind through, if any
+				threads:		decoding threads. guc["system"]["loader_threads"] by default
+				upload_budget:	bytes uploaded per update(). guc["video"]["texture_upload_budget"] by default
+				decoder:		function taking a path and returning a (height, width[, channels])
+								array, rows from the bottom. Arrays that aren't uint8 need
+								an internal format passed to load()
+		"""
+		self.context = context
+		self.decoder = decoder
+		self.upload_budget = (upload_budget or guc["video"]["texture_upload_budget"])
+		self.executor = concurrent.futures.ThreadPoolExecutor(
+			max_workers = (threads or guc["system"]["loader_threads"]),
+			thread_name_prefix = "TextureLoader"
+		)
+		# one region per frame in flight, so we never write what GL may still be reading
+		self.stream = opengl.StreamBuffer(self.upload_budget, regions = 3, target = GL_PIXEL_UNPACK_BUFFER)
+
+		# path -> TextureHandle, so that loading something twice is free
+		self.handles = {}
+		# handles being decoded, and decoded ones waiting for their upload (in order)
+		self.decoding = []
+		self.uploading = collections.deque()
+
+		self.loaded = 0
+		self.failures = 0
+		self.frame_bytes = 0
+		self.total_bytes = 0
+
+
+	def load(self, path, internal_format = None, mipmaps = True):
+		"""
+			Starts loading an image. Returns right away
+
+			Arguments:
+				internal_format:	sized GL format. Follows the channels by default (GL_RGBA8 for RGBA...)
+				mipmaps:			whether to generate a full mipmap chain
+
+			Return:
+				the TextureHandle, the same one for the same path
+		"""
+		path = os.path.abspath(path)
+		handle = self.handles.get(path)
+		if (handle is not None):
+			return handle
+		handle = TextureHandle(path, internal_format, mipmaps)
+		handle.future = self.executor.submit(self.decoder, path)
+		self.handles[path] = handle
+		self.decoding.append(handle)
+		return handle
+
+
+	@property
+	def pending(self):
+		""" Textures not done loading """
+		return (len(self.decoding) + len(self.uploading))
+
+
+	def update(self):
+		"""
+			Picks up the images decoded since the last call and uploads as
+			much as the budget allows. Meant to be called once per frame
+
+			Return:
+				the list of handles that became ready
+		"""
+		self.frame_bytes = 0
+		still_decoding = []
+		for handle in self.decoding:
+			if (not handle.future.done()):
+				still_decoding.append(handle)
+				continue
+			try:
+				handle.pixels = self._check_pixels(handle, handle.future.result())
+				self.uploading.append(handle)
+			except Exception as e_load:
+				self._fail(handle, e_load)
+			handle.future = None
+		self.decoding = still_decoding
+
+		if (not self.uploading):
+			return []
+
+		ready = []
+		region = self.stream.begin()
+		used = 0
+		opengl.bind_buffer(GL_PIXEL_UNPACK_BUFFER, self.stream.gl_id, self.context)
+		# rows are packed back to back
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+		while (self.uploading):
+			handle = self.uploading[0]
+			pixels = handle.pixels
+			(height, width) = pixels.shape[:2]
+			(pixel_format, pixel_type) = (CHANNEL_FORMATS[self._channels(pixels)][0], opengl.PIXEL_TYPES[pixels.dtype])
+			if (handle.texture is None):
+				handle.texture = opengl.Texture(width, height, handle.internal_format, levels = (0 if handle.mipmaps else 1))
+
+			first_row = handle.rows_uploaded
+			row_bytes = pixels[0].nbytes
+			if (row_bytes > len(region)):
+				# a row that can't ever fit goes straight from client memory
+				opengl.bind_buffer(GL_PIXEL_UNPACK_BUFFER, 0, self.context)
+				handle.texture.upload(pixels[first_row:], y = first_row, width = width, height = (height - first_row), pixel_format = pixel_format)
+				opengl.bind_buffer(GL_PIXEL_UNPACK_BUFFER, self.stream.gl_id, self.context)
+				# upload() may have put the alignment back
+				glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+				rows = height - first_row
+			else:
+				rows = min((height - first_row), ((len(region) - used) // row_bytes))
+				if (not rows):
+					break
+				chunk = pixels[first_row:(first_row + rows)].reshape(-1).view(numpy.uint8)
+				region[used:(used + chunk.nbytes)] = chunk
+				handle.texture.upload(
+					(self.stream.offset + used), y = first_row, width = width, height = rows,
+					pixel_format = pixel_format, pixel_type = pixel_type
+				)
+				used += chunk.nbytes
+
+			handle.rows_uploaded += rows
+			self.frame_bytes += (rows * row_bytes)
+			if (handle.rows_uploaded == height):
+				if (handle.texture.levels > 1):
+					handle.texture.generate_mipmaps()
+				(handle.pixels, handle.state) = (None, TEXTURE_READY)
+				self.uploading.popleft()
+				self.loaded += 1
+				ready.append(handle)
+
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+		opengl.bind_buffer(GL_PIXEL_UNPACK_BUFFER, 0, self.context)
+		self.stream.end()
+		self.total_bytes += self.frame_bytes
+		return ready
+
+
+	@staticmethod
+	def _channels(pixels):
+		return (pixels.shape[2] if (pixels.ndim == 3) else 1)
+
+
+	def _check_pixels(self, handle, pixels):
+		"""
+			Validates what the decoder returned and settles the internal format
+		"""
+		pixels = opengl.as_buffer(pixels)
+		if ((pixels.ndim not in (2, 3)) or (self._channels(pixels) not in CHANNEL_FORMATS)):
+			raise ValueError("Decoded images must be (height, width[, 1 to 4 channels]), got shape %s" % (pixels.shape, ))
+		if (pixels.dtype not in opengl.PIXEL_TYPES):
+			raise ValueError("No pixel type for %s" % (pixels.dtype))
+		if (handle.internal_format is None):
+			if (pixels.dtype != numpy.uint8):
+				raise ValueError("%s pixels need an explicit internal format" % (pixels.dtype))
+			handle.internal_format = CHANNEL_FORMATS[self._channels(pixels)][1]
+		return pixels
+
+
+	def _fail(self, handle, error):
+		(handle.state, handle.error) = (TEXTURE_FAILED, str(error))
+		self.failures += 1
+		logger.warning("Unable to load texture `%s`: %s", handle.path, error)
+
+
+	def stats(self):
+		"""
+			Return:
+				dictionary of pending, loaded, failed, frame_bytes and total_bytes
+		"""
+		return {
+			"pending": self.pending,
+			"loaded": self.loaded,
+			"failed": self.failures,
+			"frame_bytes": self.frame_bytes,
+			"total_bytes": self.total_bytes
+		}
+
+
+	def release(self):
+		"""
+			Stops the decoding threads and releases the upload buffer and every
+			texture loaded. Handles still pending stay so forever
+		"""
+		for handle in self.decoding:
+			handle.future.cancel()
+		self.executor.shutdown(wait = True)
+		self.decoding = []
+		self.uploading.clear()
+		self.stream.release(self.context)
+		for handle in self.handles.values():
+			if (handle.texture is not None):
+				handle.texture.release(self.context)
+				handle.texture = None
+		self.handles.clear()
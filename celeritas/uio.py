@@ -11,11 +11,15 @@
 """
 import ctypes
 import logging
+import collections
+import itertools
+import numpy
 import sdl2
 from sdl2 import *
 
 
-import info;
+import celeritas.info as info
+import celeritas.profiler as profiler
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +30,12 @@ WINDOW_FULL_SCREEN = 1
 WINDOW_FAKE_FULL_SCREEN = 2
 
 
+# values for SDL_GL_SetSwapInterval()
+SWAP_INTERVAL_OFF = 0
+SWAP_INTERVAL_VSYNC = 1
+SWAP_INTERVAL_ADAPTIVE = -1		# late frames are swapped immediately instead of waiting for the next sync
+
+
 EVENT_KEY_DOWN = 64
 EVENT_KEY_UP = 65
 
@@ -84,23 +94,95 @@ MBUTTON_FLAGS = {
 	"butt_x2": SDL_BUTTON_X2
 }
 
+# same names, mapped to the bit each button has in SDL's buttons state mask
+MBUTTON_MASKS = dict(((b_name, SDL_BUTTON(b_index)) for (b_name, b_index) in MBUTTON_FLAGS.items()))
 
 
-window_count = 0
 
+# what a window event queue does when it is full and another event comes in
+QUEUE_OVERFLOW_DROP_OLDEST = 0		# the head of the queue is discarded to make room
+QUEUE_OVERFLOW_DROP_NEWEST = 1		# the incoming event is discarded
+QUEUE_OVERFLOW_COALESCE = 2			# the incoming event is merged into the tail if possible, otherwise drop oldest
 
+# default per-window queue size. At 1000Hz mouse polling this is about a second of backlog
+EVENT_QUEUE_CAPACITY = 1024
+EVENT_QUEUE_OVERFLOW = QUEUE_OVERFLOW_DROP_OLDEST
 
-# event queue, maintained as an ever increasing counter
-# each member actually contains a tuple: (raw_SDL_event, our_object_representation)
-polled_sdl_events = {}
-# current event counter
-# this may overflow on 32 bit machines if the application keeps running
-# long enough
-event_counter = 0
 
-# window_id -> [event_ids] list to accelerate lookups
+
+window_count = 0
+
+
+
+# window_id -> EventQueue. Only windows created through AppWindow have a queue here,
+# and it goes away with the window
 windows_events = {}
 
+# events addressed to windows we have no queue for (destroyed, foreign or id 0).
+# They're counted and discarded rather than accumulated
+orphan_events = 0
+
+# when True, poll_events() folds runs of mouse motion for the same window/mouse/buttons
+# into the motion event already at the tail of the window queue instead of
+# creating a new object for each one. Relative motion is summed, the absolute
+# position is the last one. Off by default as it changes what consumers see.
+# Motion going to handlers is held back and folded the same way: handlers get it
+# when an event of another kind is dispatched, or at the end of poll_events()
+coalesce_mouse_motion = False
+
+# (decoded motion event, its handlers) held back for coalescing, if any
+pending_motion = None
+
+# motion events folded into one already waiting for handlers
+handler_events_coalesced = 0
+
+# how many events poll_events() moves out of SDL per SDL_PeepEvents() call
+EVENT_BATCH_SIZE = 256
+
+# raw SDL events land in a ring of this many SDL_Event structures (see EventRing).
+# Lazy EventView objects stay readable until the ring wraps around on them
+EVENT_RING_SIZE = 4096
+
+# when True, events handed back through release_events() are kept in per-class
+# free lists (up to EVENT_POOL_SIZE each) and reinitialized by the decoder
+# instead of allocating new ones
+pool_events = False
+EVENT_POOL_SIZE = 1024
+# event class -> [released instances]
+event_pools = {}
+
+# the SDL event types we know how to switch off at the source with SDL_EventState().
+# Resolved by name as not every SDL/pySDL2 version has all of them
+FILTERABLE_EVENT_TYPES = tuple((getattr(sdl2, e_name) for e_name in (
+	"SDL_QUIT", "SDL_DISPLAYEVENT", "SDL_WINDOWEVENT", "SDL_SYSWMEVENT",
+	"SDL_KEYDOWN", "SDL_KEYUP", "SDL_TEXTEDITING", "SDL_TEXTINPUT", "SDL_KEYMAPCHANGED",
+	"SDL_MOUSEMOTION", "SDL_MOUSEBUTTONDOWN", "SDL_MOUSEBUTTONUP", "SDL_MOUSEWHEEL",
+	"SDL_JOYAXISMOTION", "SDL_JOYBALLMOTION", "SDL_JOYHATMOTION", "SDL_JOYBUTTONDOWN", "SDL_JOYBUTTONUP",
+	"SDL_JOYDEVICEADDED", "SDL_JOYDEVICEREMOVED",
+	"SDL_CONTROLLERAXISMOTION", "SDL_CONTROLLERBUTTONDOWN", "SDL_CONTROLLERBUTTONUP",
+	"SDL_CONTROLLERDEVICEADDED", "SDL_CONTROLLERDEVICEREMOVED", "SDL_CONTROLLERDEVICEREMAPPED",
+	"SDL_FINGERDOWN", "SDL_FINGERUP", "SDL_FINGERMOTION",
+	"SDL_DOLLARGESTURE", "SDL_DOLLARRECORD", "SDL_MULTIGESTURE",
+	"SDL_CLIPBOARDUPDATE", "SDL_DROPFILE", "SDL_DROPTEXT", "SDL_DROPBEGIN", "SDL_DROPCOMPLETE",
+	"SDL_AUDIODEVICEADDED", "SDL_AUDIODEVICEREMOVED", "SDL_SENSORUPDATE",
+	"SDL_RENDER_TARGETS_RESET", "SDL_RENDER_DEVICE_RESET"
+) if hasattr(sdl2, e_name)))
+
+# what is subscribed out of the box: the types decode_sdl_event() has classes for
+DEFAULT_EVENT_SUBSCRIPTIONS = (SDL_WINDOWEVENT, SDL_MOUSEMOTION, SDL_KEYDOWN, SDL_KEYUP)
+
+# sdl_type -> number of subscribers. Filterable types nobody is subscribed to
+# are disabled in SDL, so they never reach poll_events()
+event_subscriptions = dict(((e_type, 1) for e_type in DEFAULT_EVENT_SUBSCRIPTIONS))
+
+# (sdl_type, window_event_type) -> number of occurrences, for whatever still gets
+# through without a class to decode it into. Only the first one of each kind is logged
+unhandled_events = {}
+
+# (window_id, sdl_type, window_event_type) -> tuple of callbacks. See AppWindow.add_event_handler().
+# Tuples are replaced, never mutated, so handlers can (un)register from within a dispatch
+event_handlers = {}
+
 
 
 
@@ -108,11 +190,19 @@ windows_events = {}
 
 
 class SDLException(Exception): pass
+class StaleEventError(Exception): pass
 
 class Event(object):
 	"""
-		Generic User I/O Event
+		Generic User I/O Event.
+
+		The whole hierarchy uses __slots__ and flat constructors (every class assigns
+		all of its fields itself instead of chaining up through super()): these objects
+		are created by the thousand per second and per-instance dictionaries plus
+		keyword argument shuffling showed up in profiles
 	"""
+	__slots__ = ("sdl_type", "ts")
+
 	def __init__(self,
 		event_type,
 		timestamp
@@ -122,13 +212,14 @@ class Event(object):
 				event_type:				SDL_KEYDOWN, SDL_KEYUP, SDL_MOUSEMOTION and so on...
 				timestamp:				process-relative event timestamp as supplied by SDL
 		"""
-		self.sdl_type = event_type;
-		self.ts = timestamp;
+		(self.sdl_type, self.ts) = (event_type, timestamp)
 
 class WindowScopeEvent(Event):
 	"""
 		Any event that could happen within the scope of a window
 	"""
+	__slots__ = ("winid",)
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -138,17 +229,15 @@ class WindowScopeEvent(Event):
 			Extension arguments:
 				window_id:				the window ID the event occurred on
 		"""
-		super(WindowScopeEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp
-		)
-		self.winid = window_id
+		(self.sdl_type, self.ts, self.winid) = (event_type, timestamp, window_id)
 
 
 class WindowEvent(WindowScopeEvent):
 	"""
 		Events affecting the window itself
 	"""
+	__slots__ = ("we_type",)
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -159,20 +248,15 @@ class WindowEvent(WindowScopeEvent):
 			Extension arguments:
 				window_event_type:				specific sub type of the window event (SDL_WINDOWEVENT_*)
 		"""
-		super(WindowEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp,
-			window_id = window_id
-		)
-		self.we_type = window_event_type
+		(self.sdl_type, self.ts, self.winid, self.we_type) = (event_type, timestamp, window_id, window_event_type)
 
 
-class WindowFocusOnEvent(WindowEvent):	"""Window focus event. Has no properties of its own"""; pass;
-class WindowFocusOffEvent(WindowEvent):	"""Window un-focus event. Has no properties of its own"""; pass;
-class WindowMinimizeEvent(WindowEvent):	"""Window minimization event. Has no properties of its own"""; pass;
-class WindowRestoreEvent(WindowEvent):	"""Window size restoration event. Has no properties of its own"""; pass;
-class WindowMaximizeEvent(WindowEvent):	"""Window maximization event. Has no properties of its own"""; pass;
-class WindowCloseEvent(WindowEvent):	"""Window close event. Has no properties of its own"""; pass;
+class WindowFocusOnEvent(WindowEvent):	"""Window focus event. Has no properties of its own"""; __slots__ = ();
+class WindowFocusOffEvent(WindowEvent):	"""Window un-focus event. Has no properties of its own"""; __slots__ = ();
+class WindowMinimizeEvent(WindowEvent):	"""Window minimization event. Has no properties of its own"""; __slots__ = ();
+class WindowRestoreEvent(WindowEvent):	"""Window size restoration event. Has no properties of its own"""; __slots__ = ();
+class WindowMaximizeEvent(WindowEvent):	"""Window maximization event. Has no properties of its own"""; __slots__ = ();
+class WindowCloseEvent(WindowEvent):	"""Window close event. Has no properties of its own"""; __slots__ = ();
 
 
 
@@ -182,8 +266,11 @@ class KeyInputEvent(WindowScopeEvent):
 	"""
 		Key press/release/whatever event.
 		
-		Modifiers are represented as individual properties
+		Modifiers are represented as individual properties, one per KMOD_FLAGS entry,
+		which test the native bitmask when read
 	"""
+	__slots__ = ("down", "up", "kc", "uc", "sc", "_modifiers", "rep")
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -200,42 +287,29 @@ class KeyInputEvent(WindowScopeEvent):
 
 			Arguments:
 				key_code:				see https://wiki.libsdl.org/SDL_Keysym
-				unicode_cp:				unicode Code Point. For some reason not documented by SDL but returned by pySDL
+				unicode_cp:				unicode Code Point. SDL 2 key events carry none (text comes with
+										SDL_TEXTINPUT), so decoded events have None
 				scan_code:				see https://wiki.libsdl.org/SDL_Keysym
 				modifiers:				see https://wiki.libsdl.org/SDL_Keysym
 				is_repeat:				https://wiki.libsdl.org/SDL_KeyboardEvent
 
 		"""
-		super(KeyInputEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp,
-			window_id = window_id
-		)
 		# single assignment is good
-		(self.down,                   self.up,                     self.kc,  self.uc,    self.sc,    self._modifiers, self.rep) = \
-		((event_type == SDL_KEYDOWN), (event_type == SDL_KEYUP),   key_code, unicode_cp, scan_code,  modifiers,       is_repeat)
-
-
-
-	def __getattr__(self, attribute):
-		"""
-			Instead of materializing the modifiers in a tuple/list
-			at event generation (expensive) we resolve them on-demand
-			from the bitmask
-		"""
-		try:
-			return bool(self._modifiers & KMOD_FLAGS[attribute]);
-		except:
-			raise AttributeError("No such attribute: %s" % attribute);
-			return None;
+		(self.sdl_type, self.ts,   self.winid, self.down,                   self.up,                     self.kc,  self.uc,    self.sc,    self._modifiers, self.rep) = \
+		(event_type,    timestamp, window_id,  (event_type == SDL_KEYDOWN), (event_type == SDL_KEYUP),   key_code, unicode_cp, scan_code,  modifiers,       is_repeat)
 
 
 
 class MouseInputEvent(WindowScopeEvent):
 	"""
 		Generic mouse action event. Base class that is meant to be
-		extended by various mouse event types
+		extended by various mouse event types.
+
+		Buttons are represented as individual properties, one per MBUTTON_FLAGS entry,
+		which test the native bitmask when read
 	"""
+	__slots__ = ("md_id", "_buttons_mask", "x_abs", "y_abs")
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -257,32 +331,16 @@ class MouseInputEvent(WindowScopeEvent):
 			y:				see x_abs and guess...
 			
 		"""
-		super(MouseInputEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp,
-			window_id = window_id
-		)
-
-		(self.md_id, self._buttons_mask, self.x_abs, self.y_abs) = \
-		(mouse_id,   buttons_mask,       x,          y)
-
-	def __getattr__(self, attribute):
-		"""
-			Much like for keyboard events, it is preferable not to materialize
-			the list of buttons at class initialization; the flag mask is compared on
-			demand instead
-		"""
-		try:
-			return bool(self._buttons_mask & MBUTTON_FLAGS[attribute]);
-		except:
-			raise AttributeError("No such attribute: %s" % attribute);
-			return None;
+		(self.sdl_type, self.ts,   self.winid, self.md_id, self._buttons_mask, self.x_abs, self.y_abs) = \
+		(event_type,    timestamp, window_id,  mouse_id,   buttons_mask,       x,          y)
 
 
 class MouseMotionEvent(MouseInputEvent):
 	"""
 		Mouse move. Implemented as its own class as it has specific properties
 	"""
+	__slots__ = ("x_rel", "y_rel")
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -301,20 +359,47 @@ class MouseMotionEvent(MouseInputEvent):
 				xrel:		relative motion x
 				yrel:		relative motion y
 		"""
-		super(MouseMotionEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp,
-			window_id = window_id,
-			mouse_id = mouse_id,
-			buttons_mask = buttons_mask,
-			x = x,
-			y = y
-		)
-		
-		(self.x_rel, self.y_rel) = (xrel, yrel)
+		(self.sdl_type, self.ts,   self.winid, self.md_id, self._buttons_mask, self.x_abs, self.y_abs, self.x_rel, self.y_rel) = \
+		(event_type,    timestamp, window_id,  mouse_id,   buttons_mask,       x,          y,          xrel,       yrel)
+
+
+	def coalesce(self, other):
+		"""
+			Merges a later motion event into this one, in place, if they are compatible
+			(same window, mouse and buttons mask).
+			The absolute position and timestamp become those of `other`, relative motion is summed.
+
+			Return:
+				True if `other` was absorbed, False if the caller has to keep it separately
+		"""
+		if (
+			(type(other) is not MouseMotionEvent)
+		or
+			(other.winid != self.winid)
+		or
+			(other.md_id != self.md_id)
+		or
+			(other._buttons_mask != self._buttons_mask)
+		):
+			return False
+
+		self.absorb(other.ts, other.x_abs, other.y_abs, other.x_rel, other.y_rel)
+
+		return True
+
+
+	def absorb(self, timestamp, x, y, xrel, yrel):
+		"""
+			Folds the raw fields of a subsequent motion into this event without
+			building an object for it. Compatibility is the caller's problem
+		"""
+		(self.ts,    self.x_abs,  self.y_abs,  self.x_rel,          self.y_rel) = \
+		(timestamp,  x,           y,           (self.x_rel + xrel), (self.y_rel + yrel))
 
 
 class MouseButtonEvent(MouseInputEvent):
+	__slots__ = ("click_count",)
+
 	def __init__(self,
 		event_type,
 		timestamp,
@@ -331,17 +416,320 @@ class MouseButtonEvent(MouseInputEvent):
 			Additional arguments to parent[s]:
 				clicks:		number of consecutive clicks
 		"""
+		(self.sdl_type, self.ts,   self.winid, self.md_id, self._buttons_mask, self.x_abs, self.y_abs, self.click_count) = \
+		(event_type,    timestamp, window_id,  mouse_id,   buttons_mask,       x,          y,          clicks)
+
+
+
+# Modifier and button properties are generated once here rather than resolved
+# through __getattr__ at every access
+def _modifier_property(flag):	return property(lambda self: bool(self._modifiers & flag))
+def _button_property(mask):		return property(lambda self: bool(self._buttons_mask & mask))
+
+for (flag_name, flag) in KMOD_FLAGS.items():
+	setattr(KeyInputEvent, flag_name, _modifier_property(flag))
+for (flag_name, mask) in MBUTTON_MASKS.items():
+	setattr(MouseInputEvent, flag_name, _button_property(mask))
+
+
+
+
+class EventQueue(object):
+	"""
+		Bounded FIFO of decoded events belonging to one window.
+		Push and pop are O(1) regardless of the backlog; what happens when
+		the queue is full is governed by the overflow policy (QUEUE_OVERFLOW_*)
+	"""
+	def __init__(self,
+		capacity = EVENT_QUEUE_CAPACITY,
+		overflow = EVENT_QUEUE_OVERFLOW,
+		lazy = False
+	):
+		"""
+			Arguments:
+				capacity:		maximum number of events held at any time
+				overflow:		one of the QUEUE_OVERFLOW_* policies
+				lazy:			take EventView objects over the event ring rather than decoded events
+		"""
+		if (capacity < 1):
+			raise ValueError("Event queue capacity must be positive, got %d" % (capacity))
+		if (overflow not in (QUEUE_OVERFLOW_DROP_OLDEST, QUEUE_OVERFLOW_DROP_NEWEST, QUEUE_OVERFLOW_COALESCE)):
+			raise ValueError("Unknown event queue overflow policy: %s" % (overflow))
+
+		self.capacity = capacity
+		self.overflow = overflow
+		self.lazy = lazy
+		self._events = collections.deque()
+
+		# counters are monotonic over the life of the queue
+		self.dropped = 0
+		self.coalesced = 0
+
+
+	def __len__(self):
+		return len(self._events)
+
+
+	def __iter__(self):
+		return iter(self._events)
+
+
+	def push(self, event):
+		"""
+			Appends an event, applying the overflow policy if the queue is full
+
+			Return:
+				True if the event (or its content, when coalesced) made it into the queue
+		"""
+		if (len(self._events) < self.capacity):
+			self._events.append(event)
+			return True
+
+		if (self.overflow == QUEUE_OVERFLOW_DROP_NEWEST):
+			self.dropped += 1
+			return False
+
+		if (self.overflow == QUEUE_OVERFLOW_COALESCE):
+			tail = self._events[-1]
+			if (hasattr(tail, "coalesce") and tail.coalesce(event)):
+				self.coalesced += 1
+				return True
+
+		# drop oldest, also the fallback for events that cannot be coalesced
+		self._events.popleft()
+		self._events.append(event)
+		self.dropped += 1
+		return True
+
+
+	def pop(self, limit = 0):
+		"""
+			Removes and returns up to `limit` events from the head of the queue (all if limit <= 0)
+		"""
+		events = self._events
+		if ((limit <= 0) or (limit >= len(events))):
+			pop_out = list(events)
+			events.clear()
+			return pop_out
+
+		popleft = events.popleft
+		return [popleft() for e_n in range(limit)]
 
-		super(MouseMotionEvent, self).__init__(
-			event_type = event_type,
-			timestamp = timestamp,
-			window_id = window_id,
-			mouse_id = mouse_id,
-			buttons_mask = buttons_mask,
-			x = x,
-			y = y
+
+	def peek(self, limit = 0):
+		"""
+			Like pop(), but leaves the queue untouched
+		"""
+		if ((limit <= 0) or (limit >= len(self._events))):
+			return list(self._events)
+		return list(itertools.islice(self._events, limit))
+
+
+	def clear(self):
+		self._events.clear()
+
+
+	@property
+	def last(self):
+		""" The most recently queued event, or None if the queue is empty """
+		return (self._events[-1] if self._events else None)
+
+
+
+class EventRing(object):
+	"""
+		Preallocated circular array of raw SDL_Event structures.
+		SDL_PeepEvents() writes straight into it, so raw events are never copied
+		once more on our side. Every slot is identified by an ever increasing sequence
+		number, which lets views tell whether their slot has been overwritten since
+	"""
+	def __init__(self, size = EVENT_RING_SIZE):
+		"""
+			Arguments:
+				size:		number of SDL_Event slots
+		"""
+		if (size < EVENT_BATCH_SIZE):
+			raise ValueError("The event ring cannot be smaller than a batch (%d < %d)" % (size, EVENT_BATCH_SIZE))
+		self.size = size
+		self.events = (SDL_Event * size)()
+		# total number of events ever written. The next one goes to slot (written % size)
+		self.written = 0
+
+
+	def peep(self, max_events = EVENT_BATCH_SIZE):
+		"""
+			Moves up to `max_events` events from SDL into the ring. Never wraps within a call,
+			so the batch might be shorter than requested near the end of the ring
+
+			Return:
+				(sequence number of the first event, number of events retrieved)
+		"""
+		start = self.written % self.size
+		batch_len = SDL_PeepEvents(
+			ctypes.cast(ctypes.addressof(self.events) + (start * ctypes.sizeof(SDL_Event)), ctypes.POINTER(SDL_Event)),
+			min(max_events, self.size - start),
+			SDL_GETEVENT,
+			SDL_FIRSTEVENT,
+			SDL_LASTEVENT
 		)
-		self.click_count = clicks;
+		if (batch_len < 0):
+			raise SDLException("Unable to retrieve events from the SDL queue: %s" % (SDL_GetError()))
+
+		first_seq = self.written
+		self.written += batch_len
+		return (first_seq, batch_len)
+
+
+	def __getitem__(self, seq):
+		"""
+			Returns the raw SDL_Event (a view over the ring memory, not a copy) for a sequence number
+		"""
+		if ((self.written - seq) > self.size):
+			raise StaleEventError("Event #%d has been overwritten in the event ring" % (seq))
+		return self.events[seq % self.size]
+
+
+event_ring = EventRing(EVENT_RING_SIZE)
+
+
+
+
+class EventView(object):
+	"""
+		Lightweight handle over a raw event sitting in the event ring.
+		Nothing is decoded up front: every attribute is read from the SDL structure when
+		accessed, so looking at sdl_type or a single coordinate costs just that.
+		Attribute names are the same as in the Event class hierarchy.
+
+		The view is only readable until the ring wraps around (EVENT_RING_SIZE
+		events later), after which StaleEventError is raised. Use materialize()
+		for events that need to outlive that
+	"""
+	__slots__ = ("_ring", "_seq")
+
+	def __init__(self, ring, seq):
+		(self._ring, self._seq) = (ring, seq)
+
+	@property
+	def raw(self): return self._ring[self._seq]
+
+	@property
+	def stale(self): return ((self._ring.written - self._seq) > self._ring.size)
+
+	# common to all events
+	@property
+	def sdl_type(self): return self._ring[self._seq].type
+	@property
+	def ts(self): return self._ring[self._seq].common.timestamp
+	# window id lives at the same offset in all window scoped SDL events
+	@property
+	def winid(self): return self._ring[self._seq].window.windowID
+
+	# window events
+	@property
+	def we_type(self): return self._ring[self._seq].window.event
+
+	# mouse motion events
+	@property
+	def md_id(self): return self._ring[self._seq].motion.which
+	@property
+	def x_abs(self): return self._ring[self._seq].motion.x
+	@property
+	def y_abs(self): return self._ring[self._seq].motion.y
+	@property
+	def x_rel(self): return self._ring[self._seq].motion.xrel
+	@property
+	def y_rel(self): return self._ring[self._seq].motion.yrel
+
+	# keyboard events
+	@property
+	def down(self): return (self._ring[self._seq].type == SDL_KEYDOWN)
+	@property
+	def up(self): return (self._ring[self._seq].type == SDL_KEYUP)
+	@property
+	def kc(self): return self._ring[self._seq].key.keysym.sym
+	@property
+	def sc(self): return self._ring[self._seq].key.keysym.scancode
+	@property
+	def rep(self): return bool(self._ring[self._seq].key.repeat)
+
+
+	def materialize(self):
+		"""
+			Return:
+				the fully decoded Event object for this view (None if the type has no class)
+		"""
+		return decode_sdl_event(self._ring[self._seq])
+
+
+
+
+# modifier and button flags, read from the raw masks like the eager classes do
+def _view_modifier_property(flag):	return property(lambda self: bool(self._ring[self._seq].key.keysym.mod & flag))
+def _view_button_property(mask):	return property(lambda self: bool(self._ring[self._seq].motion.state & mask))
+
+for (flag_name, flag) in KMOD_FLAGS.items():
+	setattr(EventView, flag_name, _view_modifier_property(flag))
+for (flag_name, mask) in MBUTTON_MASKS.items():
+	setattr(EventView, flag_name, _view_button_property(mask))
+
+
+
+
+class InputState(object):
+	"""
+		Per-frame snapshot of the keyboard and mouse, for continuous input
+		(movement keys, mouse look...) that is better polled than replayed event by event.
+
+		keys is a NumPy view straight over SDL's internal keyboard state array, indexed by
+		SDL_SCANCODE_*, so it is never copied and always current as of the last event pump.
+		update() is meant to be called once per frame, after poll_events(): it samples the
+		mouse and computes the pressed/released edges since the previous call with
+		vectorized comparisons.
+		SDL keeps the state current even for event types that are not subscribed to
+	"""
+	def __init__(self):
+		if (not SDL_WasInit(SDL_INIT_EVENTS)):
+			raise SDLException("Input state requires SDL to be initialized. Create a window first")
+
+		key_count = ctypes.c_int()
+		keys_ptr = SDL_GetKeyboardState(ctypes.byref(key_count))
+		if (not keys_ptr):
+			raise SDLException("Unable to access the SDL keyboard state: %s" % (SDL_GetError()))
+
+		# SDL owns this memory for its whole lifetime. Writing to it would fake key states
+		self.keys = numpy.ctypeslib.as_array(ctypes.cast(keys_ptr, ctypes.POINTER(ctypes.c_uint8)), shape = (key_count.value,))
+		self.keys.flags.writeable = False
+
+		# state as of the previous update() and the edges since then, all indexed by scan code
+		self._keys_prev = self.keys.copy()
+		self.pressed = numpy.zeros(key_count.value, dtype = numpy.bool_)
+		self.released = numpy.zeros(key_count.value, dtype = numpy.bool_)
+
+		# mouse position is relative to the focused window, buttons are SDL state masks (see MBUTTON_MASKS)
+		(self._mouse_x, self._mouse_y) = (ctypes.c_int(), ctypes.c_int())
+		(self.mouse_x, self.mouse_y, self.buttons, self.buttons_pressed, self.buttons_released) = (0, 0, 0, 0, 0)
+
+
+	def update(self):
+		"""
+			Samples the mouse and refreshes the edge arrays/masks
+		"""
+		numpy.greater(self.keys, self._keys_prev, out = self.pressed)
+		numpy.less(self.keys, self._keys_prev, out = self.released)
+		numpy.copyto(self._keys_prev, self.keys)
+
+		buttons = SDL_GetMouseState(ctypes.byref(self._mouse_x), ctypes.byref(self._mouse_y))
+		(self.mouse_x,          self.mouse_y,          self.buttons_pressed,      self.buttons_released,     self.buttons) = \
+		(self._mouse_x.value,   self._mouse_y.value,   (buttons & ~self.buttons), (self.buttons & ~buttons), buttons)
+
+
+	def button_down(self, button_name):
+		""" Whether a button (by MBUTTON_FLAGS name) is held """
+		return bool(self.buttons & MBUTTON_MASKS[button_name])
+
+
+
 
 class AppWindow():
 
@@ -355,7 +743,12 @@ class AppWindow():
 		w = 320,
 		h = 200,
 		title = "New SDL/OpenGL Window",
-		visible = True
+		visible = True,
+		swap_interval = SWAP_INTERVAL_VSYNC,
+		event_queue_capacity = EVENT_QUEUE_CAPACITY,
+		event_queue_overflow = EVENT_QUEUE_OVERFLOW,
+		lazy_events = False,
+		queue_events = True
 	):
 		"""
 			Initializes a window. If necessary initializes a the SDL context.
@@ -367,11 +760,22 @@ class AppWindow():
 			h:			height
 			title:		title
 			visiblle:	whether or not the window should be visible on initializtion
+			swap_interval:	one of the SWAP_INTERVAL_* modes. See set_swap_interval()
+			event_queue_capacity:	maximum number of undrained events this window holds
+			event_queue_overflow:	QUEUE_OVERFLOW_* policy applied once the queue is full
+			lazy_events:			queue EventView objects over the raw event ring instead
+									of decoded Event objects. See EventView for the caveats
+			queue_events:			whether events with no handler (see add_event_handler())
+									are queued for pop_events(). When False they are discarded
+									before being decoded
 		"""
 
 		self.sdl_window = None
 		self.sdl_winid = None
 		self.gl_context = None;
+		self.event_queue = None
+		# (event_class, callback) pairs, in registration order
+		self.event_handlers = []
 
 		global window_count
 		
@@ -384,10 +788,13 @@ class AppWindow():
 				if (SDL_GL_SetAttribute(sdl2.__dict__[att_name], att_value) != 0):
 					raise SDLException("Error setting SDL attribute `%s` to %d: %s" % (att_name, att_value, SDL_GetError()))
 
+			apply_event_subscriptions()
+
 
 
 		self.sdl_window = SDL_CreateWindow(
-			title,
+			# SDL takes UTF-8 bytes
+			(title.encode("utf-8") if isinstance(title, str) else title),
 			SDL_WINDOWPOS_CENTERED,
 			SDL_WINDOWPOS_CENTERED,
 			w, h,
@@ -418,11 +825,26 @@ class AppWindow():
 			raise SDLException("Unable to set OpenGL context #%d as the current one for window `%s`: %s" % (self.gl_context, self.sdl_window, SDL_GetError()));
 
 
-		if (SDL_GL_SetSwapInterval(1)):
+		self.swap_interval = None
+		try:
+			self.set_swap_interval(swap_interval)
+		except SDLException:
 			SDL_GL_DeleteContext(self.gl_context)
 			SDL_DestroyWindow(self.sdl_window);
 			self.sdl_winid = None
-			raise SDLException("Unable to set GL swap interval: %s" % (SDL_GetError()))
+			window_count -= 1;
+			raise
+
+
+		# the queue only exists once the window is fully usable, so that
+		# events for half-initialized windows are treated as orphans
+		if (queue_events):
+			self.event_queue = EventQueue(
+				capacity = event_queue_capacity,
+				overflow = event_queue_overflow,
+				lazy = lazy_events
+			)
+			windows_events[self.sdl_winid] = self.event_queue
 
 
 	def __del__(self):
@@ -432,10 +854,9 @@ class AppWindow():
 		global window_count
 		global windows_events;
 
-		try:
-			del(windows_events[self.sdl_winid])
-		except:
-			pass
+		windows_events.pop(self.sdl_winid, None)
+		for (event_class, callback) in list(self.event_handlers):
+			self.remove_event_handler(event_class, callback)
 		SDL_GL_DeleteContext(self.gl_context)
 		SDL_DestroyWindow(self.sdl_window)
 		window_count -= 1
@@ -443,29 +864,20 @@ class AppWindow():
 		logger.debug("Window count decreased to %d", (window_count))
 
 
+	@profiler.profiled("uio.pop_events")
 	def pop_events(self, limit = 0, retain = False):
 		"""
-			Returns up to `limit` events from the object internal queue.
-			Deletes the retrieved objects unless `retain` evaluates to True
+			Returns up to `limit` events from the window's queue (all of them if limit <= 0).
+			Deletes the retrieved objects unless `retain` evaluates to True.
+			Popped events can be handed to release_events() once processed
 		"""
-		# we need to scroll to get events selectively
-		global polled_sdl_events;
-		global event_counter;
-		global windows_events;
-
 		poll_events()
 
-		pop_out = [];
-		# there MUST be a more efficient and idiomatic way to do this,
-		# but I'd rather not return a generator
-		if self.sdl_winid in windows_events:
-			for eid in list(windows_events[self.sdl_winid][:(limit if (limit > 0) else len(windows_events[self.sdl_winid]))]):
-				pop_out.append(polled_sdl_events[eid][1])
-				if (not retain):
-					windows_events[self.sdl_winid].remove(eid)
-					del(polled_sdl_events[eid])
-		
-		return pop_out
+		if (self.event_queue is None):
+			return []
+		if (retain):
+			return self.event_queue.peek(limit)
+		return self.event_queue.pop(limit)
 
 	@property
 	def polled_events(self):
@@ -473,10 +885,58 @@ class AppWindow():
 			Simply show the whole event list as a property.
 			Sidesteps the popping mechanism and is therefore much faster
 		"""
+		return (self.event_queue.peek() if (self.event_queue is not None) else [])
+
+	@property
+	def events_dropped(self):
+		""" Number of events this window lost to queue overflow """
+		return (self.event_queue.dropped if (self.event_queue is not None) else 0)
+
+
+	def add_event_handler(self, event_class, callback):
+		"""
+			Has poll_events() call `callback(event)` for every event of `event_class`
+			(subclasses included) occurring on this window.
+			Dispatched events are consumed by their handlers and not queued.
+			The relevant SDL event types are subscribed to as a side effect
+
+			Arguments:
+				event_class:		one of the Event classes
+				callback:			callable taking the event object. When pool_events is set
+									the object is recycled as soon as the callbacks return
+		"""
+		e_keys = event_class_keys(event_class)
+		if (not e_keys):
+			raise ValueError("No SDL event decodes into %s" % (event_class.__name__))
+
+		for (e_type, e_subtype) in e_keys:
+			h_key = (self.sdl_winid, e_type, e_subtype)
+			event_handlers[h_key] = event_handlers.get(h_key, ()) + (callback,)
+
+		subscribe_events(*set((e_type for (e_type, e_subtype) in e_keys)))
+		self.event_handlers.append((event_class, callback))
+
+
+	def remove_event_handler(self, event_class, callback):
+		"""
+			Undoes one add_event_handler() call with the same arguments
+		"""
 		try:
-			return [polled_sdl_events[eid][1] for eid in windows_events[self.sdl_winid]]
-		except KeyError:
-			return [];
+			self.event_handlers.remove((event_class, callback))
+		except ValueError:
+			raise ValueError("%s is not a handler of %s on window %d" % (callback, event_class.__name__, self.sdl_winid))
+
+		e_keys = event_class_keys(event_class)
+		for (e_type, e_subtype) in e_keys:
+			h_key = (self.sdl_winid, e_type, e_subtype)
+			callbacks = list(event_handlers[h_key])
+			callbacks.remove(callback)
+			if (callbacks):
+				event_handlers[h_key] = tuple(callbacks)
+			else:
+				del(event_handlers[h_key])
+
+		unsubscribe_events(*set((e_type for (e_type, e_subtype) in e_keys)))
 			
 
 	def get_queued_events(limit = None, pop = True):
@@ -528,6 +988,25 @@ class AppWindow():
 				)
 
 
+	def set_swap_interval(self, swap_interval):
+		"""
+			Sets the swap interval of the window's context.
+			Adaptive vsync is not available everywhere, in which case plain vsync is used
+
+			Return:
+				the swap interval actually in effect, also stored in .swap_interval
+		"""
+		if (SDL_GL_SetSwapInterval(swap_interval) != 0):
+			if (swap_interval != SWAP_INTERVAL_ADAPTIVE):
+				raise SDLException("Unable to set GL swap interval to %d: %s" % (swap_interval, SDL_GetError()))
+			logger.info("Adaptive vsync is not supported (%s). Falling back to vsync", SDL_GetError())
+			return self.set_swap_interval(SWAP_INTERVAL_VSYNC)
+
+		self.swap_interval = swap_interval
+		return swap_interval
+
+
+	@profiler.profiled("uio.frame_swap")
 	def frame_swap(self):
 		"""
 			Framebuffer swap
@@ -536,72 +1015,265 @@ class AppWindow():
 
 
 
+@profiler.profiled("uio.poll_events")
 def poll_events():
 	"""
-		Pops events from the subsystem's queue and puts them into our
-		internal one. Decodes them immediately
+		Pops events from the subsystem's queue and puts them into the
+		queue of the window they belong to. Decodes them immediately.
+
+		SDL is pumped once, then drained EVENT_BATCH_SIZE events at a time
+		with SDL_PeepEvents into the event ring, which costs one ctypes
+		round trip per batch instead of one per event.
+		Every event then goes through route_sdl_event()
+
+		Return:
+			the number of SDL events drained
 	"""
-	
-	global polled_sdl_events;
-	global event_counter;
-	global windows_events;
+	SDL_PumpEvents()
 
-	# we pump events into our internal queue first
-	event = SDL_Event()
-	while (SDL_PollEvent(ctypes.byref(event))):
-		e_obj = None
-		# resolution can be flaky. So far it is assumed that all events have a vaild .winid
+	ring_events = event_ring.events
+	ring_size = event_ring.size
 
-		if (event.type == SDL_WINDOWEVENT):
-			
-			# windows have event subtypes. We resolve the relevant ones
-			eo_type = None
-			if (event.window.event == SDL_WINDOWEVENT_CLOSE): eo_type = WindowCloseEvent
-			
-			if (eo_type is not None):
-				e_obj = eo_type(
-					event_type = event.type,
-					timestamp = event.window.timestamp,
-					window_id = event.window.windowID,
-					window_event_type = event.window.event
-				)
-		#elif (event.type in (SDL_WINDOWEVENT_RESIZED, SDL_WINDOWEVENT_SIZE_CHANGED, SDL_WINDOWEVENT_MOVED)):
-			#w_x = ctypes.c_int(); w_y = ctypes.c_int()
-			#print("Resized")
-			#SDL_GetWindowSize(main_window.sdl_window, w_x, w_y)
-		elif (event.type == SDL_MOUSEMOTION):
-			e_obj = MouseMotionEvent(
-				event_type = event.type,
-				timestamp = event.motion.timestamp,
-				window_id = event.motion.windowID,
-				mouse_id = event.motion.which,
-				buttons_mask = event.motion.state,
-				x = event.motion.x,
-				y = event.motion.y,
-				xrel = event.motion.xrel,
-				yrel = event.motion.yrel
-			)
-		elif (event.type in (SDL_KEYDOWN, SDL_KEYUP)):
-			e_obj = KeyInputEvent(
-				event_type = event.type,
-				timestamp = event.key.timestamp,
-				window_id = event.key.windowID,
-				key_code = event.key.keysym.sym,
-				unicode_cp = event.key.keysym.unicode,
-				scan_code = event.key.keysym.scancode,
-				modifiers = event.key.keysym.mod,
-				is_repeat = bool(event.key.repeat)
-			)
+	drained = 0
+	while (True):
+		(first_seq, batch_len) = event_ring.peep(EVENT_BATCH_SIZE)
 
+		for seq in range(first_seq, first_seq + batch_len):
+			route_sdl_event(ring_events[seq % ring_size], seq)
 
+		drained += batch_len
+		# a short batch at the end of the ring does not mean SDL is empty
+		if ((batch_len == 0) or ((batch_len < EVENT_BATCH_SIZE) and (event_ring.written % ring_size))):
+			flush_pending_motion()
+			return drained
 
-		if (e_obj is not None):
-			polled_sdl_events[event_counter] = (event, e_obj)
-			if e_obj.winid not in windows_events:
-				windows_events[e_obj.winid] = [event_counter]
-			else:
-				windows_events[e_obj.winid].append(event_counter)
-		else:
-			logger.info("SDL Event of type %d:%d has no handler class" % (event.type, (event.window.event if (event.type == SDL_WINDOWEVENT) else 0)))
 
-		event_counter += 1
+
+def route_sdl_event(event, seq = None):
+	"""
+		Delivers a single SDL_Event. Everything is resolved through dictionary lookups
+		keyed on (SDL type, window event sub type), whatever the number of event kinds:
+			- types with no event class are counted in unhandled_events
+			- if the window has handlers for the class, they're called with the decoded object
+			- otherwise the event goes to the window queue, if there is one. Nothing is
+			  decoded for windows without a queue, or for lazy queues (which get an EventView
+			  when the event sits in the event ring at sequence number `seq`)
+
+		The event structure is not retained, so the caller is free to reuse it
+	"""
+	global orphan_events, pending_motion, handler_events_coalesced;
+
+	e_type = event.type
+	e_subtype = (event.window.event if (e_type == SDL_WINDOWEVENT) else 0)
+
+	decoding = EVENT_CLASSES.get((e_type, e_subtype))
+	if (decoding is None):
+		unhandled_key = (e_type, e_subtype)
+		unhandled_count = unhandled_events.get(unhandled_key, 0)
+		if (unhandled_count == 0):
+			logger.info("SDL Event of type %d:%d has no handler class. Further ones will only be counted", e_type, e_subtype)
+		unhandled_events[unhandled_key] = unhandled_count + 1
+		return
+
+	# window id lives at the same offset in all window scoped SDL events
+	winid = event.window.windowID
+
+	handlers = event_handlers.get((winid, e_type, e_subtype))
+	if (handlers is not None):
+		if ((e_type == SDL_MOUSEMOTION) and coalesce_mouse_motion):
+			motion = event.motion
+			if (pending_motion is not None):
+				held = pending_motion[0]
+				if ((held.winid == winid) and (held.md_id == motion.which) and (held._buttons_mask == motion.state)):
+					held.absorb(motion.timestamp, motion.x, motion.y, motion.xrel, motion.yrel)
+					handler_events_coalesced += 1
+					return
+				flush_pending_motion()
+			pending_motion = (decoding[1](decoding[0], event), handlers)
+			return
+
+		# whatever the handlers see must come after the motion before it
+		if (pending_motion is not None):
+			flush_pending_motion()
+		e_obj = decoding[1](decoding[0], event)
+		for handler in handlers:
+			handler(e_obj)
+		if (pool_events):
+			release_events((e_obj,))
+		return
+
+	queue = windows_events.get(winid)
+	if (queue is None):
+		orphan_events += 1
+		return
+
+	if (queue.lazy and (seq is not None)):
+		queue.push(EventView(event_ring, seq))
+		return
+
+	if ((e_type == SDL_MOUSEMOTION) and coalesce_mouse_motion):
+		# the tail of the destination queue is all we need to look at: anything
+		# else queued after a motion event breaks the run, preserving order
+		motion = event.motion
+		tail = queue.last
+		if (
+			(type(tail) is MouseMotionEvent)
+		and
+			(tail.md_id == motion.which)
+		and
+			(tail._buttons_mask == motion.state)
+		):
+			tail.absorb(motion.timestamp, motion.x, motion.y, motion.xrel, motion.yrel)
+			queue.coalesced += 1
+			return
+
+	queue.push(decoding[1](decoding[0], event))
+
+
+
+def flush_pending_motion():
+	"""
+		Hands the motion event held back for coalescing, if any, to its handlers
+	"""
+	global pending_motion;
+
+	if (pending_motion is None):
+		return
+	((e_obj, handlers), pending_motion) = (pending_motion, None)
+	for handler in handlers:
+		handler(e_obj)
+	if (pool_events):
+		release_events((e_obj,))
+
+
+
+def subscribe_events(*event_types):
+	"""
+		Declares interest in the given SDL event types, enabling them in SDL
+		if nobody was subscribed to them yet. Subscriptions are reference counted
+	"""
+	for e_type in event_types:
+		e_subs = event_subscriptions.get(e_type, 0)
+		event_subscriptions[e_type] = e_subs + 1
+		if ((e_subs == 0) and SDL_WasInit(SDL_INIT_EVENTS)):
+			SDL_EventState(e_type, SDL_ENABLE)
+
+
+
+def unsubscribe_events(*event_types):
+	"""
+		Drops one subscription to each of the given SDL event types.
+		Types left without subscribers are disabled in SDL, which then discards
+		them at the source and flushes the ones already queued
+	"""
+	for e_type in event_types:
+		e_subs = event_subscriptions.get(e_type, 0)
+		if (e_subs <= 0):
+			raise ValueError("Event type %d has no subscriptions" % (e_type))
+		event_subscriptions[e_type] = e_subs - 1
+		if ((e_subs == 1) and SDL_WasInit(SDL_INIT_EVENTS)):
+			SDL_EventState(e_type, SDL_DISABLE)
+
+
+
+def apply_event_subscriptions():
+	"""
+		Brings SDL's per type event state in line with event_subscriptions.
+		Done when SDL is initialized, as subscriptions can be made before that
+	"""
+	for e_type in FILTERABLE_EVENT_TYPES:
+		SDL_EventState(e_type, (SDL_ENABLE if (event_subscriptions.get(e_type, 0) > 0) else SDL_DISABLE))
+
+
+
+def new_event(event_class, *args):
+	"""
+		Instantiates an event, recycling a released instance of the same class if there is one.
+		Takes the constructor arguments positionally
+	"""
+	pool = event_pools.get(event_class)
+	if (pool):
+		e_obj = pool.pop()
+		e_obj.__init__(*args)
+		return e_obj
+	return event_class(*args)
+
+
+
+def release_events(events):
+	"""
+		Hands events obtained from pop_events() back for reuse. Does nothing unless pool_events is set.
+		The caller must not touch the released objects afterwards: they will be
+		reinitialized in place for future events
+	"""
+	if (not pool_events):
+		return
+	for e_obj in events:
+		if (not isinstance(e_obj, Event)):
+			# views and foreign objects have nothing to recycle
+			continue
+		pool = event_pools.get(type(e_obj))
+		if (pool is None):
+			pool = event_pools[type(e_obj)] = []
+		if (len(pool) < EVENT_POOL_SIZE):
+			pool.append(e_obj)
+
+
+
+def decode_window_event(event_class, event):
+	window = event.window
+	return new_event(event_class, event.type, window.timestamp, window.windowID, window.event)
+
+def decode_mouse_motion_event(event_class, event):
+	motion = event.motion
+	return new_event(event_class,
+		event.type, motion.timestamp, motion.windowID,
+		motion.which, motion.state, motion.x, motion.y, motion.xrel, motion.yrel
+	)
+
+def decode_key_event(event_class, event):
+	key = event.key
+	keysym = key.keysym
+	return new_event(event_class,
+		event.type, key.timestamp, key.windowID,
+		keysym.sym, None, keysym.scancode, keysym.mod, bool(key.repeat)
+	)
+
+
+
+# (sdl_type, window_event_type) -> (event class, decoder function). The sub type is 0
+# for anything but SDL_WINDOWEVENT. This is the only place where SDL types meet our classes
+EVENT_CLASSES = {
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_FOCUS_GAINED):	(WindowFocusOnEvent, decode_window_event),
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_FOCUS_LOST):		(WindowFocusOffEvent, decode_window_event),
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_MINIMIZED):		(WindowMinimizeEvent, decode_window_event),
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_RESTORED):		(WindowRestoreEvent, decode_window_event),
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_MAXIMIZED):		(WindowMaximizeEvent, decode_window_event),
+	(SDL_WINDOWEVENT, SDL_WINDOWEVENT_CLOSE):			(WindowCloseEvent, decode_window_event),
+	(SDL_MOUSEMOTION, 0):								(MouseMotionEvent, decode_mouse_motion_event),
+	(SDL_KEYDOWN, 0):									(KeyInputEvent, decode_key_event),
+	(SDL_KEYUP, 0):										(KeyInputEvent, decode_key_event),
+}
+
+
+
+def event_class_keys(event_class):
+	"""
+		Return:
+			the list of (sdl_type, window_event_type) keys that decode into `event_class` or a subclass of it
+	"""
+	return [e_key for (e_key, (e_class, e_decoder)) in EVENT_CLASSES.items() if issubclass(e_class, event_class)]
+
+
+
+def decode_sdl_event(event):
+	"""
+		Builds our object representation of a raw SDL_Event
+
+		Return:
+			the Event object, or None if the type has no handler class
+	"""
+	decoding = EVENT_CLASSES.get((event.type, (event.window.event if (event.type == SDL_WINDOWEVENT) else 0)))
+	if (decoding is None):
+		return None
+	return decoding[1](decoding[0], event)
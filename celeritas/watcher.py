@@ -0,0 +1,199 @@
+#!/usr/bin/python -uB
+
+"""
+	File change notifications for Celeritas.
+	A background thread watches a set of files and collects the ones that
+	changed; the main loop picks them up with changed() whenever it suits it,
+	so nothing ever runs on the watcher thread but the bookkeeping.
+
+	On Linux inotify is used, through libc. Elsewhere (or if inotify cannot be
+	set up) the thread polls the modification times.
+	The directories are watched rather than the files, as most editors save by
+	writing a new file and renaming it over the old one
+"""
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+# seconds between modification time checks, and upper bound to how long
+# stop() takes to be noticed by the thread
+POLL_INTERVAL = 0.25
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# what makes a file count as changed
+IN_WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+
+# struct inotify_event header: wd, mask, cookie, len. The name follows
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+
+def _load_inotify():
+	"""
+		Return:
+			libc, if it has inotify, None otherwise
+	"""
+	libc_name = ctypes.util.find_library("c")
+	if (libc_name is None):
+		return None
+	try:
+		libc = ctypes.CDLL(libc_name, use_errno = True)
+		# raises AttributeError where there is no inotify
+		libc.inotify_init1
+	except (OSError, AttributeError):
+		return None
+	libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+	return libc
+
+
+
+class FileWatcher(object):
+	"""
+		Collects changes to a set of files on a background thread.
+		Paths are normalized with os.path.abspath(); changed() returns them in that form
+	"""
+	def __init__(self, poll_interval = POLL_INTERVAL, use_inotify = True):
+		"""
+			Arguments:
+				poll_interval:	see POLL_INTERVAL
+				use_inotify:	False forces modification time polling
+		"""
+		self.poll_interval = poll_interval
+		self.lock = threading.Lock()
+		# watched file -> last seen modification time (None if missing)
+		self.files = {}
+		# changed files not yet picked up
+		self.pending = set()
+
+		self.libc = (_load_inotify() if use_inotify else None)
+		self.inotify_fd = -1
+		# inotify watch descriptor -> directory, and back
+		self.watch_dirs = {}
+		self.dir_watches = {}
+		if (self.libc is not None):
+			self.inotify_fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+			if (self.inotify_fd < 0):
+				logger.warning("inotify_init1() failed: %s. Falling back to polling", os.strerror(ctypes.get_errno()))
+				self.libc = None
+
+		self.running = True
+		self.thread = threading.Thread(
+			target = (self._inotify_loop if (self.libc is not None) else self._poll_loop),
+			name = "FileWatcher"
+		)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	@property
+	def mode(self):
+		return ("inotify" if (self.libc is not None) else "poll")
+
+
+	def watch(self, path):
+		"""
+			Starts watching `path`, which need not exist yet
+		"""
+		path = os.path.abspath(path)
+		with self.lock:
+			if (path in self.files):
+				return
+			self.files[path] = self._mtime(path)
+
+		if (self.libc is not None):
+			dir_name = os.path.dirname(path)
+			if (dir_name not in self.dir_watches):
+				wd = self.libc.inotify_add_watch(self.inotify_fd, dir_name.encode(), IN_WATCH_MASK)
+				if (wd < 0):
+					logger.warning("Unable to watch `%s`: %s", dir_name, os.strerror(ctypes.get_errno()))
+					return
+				with self.lock:
+					self.watch_dirs[wd] = dir_name
+					self.dir_watches[dir_name] = wd
+
+
+	def changed(self):
+		"""
+			Return:
+				the set of watched files that changed since the last call
+		"""
+		with self.lock:
+			(changed, self.pending) = (self.pending, set())
+		return changed
+
+
+	def stop(self):
+		"""
+			Stops the thread and releases the inotify descriptor
+		"""
+		if (not self.running):
+			return
+		self.running = False
+		self.thread.join()
+		if (self.inotify_fd >= 0):
+			os.close(self.inotify_fd)
+			self.inotify_fd = -1
+
+
+	@staticmethod
+	def _mtime(path):
+		try:
+			return os.stat(path).st_mtime
+		except OSError:
+			return None
+
+
+	def _inotify_loop(self):
+		while (self.running):
+			(readable, writable, failed) = select.select((self.inotify_fd, ), (), (), self.poll_interval)
+			if (not readable):
+				continue
+			try:
+				buf = os.read(self.inotify_fd, 65536)
+			except OSError as e_read:
+				if (e_read.errno == errno.EAGAIN):
+					continue
+				raise
+
+			offset = 0
+			with self.lock:
+				while (offset < len(buf)):
+					(wd, mask, cookie, name_len) = INOTIFY_EVENT.unpack_from(buf, offset)
+					offset += INOTIFY_EVENT.size
+					# the name is NUL padded
+					name = buf[offset:(offset + name_len)].rstrip(b"\0").decode(errors = "replace")
+					offset += name_len
+					dir_name = self.watch_dirs.get(wd)
+					if (dir_name is not None):
+						path = os.path.join(dir_name, name)
+						if (path in self.files):
+							self.pending.add(path)
+
+
+	def _poll_loop(self):
+		while (self.running):
+			with self.lock:
+				paths = list(self.files)
+			for path in paths:
+				mtime = self._mtime(path)
+				with self.lock:
+					if (mtime != self.files[path]):
+						self.files[path] = mtime
+						self.pending.add(path)
+			time.sleep(self.poll_interval)
@@ -0,0 +1,21 @@
+#version 450 core
+
+uniform vec4 obj_rgba;
+// per-frame data, shared by every program
+layout (std140, binding = 0) uniform frame_data {
+	vec2 crosshair_position;
+	float time;
+};
+
+out vec4 color;
+
+float distance;
+
+void main()	{
+	distance = pow(pow(abs(crosshair_position.x), 2.0) + pow(abs(crosshair_position.y), 2.0), 0.5) / 1.414213562;
+	//distance = (abs.crosshair_position.x ** 2);
+	//color = obj_rgba;
+	color = vec4(1.0, 1.0, 1.0, 1.0);
+	color = vec4((1 - distance), distance, 0.0, obj_rgba.w);
+	//color = vec4((1 - abs(crosshair_position.x)), (1 - abs(crosshair_position.x)), abs(crosshair_position.x), 1.0);
+}
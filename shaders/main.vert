@@ -0,0 +1,18 @@
+#version 450 core
+layout (location = 0) in vec3 vertex_offset;
+
+// per-frame data, shared by every program
+layout (std140, binding = 0) uniform frame_data {
+	vec2 crosshair_position;
+	float time;
+};
+
+
+void main() {
+	gl_Position = vec4(
+		crosshair_position.x + (vertex_offset.x * (1.0 - abs(crosshair_position.x))),
+		crosshair_position.y + (vertex_offset.y * (1.0 - abs(crosshair_position.y))),
+		vertex_offset.z,
+		1.0
+	);
+}